@@ -80,6 +80,18 @@ int general_work(int noutput, gr_vector_int& ninput_items,
 
 			int psdu_length = pmt::blob_length(pmt::cdr(msg));
 
+			// per-PDU encoding, if given, overrides the block setting for this frame
+			ofdm_param ofdm = d_ofdm;
+			pmt::pmt_t pdu_encoding = pmt::dict_ref(pmt::car(msg), pmt::mp("encoding"), pmt::PMT_NIL);
+			if (pmt::is_integer(pdu_encoding)) {
+				long e = pmt::to_long(pdu_encoding);
+				if (e >= BPSK_1_2 && e <= QAM64_3_4) {
+					ofdm = ofdm_param((Encoding)e);
+				} else {
+					std::cout << "MAPPER: invalid PDU encoding " << e << ", using " << d_ofdm.encoding << std::endl;
+				}
+			}
+
 			// check if crc was already included
 			pmt::pmt_t crc_included = pmt::dict_ref(pmt::car(msg), pmt::mp("crc_included"), pmt::PMT_T);
 			if (pmt::eq(crc_included, pmt::PMT_F)) {
@@ -101,7 +113,7 @@ int general_work(int noutput, gr_vector_int& ninput_items,
             }
 
 			// ############ INSERT MAC STUFF
-			frame_param frame(d_ofdm, psdu_length);
+			frame_param frame(ofdm, psdu_length);
 			if(frame.n_sym > MAX_SYM) {
 				std::cout << "packet too large, maximum number of symbols is " << MAX_SYM << std::endl;
 				return 0;
@@ -113,7 +125,7 @@ int general_work(int noutput, gr_vector_int& ninput_items,
 			char *encoded_data     = (char*)calloc(frame.n_data_bits * 2, sizeof(char));
 			char *punctured_data   = (char*)calloc(frame.n_encoded_bits, sizeof(char));
 			char *interleaved_data = (char*)calloc(frame.n_encoded_bits, sizeof(char));
-			char *symbols          = (char*)calloc((frame.n_encoded_bits / d_ofdm.n_bpsc), sizeof(char));
+			char *symbols          = (char*)calloc((frame.n_encoded_bits / ofdm.n_bpsc), sizeof(char));
 
 			//generate the WIFI data field, adding service field and pad bits
 			generate_bits(psdu, data_bits, frame);
@@ -129,14 +141,14 @@ int general_work(int noutput, gr_vector_int& ninput_items,
 			// encoding
 			convolutional_encoding(scrambled_data, encoded_data, frame);
 			// puncturing
-			puncturing(encoded_data, punctured_data, frame, d_ofdm);
+			puncturing(encoded_data, punctured_data, frame, ofdm);
 			//std::cout << "punctured" << std::endl;
 			// interleaving
-			interleave(punctured_data, interleaved_data, frame, d_ofdm);
+			interleave(punctured_data, interleaved_data, frame, ofdm);
 			//std::cout << "interleaved" << std::endl;
 
 			// one byte per symbol
-			split_symbols(interleaved_data, symbols, frame, d_ofdm);
+			split_symbols(interleaved_data, symbols, frame, ofdm);
 
 			d_symbols_len = frame.n_sym * 48;
 
@@ -154,7 +166,7 @@ int general_work(int noutput, gr_vector_int& ninput_items,
 			add_item_tag(0, nitems_written(0), pmt::mp("psdu_len"),
 					psdu_bytes, srcid);
 
-			pmt::pmt_t encoding = pmt::from_long(d_ofdm.encoding);
+			pmt::pmt_t encoding = pmt::from_long(ofdm.encoding);
 			add_item_tag(0, nitems_written(0), pmt::mp("encoding"),
 					encoding, srcid);
 
@@ -45,13 +45,14 @@
 #	Dr. Javier Gozalvez (j.gozalvez@umh.es)
 
 
-import pickle
 import socket
 import time
 from optparse import OptionParser
 
 from gnuradio.eng_option import eng_option
 
+import uwicore_mpif as plcp
+
 # Beacon packet generator main
 if __name__ == '__main__':
 
@@ -79,7 +80,6 @@ if __name__ == '__main__':
         s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         s.connect((socket.gethostname(), 8001))
         pkt = create_packet("BEACON", "[beacon packet]")  # FIXME Update the Beacon header with the correct BI value
-        packet = pickle.dumps(pkt, 1)
-        s.send(packet)
+        plcp.send_to_mac(s, pkt)
         s.close()
         time.sleep(options.BI)
@@ -0,0 +1,60 @@
+"""
+Microbenchmark script for the PDU construction of wifi_transceiver.send_pkt: one u8vector_set
+per byte (the former code) against a single init_u8vector call. No results are recorded here,
+run it on a node with GNU Radio to compare both on that host.
+Usage: python bench_send_pkt.py [iterations]
+"""
+import sys
+import time
+
+import pmt
+
+
+def pdu_per_byte(pkt):
+    """
+    PDU construction of send_pkt before: one u8vector_set per byte
+    """
+    crc_dict = pmt.make_dict()
+    crc_dict = pmt.dict_add(crc_dict, pmt.string_to_symbol("crc_included"), pmt.PMT_F)
+
+    p = pmt.make_u8vector(len(pkt), 0)
+    pkt1 = bytearray(pkt)
+    for i in range(len(pkt1)):
+        pmt.u8vector_set(p, i, pkt1[i])
+    return pmt.cons(crc_dict, p)
+
+
+TX_META = pmt.dict_add(pmt.dict_add(pmt.make_dict(), pmt.string_to_symbol("crc_included"), pmt.PMT_F),
+                       pmt.string_to_symbol("encoding"), pmt.from_long(0))
+
+
+def pdu_single_call(pkt):
+    """
+    PDU construction of send_pkt now: the u8vector is built at once, the metadata is shared
+    """
+    return pmt.cons(TX_META, pmt.init_u8vector(len(pkt), bytearray(pkt)))
+
+
+def measure(build, pkt, iterations):
+    """
+    :return: mean and 99th percentile latency (us)
+    """
+    latency = []
+    for _ in range(iterations):
+        t_start = time.perf_counter()
+        build(pkt)
+        latency.append(time.perf_counter() - t_start)
+    latency.sort()
+    return sum(latency) / iterations * 1e6, latency[int(iterations * 0.99)] * 1e6
+
+
+if __name__ == '__main__':
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+
+    for length in (10, 16, 100, 1500, 2304):  # ACK/CTS, RTS, short DATA, MTU-size DATA, maximum MPDU
+        pkt = bytes(i & 0xff for i in range(length))
+        assert pmt.equal(pmt.cdr(pdu_per_byte(pkt)), pmt.cdr(pdu_single_call(pkt)))
+        before = measure(pdu_per_byte, pkt, iterations)
+        after = measure(pdu_single_call, pkt, iterations)
+        print("%4d bytes: before %8.1f us (p99 %8.1f)  after %6.1f us (p99 %6.1f)  x%.0f" % (
+            length, before[0], before[1], after[0], after[1], before[0] / after[0]))
@@ -48,7 +48,10 @@
 #   Dr. Javier Gozalvez (j.gozalvez@umh.es)
 
 
-import pickle
+import threading
+from collections import deque
+
+import uwicore_mpif as plcp
 
 
 class Buffer:
@@ -128,17 +131,111 @@ class Buffer:
         return True, found
 
 
+class PeerQueues:
+    """
+    TX buffer with one FIFO queue per destination MAC address (None for packets without destination).
+    head() hands out the packet to send and keeps handing it out until remove(), so the MAC retries the
+    same packet; after remove() the scheduler moves to the next destination. A peer that stops answering
+    costs its own turns only (the MAC drops its packet after the retries), not the queues of the others.
+    Scheduling between the destinations with packets:
+        "rr": round-robin, one packet per turn
+        "drr": deficit round-robin, quantum bytes per turn, so that peers share the air time by bytes
+    :param scheduling: "rr" or "drr"
+    :param quantum: bytes credited to a destination per turn (drr)
+    """
+
+    def __init__(self, scheduling="rr", quantum=1500):
+        assert scheduling in ("rr", "drr"), "Invalid scheduling %s" % scheduling
+        self.scheduling = scheduling
+        self.quantum = quantum
+        self.queues = {}  # destination -> deque of packets
+        self.active = deque()  # destinations with packets, the one being served first
+        self.deficit = {}  # bytes each destination may still send in its turn (drr)
+        self.credited = False  # the destination being served got its quantum for this turn
+        self.handed_out = False  # the head packet of active[0] was handed out, until remove()
+        self.lock = threading.Lock()
+
+    def push(self, dest, element):  # insert an element at the tail of the queue of dest
+        with self.lock:
+            queue = self.queues.get(dest)
+            if queue is None:
+                queue = self.queues[dest] = deque()
+                self.deficit[dest] = 0
+            if not queue:
+                self.active.append(dest)
+            queue.append(element)
+
+    def head(self):
+        """
+        Packet to send now
+        :return: (destination, packet), None if the buffer is empty
+        """
+        with self.lock:
+            if not self.handed_out:
+                if not self._select():
+                    return None
+                self.handed_out = True
+            dest = self.active[0]
+            return dest, self.queues[dest][0]
+
+    def remove(self):
+        """
+        Remove the packet handed out by head() (sent, or dropped by the MAC)
+        :return: (destination, packet), None if no packet was handed out
+        """
+        with self.lock:
+            if not self.handed_out:
+                return None
+            self.handed_out = False
+            dest = self.active[0]
+            queue = self.queues[dest]
+            element = queue.popleft()
+            if self.scheduling == "drr":
+                self.deficit[dest] -= len(element)
+            if not queue:  # Leaves the round, an empty queue keeps no credit
+                self.active.popleft()
+                self.deficit[dest] = 0
+                self.credited = False
+            elif self.scheduling == "rr":
+                self.active.rotate(-1)
+            return dest, element
+
+    def _select(self):
+        """
+        Bring the destination to serve next to the front of active (lock held)
+        :return: False if every queue is empty
+        """
+        while self.active:
+            dest = self.active[0]
+            if self.scheduling == "rr":
+                return True
+            if not self.credited:
+                self.deficit[dest] += self.quantum
+                self.credited = True
+            if len(self.queues[dest][0]) <= self.deficit[dest]:
+                return True
+            self.active.rotate(-1)  # Not enough credit left: next destination, this one keeps the rest
+            self.credited = False
+        return False
+
+    def isEmpty(self):
+        return self.length() == 0
+
+    def length(self):
+        return sum(len(queue) for queue in list(self.queues.values()))
+
+    def lengths(self):  # packets queued per destination
+        return dict((dest, len(queue)) for dest, queue in list(self.queues.items()) if queue)
+
+
 def create_packet(header, data):  # create a packet for cross-layer messaging
     packet = {"HEADER": header, "DATA": data}
     return packet
 
 
 def send_to_mac(datos, sd):  # send data to MAC layer
-    pkt = pickle.dumps(datos, 1)
-    sd.send(pkt)
+    plcp.send_to_mac(sd, datos)
 
 
 def receive_from_mac(sd):  # receive data from MAC
-    pkt = sd.recv(1000)
-    info = pickle.loads(pkt)
-    return info
+    return plcp.receive_from_mac(sd)
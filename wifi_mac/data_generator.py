@@ -1,9 +1,8 @@
-import pickle
 import socket
 import time
 import random
 from threading import Thread
-from buffer_lib import Buffer as buffer
+from buffer_lib import Buffer as buffer, PeerQueues
 import uwicore_mpif as plcp
 import logging
 
@@ -14,10 +13,12 @@ class UlBuffer:
     '''
     This class is used to create a buffer for upper layer traffic generator.
     the client class is used to handle multiple packet arrival (from PHY traffic generator or from MAC).
+    the TX buffer keeps one queue per destination (see buffer_lib.PeerQueues), served by
+    round-robin ("rr") or deficit round-robin ("drr", quantum in bytes).
     '''
-    def __init__(self, MACport=8001):
+    def __init__(self, MACport=8001, scheduling="rr", quantum=1500):
         self.MACport = MACport
-        self.cs = buffer()
+        self.cs = PeerQueues(scheduling, quantum)
         self.cs2 = buffer()
         self.server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         self.server.bind((socket.gethostname(), self.MACport))
@@ -34,12 +35,15 @@ class UlTraffic:
     This class is used to create a traffic generator for upper layer.
     it sends a packet to MAC layer every interval seconds.
     then it waits for interval seconds and sends another packet.
-    the pickle library is used to serialize the packet.
+    the packet is serialized with the framed crosslayer format of uwicore_mpif.
+    with peers (MAC addresses), each packet goes to a random peer ("PAYLOAD_TO"),
+    otherwise to the destination configured in the MAC ("PAYLOAD").
     '''
-    def __init__(self, MACport=8001, pkt_num=50, interval=0.05):
+    def __init__(self, MACport=8001, pkt_num=50, interval=0.05, peers=None):
         self.MACport = MACport
         self.pkt_num = pkt_num
         self.interval = interval
+        self.peers = peers
 
     def run(self):
         while self.pkt_num > 0:
@@ -48,10 +52,12 @@ class UlTraffic:
             s.connect((socket.gethostname(), self.MACport))
 
             num = random.randint(0, 3)
-            pkt = self.create_packet("PAYLOAD", f"TEST_{num + 1}")
+            if self.peers:
+                pkt = self.create_packet("PAYLOAD_TO", random.choice(self.peers) + f"TEST_{num + 1}".encode())
+            else:
+                pkt = self.create_packet("PAYLOAD", f"TEST_{num + 1}")
 
-            packet = pickle.dumps(pkt, 1)
-            s.send(packet)
+            plcp.send_to_mac(s, pkt)
             s.close()
             time.sleep(self.interval)
 
@@ -76,46 +82,63 @@ class Client(Thread):
         self.print_buffer = print_buffer
 
     def run(self):
-        BUFFER_FULL_RESPONSE = b"BUFFER_FULL"
-        pkt = self.socket.recv(1000)
-        arrived_packet = pickle.loads(pkt)
-
+        # The MAC keeps its connection open (asyncio engine, see mac_async.UlBufferStream) or
+        # opens one per request: serve every message until the connection is closed
+        reader = plcp.MessageReader(self.socket)
+        try:
+            arrived_packet = reader.read()
+            while arrived_packet is not None:
+                self.handle(arrived_packet)
+                arrived_packet = reader.read()
+        except (ConnectionError, OSError):
+            pass
+        finally:
+            self.socket.close()
+
+    def handle(self, arrived_packet):
         if "no_packet" == arrived_packet["HEADER"]:
-            if self.cs.isEmpty():
+            head = self.cs.head()
+            if head is None:
                 x = plcp.create_packet("NO", "")
-                plcp.send_to_mac(self.socket, x)
+                plcp.send_to_mac(self.socket, x, arrived_packet["ID"])
                 return
 
-            self.cs.elements.reverse()
-            if self.cs.read(0) == "[beacon packet]":
+            dest, payload = head
+            if payload == b"[beacon packet]":
                 x = plcp.create_packet("BEACON", "")
                 logging.info("Buffer has BEACON to send.")
-            else:
-                x = plcp.create_packet("YES", self.cs.read(0))
+            elif dest is None:  # the MAC sends it to its configured destination
+                x = plcp.create_packet("YES", payload)
                 logging.info("Buffer has a DATA to send.")
-            self.cs.elements.reverse()
-            plcp.send_to_mac(self.socket, x)
+            else:
+                x = plcp.create_packet("PAYLOAD_TO", dest + payload)
+                logging.info("Buffer has a DATA to send to %s.", dest.hex(":"))
+            plcp.send_to_mac(self.socket, x, arrived_packet["ID"])
 
             return
 
         if "remove" == arrived_packet["HEADER"]:
             logging.info("Upper buffer is set to remove a packet.")
-            self.cs.elements.pop()
+            self.cs.remove()
 
         elif "copy" == arrived_packet["HEADER"]:
             self.cs2.push(arrived_packet["DATA"])
 
         elif arrived_packet["HEADER"] == "PAYLOAD":
-            self.cs.push(arrived_packet["DATA"])
+            self.cs.push(None, arrived_packet["DATA"])
+
+        elif arrived_packet["HEADER"] == "PAYLOAD_TO":  # packet for a given peer
+            data = arrived_packet["DATA"]
+            self.cs.push(data[:plcp.PEER_ADDR_LEN], data[plcp.PEER_ADDR_LEN:])
 
         elif "BEACON" == arrived_packet["HEADER"]:
             logging.info("Buffer receives a BEACON from upper layer.")
-            self.cs.push(arrived_packet["DATA"])
+            self.cs.push(None, arrived_packet["DATA"])
 
         if self.print_buffer:
             logging.info("== Statistics %s ==", time.time())
             logging.info("========== TX Buffer ============")
-            logging.info(self.cs.elements)
+            logging.info(self.cs.lengths())
             logging.info("========== RX Buffer ============")
             logging.info(self.cs2.elements)
         else:
@@ -123,8 +146,13 @@ class Client(Thread):
 
 
 
-def run_ul_buffer():
-    ul_buffer = UlBuffer()
+def run_ul_buffer(options=None):
+    """
+    :param options: MAC options (mac_config.yaml), for the 'MACport' of the buffer and the
+                    'scheduling' ("rr" or "drr") and 'quantum' (bytes) of its TX queues
+    """
+    options = options or {}
+    ul_buffer = UlBuffer(options.get('MACport', 8001), options.get('scheduling', "rr"), options.get('quantum', 1500))
     ul_buffer.run()
 
 def run_ul_traffic():
@@ -0,0 +1,290 @@
+import asyncio
+import socket
+
+import uwicore_mac_utils as mac
+import uwicore_mpif as plcp
+from mac_dcf import DcfLogic, print_msg
+from mac_fsm import MacState, StateMachine
+
+
+class UlBufferStream:
+    """
+    Connection of a station to its upper layer buffer (data_generator.UlBuffer) on asyncio streams.
+    One connection is opened for the whole run instead of one per request (see read_ul_buffer):
+    reading the buffer is awaited, remove and copy orders are queued on the stream without
+    waiting, and all of them reach the buffer in order.
+    :param port: socket port of the buffer (MACport)
+    """
+
+    def __init__(self, port):
+        self.port = port
+        self.reader = None
+        self.writer = None
+
+    async def open(self):
+        self.reader, self.writer = await asyncio.open_connection(socket.gethostname(), self.port)
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+
+    async def read(self):
+        """
+        Check the buffer for packets to send
+        :return: status, payload and destination, see uwicore_mac_utils.read_ul_buffer
+        """
+        self.send(mac.create_packet("no_packet", ""))
+        await self.writer.drain()
+        reading = await plcp.read_message(self.reader)
+        if reading is None:
+            raise ConnectionError("Upper layer buffer closed the connection on port %d" % self.port)
+        return mac.ul_buffer_status(reading)
+
+    def send(self, pkt):
+        self.writer.write(plcp.encode_message(pkt))
+
+
+class AsyncDcf(DcfLogic):
+    """
+    DCF + RTS/CTS state machine of one station, driven by an asyncio event loop (engine: asyncio).
+    Each MacState has a coroutine handler named after it that returns the next state (see mac_fsm);
+    the handlers wait and talk to the PHY, the transitions themselves are the ones of mac_dcf.DcfLogic.
+    CTS, DATA, ACK and NAV timeouts are absolute deadlines on the loop clock (loop.call_at), and
+    frames pushed by a subscribed PhyTransport wake the waiting state at once instead of on the
+    next slot boundary.
+    Nothing blocks the loop while waiting for an answer: TAIL and CCA requests are awaited
+    (PhyTransport.request_async) and the upper layer buffer is read on a persistent stream
+    (UlBufferStream). Frames to transmit are still written to the PHY socket directly, which only
+    blocks if the socket buffer is full, and with an unsubscribed TCP / Unix transport each
+    request in flight holds an executor thread.
+    Several stations can share one loop, see run_stations().
+    :param options: MAC options (mac_config.yaml)
+    :param phy: open PhyTransport
+    :param node: node ID
+    :param t_sym: OFDM symbol duration (s)
+    """
+
+    def __init__(self, options, phy, node, t_sym):
+        self._init_dcf(options, node, t_sym)
+        self.phy = phy
+        self.cca_history = mac.has_cca_history(phy)  # CCA over whole intervals, see wait_for_difs, backing_off
+        self.t_frame_timeout = max(self.SIFS, self.tslot)  # ACK of a fragment, DATA after a CTS
+
+        self.nav_until = 0  # End of the Network Allocation Vector (loop time)
+        self.deadline = 0  # End of the current CTS / ACK / DATA timeout (loop time)
+
+        self.ul_buffer = UlBufferStream(self.mac_port)
+        self.fsm = StateMachine(self)
+        self.loop = None
+        self._wake = None
+        self._wake_on = ()
+        self.running = True
+
+    async def run(self):
+        """
+        Run the state machine on the current event loop until stop() is called
+        """
+        self.loop = asyncio.get_running_loop()
+        self._wake = asyncio.Event()
+        await self.ul_buffer.open()
+        self.phy.add_listener(self._on_frame)
+        try:
+            while self.running:
+                await self.fsm.step_async()
+        finally:
+            self.phy.remove_listener(self._on_frame)
+            self.ul_buffer.close()
+
+    def stop(self):
+        self.running = False
+        if self._wake is not None:
+            self.loop.call_soon_threadsafe(self._wake.set)
+
+    def _on_frame(self, header):
+        """
+        PhyTransport listener, runs in the thread that receives the frame
+        """
+        if header in self._wake_on:
+            self.loop.call_soon_threadsafe(self._wake.set)
+
+    async def _wait(self, deadline, headers=()):
+        """
+        Sleep until a deadline of the loop clock
+        :param deadline: absolute time (loop.time())
+        :param headers: received frame types that end the sleep early
+        :return: none
+        """
+        if headers and not self.phy.subscribed:  # Frames are only seen by polling the PHY once per slot
+            deadline = min(deadline, self.loop.time() + self.tslot)
+        if deadline <= self.loop.time():
+            return
+        if not headers or not self.phy.subscribed:
+            await asyncio.sleep(deadline - self.loop.time())
+            return
+
+        self._wake.clear()
+        self._wake_on = headers
+        if self.phy.wait_frame(headers, 0):  # Pushed before _wake_on was set
+            self._wake_on = ()
+            return
+        timer = self.loop.call_at(deadline, self._wake.set)
+        try:
+            await self._wake.wait()
+        finally:
+            timer.cancel()
+            self._wake_on = ()
+
+    def _set_nav(self, duration):
+        self.nav_until = max(self.nav_until, self.loop.time() + duration)
+
+    def _send(self, header, values, encoding):
+        packet = mac.generate_pkt(header, self.t_sym, encoding, values)
+        mac.send_wo_response(mac.create_packet("PKT", packet), self.phy)
+
+    def _ul_remove(self):
+        self.ul_buffer.send(mac.create_packet("remove", ""))
+
+    def _ul_deliver(self, payload):
+        self.ul_buffer.send(mac.create_packet("copy", payload))
+
+    async def idle(self):
+        reply_phy, rts_pkt = await mac.read_phy_response_async(self.phy, "RTS")
+        if reply_phy == "YES":  # RTS received
+            next_state = self._rts_received(rts_pkt)
+            if next_state != MacState.IDLE:
+                return next_state
+        else:
+            reply_phy, data_pkt = await mac.read_phy_response_async(self.phy, "DATA")  # Check if DATA frame received
+            if reply_phy == "YES":
+                return self._data_received(data_pkt)
+
+            next_state = self._ul_buffer_read(*await self.ul_buffer.read())  # Upper layer data to send?
+            if next_state is not None:
+                return next_state
+
+            reply_phy, cts_pkt = await mac.read_phy_response_async(self.phy, "CTS")
+            if reply_phy == "YES":
+                self._cts_overheard(cts_pkt)
+
+        await self._wait(self.loop.time() + self.tslot, ("RTS", "DATA", "CTS"))  # Time-slotted MAC
+        return MacState.IDLE
+
+    async def wait_for_nav(self):
+        await self._wait(self.nav_until)
+        self.chan_busy = False
+        return self._trans("NAV = 0", MacState.WAIT_FOR_DIFS)
+
+    async def wait_for_difs(self):
+        t_start = self.loop.time()
+        if self.cca_history:  # Sense the whole DIFS at once, from the power history of the PHY
+            await self._wait(t_start + self.DIFS)
+            channel_status, busy, sig_power = mac.sense_window(self.phy, int(t_start * 1e9),
+                                                               int((t_start + self.DIFS) * 1e9))
+            print_msg("Channel is %s (%5.2f dBw, busy %3.0f%%)......" % (channel_status, sig_power, busy * 100),
+                      self.node, self.print_chan_sense)
+            if channel_status == "OCCUPIED":
+                self.chan_busy = True
+        else:  # Sense the channel at the two slot boundaries of the DIFS
+            for n_sensing in range(2):
+                channel_status, t, sig_power = await mac.sense_channel_async(self.phy)
+                print_msg("Channel is %s (%5.2f dBw)......" % (channel_status, sig_power), self.node,
+                          self.print_chan_sense)
+                if channel_status == "OCCUPIED":
+                    self.chan_busy = True
+                await self._wait(t_start + (n_sensing + 1) * self.tslot)
+            await self._wait(t_start + self.DIFS)
+        return self._difs_sensed()
+
+    async def backing_off(self):
+        next_state = self._backoff_done()
+        if next_state is not None:
+            return next_state
+
+        t_slot_start = self.loop.time()
+        if self.cca_history:  # The slot is idle only if the channel stayed idle during the whole slot
+            await self._wait(t_slot_start + self.tslot)
+            channel_status, busy, sig_power = mac.sense_window(self.phy, int(t_slot_start * 1e9),
+                                                               int((t_slot_start + self.tslot) * 1e9))
+        else:  # Sample the channel at the start of the slot
+            channel_status, t, sig_power = await mac.sense_channel_async(self.phy)
+        print_msg("Channel is %s (%5.2f dBw)......" % (channel_status, sig_power), self.node, self.print_chan_sense)
+        next_state = self._backoff_slot(channel_status)
+        if not self.cca_history:
+            await self._wait(t_slot_start + self.tslot)
+        return next_state
+
+    async def transmitting_rts(self):
+        next_state = self._transmit_rts()
+        if next_state == MacState.WAITING_FOR_CTS:
+            self.deadline = self.loop.time() + self.SIFS
+        return next_state
+
+    async def transmitting_unicast(self):
+        next_state = self._transmit_unicast()
+        if next_state == MacState.WAITING_FOR_ACK:
+            self.deadline = self.loop.time() + self.t_ack_timeout
+        return next_state
+
+    async def waiting_for_cts(self):
+        while True:
+            reply_phy, cts_pkt = await mac.read_phy_response_async(self.phy, "CTS")
+            if reply_phy == "YES":
+                return self._cts_received(cts_pkt)
+            if self.loop.time() >= self.deadline:  # Timer expired and CTS hasn't been received
+                return self._cts_timeout()
+            await self._wait(self.deadline, ("CTS",))
+
+    async def transmitting_fragmented_packet(self):
+        next_state = self._transmit_fragment()
+        self.deadline = self.loop.time() + self.t_frame_timeout
+        return next_state
+
+    async def wait_ack_fragmented(self):
+        while True:
+            reply_phy, ack_pkt = await mac.read_phy_response_async(self.phy, "ACK")
+            if reply_phy == "YES":  # ACK addressed to this station
+                return self._fragment_acked(ack_pkt)
+            if self.loop.time() >= self.deadline:
+                return self._fragment_timeout()
+            await self._wait(self.deadline, ("ACK",))
+
+    async def waiting_for_ack(self):
+        while True:
+            reply_phy, ack_pkt = await mac.read_phy_response_async(self.phy, "ACK")
+            if reply_phy == "YES":
+                return self._acked(ack_pkt)
+            if self.loop.time() >= self.deadline:  # Doesn't received ACK during the time window
+                return self._ack_timeout()
+            await self._wait(self.deadline, ("ACK",))
+
+    async def transmitting_cts(self):
+        await self._wait(self.nav_until)  # NAV allows channel access
+        next_state = self._transmit_cts()
+        self.deadline = self.loop.time() + self.t_frame_timeout
+        return next_state
+
+    async def waiting_for_data(self):
+        while True:
+            reply_phy, data_pkt = await mac.read_phy_response_async(self.phy, "DATA")
+            if reply_phy == "YES":
+                return self._receive_data(data_pkt)
+            if self.loop.time() >= self.deadline:  # DATA didn't arrive
+                return self._data_timeout()
+            await self._wait(self.deadline, ("DATA",))
+
+    async def tx_ack_fg(self):
+        next_state = self._transmit_ack(MacState.WAITING_FOR_DATA)
+        self.deadline = self.loop.time() + self.t_frame_timeout  # Wait for the next fragment
+        return next_state
+
+    async def transmitting_ack(self):
+        return self._transmit_ack(MacState.IDLE)
+
+
+async def run_stations(stations):
+    """
+    Run several logical stations on the current event loop
+    :param stations: AsyncDcf instances
+    :return: none
+    """
+    await asyncio.gather(*(station.run() for station in stations))
@@ -0,0 +1,408 @@
+import time
+
+import uwicore_mac_utils as mac
+from mac_fsm import MacState
+from RateAdapt import MinstrelController, AarfController
+
+CW_MIN = 15
+CW_MAX = 1023
+RTS_THRESHOLD = 150
+FRAGMENTATION_THRESHOLD = 1036  # dot11FragmentationThreshold
+ENCODING_CTRL_FRAME = 0  # use the lowest data rate to transmit control frames such as ACK, RTS, CTS
+
+
+def print_msg(msg, node, log=True):
+    """
+    Print debug info
+    :param msg: message to print
+    :param node: node ID as prefix
+    :param log: print flag
+    :return: none
+    """
+    if log:
+        print("[%d] %s" % (node, msg))
+
+
+class DcfLogic:
+    """
+    Transition logic of the DCF + RTS/CTS state machine, shared by both engines (mac.MacWifi: thread,
+    mac_async.AsyncDcf: asyncio) so that they can't behave differently.
+    The methods below take what a state has just observed (a received frame, the sensed channel,
+    an expired timer), update the station and return the next state. Waiting, timers and the
+    calls to the PHY and the upper layer buffer stay in the engines, which implement:
+        _set_nav(duration): extend the NAV by duration (s)
+        _send(header, values, encoding): hand a frame to the PHY
+        _ul_remove(): remove the packet being sent from the upper layer buffer
+        _ul_deliver(payload): hand a received packet to the upper layer buffer
+    """
+
+    def _init_dcf(self, options, node, t_sym):
+        """
+        Station state of the state machine
+        :param options: MAC options (mac_config.yaml)
+        :param node: node ID
+        :param t_sym: OFDM symbol duration (s)
+        """
+        self.options = options
+        self.node = node
+        self.t_sym = t_sym
+        self.airtime = mac.airtime(t_sym)  # TX time lookups
+        self.mac_port = options['MACport']  # Socket talks to upper layer (buffer)
+        self.my_mac = mac.assign_mac(node)
+        self.default_dest_mac = mac.assign_mac(options['dest_node'])  # Peer of the packets that name none
+        self.dest_mac = self.default_dest_mac  # Peer of the packet being sent, named by the upper layer buffer
+        self.encoding = options['encoding']  # data rate for DATA frames
+        self.retx_max = options['retx_max']  # maximum number of retransmission
+
+        timing = mac.dcf_timing(options, t_sym)
+        self.tslot = timing["tslot"]
+        self.SIFS = timing["SIFS"]
+        self.DIFS = timing["DIFS"]
+        self.T_cts = timing["T_cts"]  # TX time of a CTS and an ACK packet
+        self.T_ack = timing["T_ack"]
+        self.t_ack_timeout = timing["t_ack_timeout"]
+
+        self.rate_control_type = options['rate_control'].lower()
+        assert self.rate_control_type in ["none", "minstrel", "aarf"], "Invalid rate adaptation setting"
+        if self.rate_control_type == "minstrel":
+            assert self.retx_max != 0, "To use Minstrel adaptation, retransmission must be enabled"
+        self.rate_control = self._new_rate_control()  # rate controller of dest_mac
+        self.peer_rates = {}  # data rate and rate controller of the other peers, by MAC address
+
+        # log info
+        self.print_state_trans = False  # print state transitions
+        self.print_chan_sense = False  # print channel states after CSMA
+        self.print_data = True  # print TX/RX data
+        self.print_rate = True  # print rate adaptation results
+
+        # Initial conditions of the finite state machine
+        self.backoff = 0  # Backoff counter (slots)
+        self.bo_frozen = False  # Backoff frozen
+        self.chan_busy = False  # Channel found busy in WAIT_FOR_DIFS
+        self.cts_failed = False  # CTS reception failed
+        self.tx_attempts = 0  # Tries to send a packet counter
+        self.first_tx = True  # Is the first attempt to send a packet?
+        self.fail_tx = False  # Is the DATA frame a retransmission?
+        self.retx_retries = self.retx_max
+        self.n_seq = 0  # Sequence number counter
+        self.n_frag = 0  # Fragment number counter
+        self.payload = b""  # Upper layer packet being sent
+        self.fragments = []  # Fragments of the payload not sent yet
+        self.beaconing = False  # Is ON the Beaconing process?
+        self.rts_duration = 0  # Duration field of the last RTS addressed to this station
+        self.cts_addr = None  # Transmitter of that RTS
+        self.ack_addr = None  # Transmitter of the last DATA frame
+        self.fragmenting = False  # Is a fragmented packet being received?
+        self.frag_count = 0
+        self.data_temp_reass = b""  # Fragments received so far
+
+    def _trans(self, event, next_state):
+        print_msg("| %s | %s | %s |" % (self.fsm.state.name, event, next_state.name), self.node,
+                  self.print_state_trans)
+        return next_state
+
+    def _new_rate_control(self):
+        """
+        :return: rate controller starting at the configured data rate, None without rate adaptation
+        """
+        if self.rate_control_type == "minstrel":
+            return MinstrelController(self.options['encoding'], self.retx_max,
+                                      data_rate_table=self.airtime.throughput(FRAGMENTATION_THRESHOLD))
+        if self.rate_control_type == "aarf":
+            return AarfController(self.options['encoding'], 8)  # encoding_init, n_data_rates=8, aarf_n=8
+        return None
+
+    def _select_peer(self, dest):
+        """
+        Make dest the peer of the packet being sent. The rate adaptation state is kept per peer,
+        since the channel to one peer tells nothing about the channel to another
+        :param dest: MAC address
+        """
+        if dest == self.dest_mac:
+            return
+        self.peer_rates[self.dest_mac] = (self.encoding, self.rate_control)
+        self.dest_mac = dest
+        rate = self.peer_rates.pop(dest, None)
+        self.encoding, self.rate_control = rate if rate is not None else (self.options['encoding'],
+                                                                          self._new_rate_control())
+
+    def _adapt_rate(self, success):
+        if self.rate_control is not None:
+            encoding_prev = self.encoding
+            self.encoding = self.rate_control.data_sel(self.encoding, success)
+            print_msg("Rate adaptation %d -> %d" % (encoding_prev, self.encoding), self.node, self.print_rate)
+
+    def _end_tx(self):
+        """
+        The packet being sent is done with (acknowledged or dropped): remove it from the upper layer buffer
+        """
+        self._ul_remove()
+        self.first_tx = True
+        self.fail_tx = False
+        self.fragments = []
+        self.n_frag = 0
+
+    # IDLE
+    def _rts_received(self, rts_pkt):
+        for_me = rts_pkt["RX_add"] == self.my_mac
+        print_msg("[R]-[RTS]-[DA:%s]-[SA:%s]-[duration:%f]-[IFM:%d]" % (
+            mac.format_mac(rts_pkt["RX_add"]), mac.format_mac(rts_pkt["TX_add"]), rts_pkt["tx_time"], for_me),
+            self.node, self.print_data)
+        if for_me:
+            self.cts_addr = rts_pkt["TX_add"]  # Receiver Address of the CTS frame
+            self.rts_duration = rts_pkt["tx_time"]
+            return self._trans("RTS received", MacState.TRANSMITTING_CTS)
+        self._set_nav(rts_pkt["tx_time"] / 1.0e3)  # tx_time is on milliseconds
+        return self._trans("RTS captured (update NAV)", MacState.IDLE)
+
+    def _data_received(self, data_pkt):
+        self.ack_addr = data_pkt["mac_add2"]  # address to respond
+        print_msg("[R]-[DATA]-[DA:%s]-[SA:%s]-[MF:0]-[Seq#:%i]-[""%s""]" % (
+            mac.format_mac(data_pkt["mac_add1"]), mac.format_mac(data_pkt["mac_add2"]), data_pkt["N_SEQ"],
+            data_pkt["PAYLOAD"]), self.node, self.print_data)
+        self._ul_deliver(data_pkt["packet"][24:])
+        return self._trans("DATA received", MacState.TRANSMITTING_ACK)
+
+    def _ul_buffer_read(self, reply_up, payload, dest):
+        """
+        Answer of the upper layer buffer (see read_ul_buffer)
+        :return: next state, None if there is nothing to send
+        """
+        if reply_up == "YES":
+            self.payload = payload
+            self._select_peer(dest if dest is not None else self.default_dest_mac)
+            return self._trans("MAC has DATA to Tx", MacState.WAIT_FOR_NAV)
+        if reply_up == "BEACON":
+            self.beaconing = True
+            return self._trans("Transmit BEACON FRAME", MacState.TRANSMITTING_RTS)
+        return None
+
+    def _cts_overheard(self, cts_pkt):
+        print_msg("[R]-[CTS]-[DA:%s]-[duration:%f]-[IFM:0]" % (
+            mac.format_mac(cts_pkt["RX_add"]), cts_pkt["tx_time"]), self.node, self.print_data)
+        self._set_nav(cts_pkt["tx_time"] / 1.0e3)
+        return self._trans("CTS captured (update NAV)", MacState.IDLE)
+
+    # WAIT_FOR_DIFS
+    def _difs_sensed(self):
+        """
+        End of the DIFS, self.chan_busy tells if the channel was found busy
+        """
+        if not self.chan_busy:
+            if not self.bo_frozen and not self.cts_failed:
+                self.backoff = 0  # Channel IDLE for the first time, BOtimer = 0
+            return self._trans("Channel idle", MacState.BACKING_OFF)
+
+        if not self.bo_frozen and not self.cts_failed:  # If it is the 1st time, set the CW
+            self.backoff = mac.retry(self.tx_attempts, CW_MIN)
+            print_msg("Backoff window is...... %d" % self.backoff, self.node)
+            self.tx_attempts += 1
+        self.chan_busy = False
+        return self._trans("Channel busy", MacState.IDLE)
+
+    # BACKING_OFF
+    def _backoff_done(self):
+        """
+        :return: TRANSMITTING_RTS if the backoff counter is already 0, None otherwise
+        """
+        if self.backoff == 0:
+            self.bo_frozen = False
+            return self._trans("Channel idle (CW = 0)", MacState.TRANSMITTING_RTS)
+        return None
+
+    def _backoff_slot(self, channel_status):
+        """
+        One backoff slot sensed
+        :param channel_status: "FREE" or "OCCUPIED"
+        """
+        self.backoff -= 1
+        if channel_status == "FREE":
+            next_state = MacState.BACKING_OFF
+            if self.backoff == 0:
+                self.bo_frozen = False
+                next_state = MacState.TRANSMITTING_RTS
+        else:
+            self.bo_frozen = True
+            next_state = MacState.IDLE
+        return self._trans("Channel %s (CW = %i)" % ("idle" if channel_status == "FREE" else "busy", self.backoff),
+                           next_state)
+
+    # TRANSMITTING_RTS
+    def _transmit_rts(self):
+        if self.beaconing:  # Transmit a Beacon frame
+            values = {"address2": self.my_mac, "N_SEQ": self.n_seq, "N_FRAG": 0, "BI": self.options['BI'],
+                      "timestamp": time.time()}
+            print_msg("[T]-[BEACON]-[SA:%s]-[BI=%f]-[Seq#:%i]" % (
+                mac.format_mac(self.my_mac), self.options['BI'], self.n_seq), self.node, self.print_data)
+            self._send("BEACON", values, self.encoding)
+            self._ul_remove()
+            self.n_seq = mac.next_seq_num(self.n_seq)
+            self.beaconing = False
+            return self._trans("Send BEACON", MacState.IDLE)
+
+        if self.first_tx:
+            self.retx_retries = self.retx_max
+            self.fail_tx = False
+            self.first_tx = False
+
+        if not self.options['RTS'] or len(self.payload) <= RTS_THRESHOLD:
+            return self._trans("Send DATA", MacState.TRANSMITTING_UNICAST)
+
+        T_data = self.airtime.data_time(len(self.payload), self.encoding)
+        duration = (3 * self.SIFS) + (self.T_cts + self.T_ack + T_data) / 1000  # Txtime in milliseconds
+        values = {"duration": duration, "mac_ra": self.dest_mac, "mac_ta": self.my_mac, "timestamp": time.time()}
+        self._send("RTS", values, ENCODING_CTRL_FRAME)
+        print_msg("[T]-[RTS]-[SA:%s]-[DA=%s]-[duration:%f]" % (
+            mac.format_mac(self.my_mac), mac.format_mac(self.dest_mac), duration), self.node, self.print_data)
+        return self._trans("(PAYLOAD > RTS_Th) Send RTS", MacState.WAITING_FOR_CTS)
+
+    # TRANSMITTING_UNICAST
+    def _transmit_unicast(self):
+        if len(self.payload) > FRAGMENTATION_THRESHOLD:
+            self.fragments = mac.fragment(self.payload, FRAGMENTATION_THRESHOLD)
+            self.n_frag = 0
+            return self._trans("Send Fragmented Data", MacState.TRANSMITTING_FRAGMENTED_PACKET)
+
+        header = "DATA_RETX" if self.fail_tx else "DATA"
+        values = {"payload": self.payload, "address1": self.dest_mac, "address2": self.my_mac, "N_SEQ": self.n_seq,
+                  "N_FRAG": 0, "timestamp": time.time()}
+        self._send(header, values, self.encoding)
+        print_msg("[T]-[DATA]-[DA:%s]-[SA:%s]-[MF:0]-[Seq#:%i]-[""%s""]%s" % (
+            mac.format_mac(self.dest_mac), mac.format_mac(self.my_mac), self.n_seq, self.payload,
+            "-[RETX]" if self.fail_tx else ""), self.node, self.print_data)
+        self.n_seq = mac.next_seq_num(self.n_seq)
+        self.n_frag = 0
+        return self._trans("%s DATA" % ("Resend" if self.fail_tx else "Send"), MacState.WAITING_FOR_ACK)
+
+    # WAITING_FOR_CTS
+    def _cts_received(self, cts_pkt):
+        for_me = cts_pkt["RX_add"] == self.my_mac
+        print_msg("[R]-[CTS]-[RA:%s]-[duration:%f]-[IFM:%d]" % (
+            mac.format_mac(cts_pkt["RX_add"]), cts_pkt["tx_time"], for_me), self.node, self.print_data)
+        if for_me:
+            self.tx_attempts = 0
+            self.cts_failed = False
+            return self._trans("CTS received", MacState.TRANSMITTING_UNICAST)
+        self._set_nav(cts_pkt["tx_time"] / 1e3)  # CTS captured! Transmission aborted to avoid a collision
+        return self._trans("CTS captured (update NAV)", MacState.IDLE)
+
+    def _cts_timeout(self):
+        self.tx_attempts += 1
+        self.backoff = mac.retry(self.tx_attempts, CW_MIN)
+        self.cts_failed = True
+        return self._trans("CTS not received", MacState.IDLE)
+
+    # TRANSMITTING_FRAGMENTED_PACKET
+    def _transmit_fragment(self):
+        """
+        Send the next fragment. Every fragment of a packet carries the same sequence number and
+        consecutive fragment numbers; the sequence number moves on after the last fragment.
+        """
+        payload = self.fragments.pop(0)
+        last = not self.fragments
+        values = {"payload": payload, "address1": self.dest_mac, "address2": self.my_mac, "N_SEQ": self.n_seq,
+                  "N_FRAG": self.n_frag, "timestamp": time.time()}
+        self._send("DATA" if last else "DATA_FRAG", values, self.encoding)  # MORE FRAGMENT = 0 on the last one
+        print_msg("[T]-[FRAGMENTED DATA]-[DA:%s]-[SA:%s]-[MF:%d]-[Seq#:%i]-[Frag#:%i]-[""%s""]" % (
+            mac.format_mac(self.dest_mac), mac.format_mac(self.my_mac), not last, self.n_seq, self.n_frag, payload),
+            self.node, self.print_data)
+        if last:
+            self.n_seq = mac.next_seq_num(self.n_seq)
+            self.n_frag = 0
+        else:
+            self.n_frag += 1
+        return self._trans("Send DATA FRAG%s" % (" (last fragment)" if last else ""),
+                           MacState.WAIT_ACK_FRAGMENTED)
+
+    # WAIT_ACK_FRAGMENTED
+    def _fragment_acked(self, ack_pkt):
+        print_msg("[R]-[ACK]-[DA:%s]-[IFM:1]" % mac.format_mac(ack_pkt["RX_add"]), self.node, self.print_data)
+        self.backoff = 0
+        if self.fragments:
+            return self._trans("ACK received", MacState.TRANSMITTING_FRAGMENTED_PACKET)
+        self._end_tx()  # Remove the packet from upper layers
+        return self._trans("All fragments acknowledged", MacState.IDLE)
+
+    def _fragment_timeout(self):
+        if self.fragments:  # The rest of the packet is dropped, the sequence number moves on
+            self.n_seq = mac.next_seq_num(self.n_seq)
+        self._end_tx()  # ACK not received within the Waiting_for_ack interval
+        return self._trans("ACK not received", MacState.IDLE)
+
+    # WAITING_FOR_ACK
+    def _acked(self, ack_pkt):
+        print_msg("[R]-[ACK]-[DA:%s]-[IFM:1]" % mac.format_mac(ack_pkt["RX_add"]), self.node, self.print_data)
+        self.backoff = 0
+        self._end_tx()  # Packet acknowledged, remove from upper layers
+        self._adapt_rate(True)
+        return self._trans("ACK received", MacState.IDLE)
+
+    def _ack_timeout(self):
+        if self.retx_max != 0:  # Retransmission is enabled
+            self.retx_retries -= 1
+            if self.retx_retries < 0:
+                self._end_tx()
+                self._trans("Remove packet from upper layers after retries", MacState.IDLE)
+            else:
+                self.fail_tx = True
+                self._trans("ACK not received (retries left = %i)" % self.retx_retries, MacState.IDLE)
+        else:
+            self._end_tx()  # No Re-TX!
+            self._trans("Remove packet from upper layers (ReTX disabled)", MacState.IDLE)
+        self._adapt_rate(False)
+        return MacState.IDLE
+
+    # TRANSMITTING_CTS
+    def _transmit_cts(self):
+        duration = self.rts_duration - (2 * self.T_cts) / 10 - self.SIFS
+        self._send("CTS", {"duration": duration, "mac_ra": self.cts_addr, "timestamp": time.time()},
+                   ENCODING_CTRL_FRAME)
+        print_msg("[T]-[CTS]-[DA:%s]-[duration=%f]" % (mac.format_mac(self.cts_addr), duration), self.node,
+                  self.print_data)
+        return self._trans("CTS sent", MacState.WAITING_FOR_DATA)
+
+    # WAITING_FOR_DATA
+    def _receive_data(self, x):
+        """
+        DATA frame received after a CTS: deliver it, or keep the fragment for the re-assembly
+        """
+        self.ack_addr = x["mac_add2"]
+        if x["MF"] != 0:  # More Fragments = 1. It's a fragment
+            print_msg("[R]-[FRAGMENTED DATA]-[DA:%s]-[SA:%s]-[MF:1]-[Seq#:%i]-[Frag#:%i]-[IFM:1]-[""%s""]" % (
+                mac.format_mac(x["mac_add2"]), mac.format_mac(self.my_mac), x["N_SEQ"], x["N_FRAG"], x["PAYLOAD"]),
+                self.node, self.print_data)
+            self.fragmenting = True
+            self.frag_count += 1
+            self.data_temp_reass += x["PAYLOAD"]
+            return self._trans("DATA_FRAG received (MF = 1)", MacState.TX_ACK_FG)
+
+        if not self.fragmenting:  # Not a fragmented packet
+            print_msg("[R]-[DATA]-[DA:%s]-[SA:%s]-[MF:0]-[IFM:1]-[""%s""]" % (
+                mac.format_mac(x["mac_add1"]), mac.format_mac(x["mac_add2"]), x["PAYLOAD"]), self.node,
+                self.print_data)
+            self.frag_count = 0
+            self._ul_deliver(x["PAYLOAD"])
+            return self._trans("DATA received", MacState.TRANSMITTING_ACK)
+
+        # Last fragmented packet
+        print_msg("[R]-[FRAGMENTED DATA]-[DA:%s]-[SA:%s]-[MF:0]-[Seq#:%i]-[Frag#:%i]-[IFM:1]-[""%s""]" % (
+            mac.format_mac(x["mac_add2"]), mac.format_mac(self.my_mac), x["N_SEQ"], x["N_FRAG"], x["PAYLOAD"]),
+            self.node, self.print_data)
+        complete = x["N_FRAG"] == self.frag_count  # Every previous fragment was received
+        packet = self.data_temp_reass + x["PAYLOAD"]
+        self.fragmenting = False
+        self.frag_count = 0
+        self.data_temp_reass = b""
+        if not complete:
+            return self._trans("Error: one or more fragments not received", MacState.IDLE)
+        self._ul_deliver(packet)
+        return self._trans("DATA_FRAG received (MF = 0)", MacState.TRANSMITTING_ACK)
+
+    def _data_timeout(self):
+        return self._trans("DATA not received", MacState.IDLE)
+
+    # TX_ACK_FG, TRANSMITTING_ACK
+    def _transmit_ack(self, next_state):
+        self._send("ACK", {"duration": 0, "mac_ra": self.ack_addr, "timestamp": time.time()}, ENCODING_CTRL_FRAME)
+        print_msg("[T]-[ACK]-[DA:%s]" % mac.format_mac(self.ack_addr), self.node, self.print_data)
+        return self._trans("ACK sent", next_state)
@@ -0,0 +1,112 @@
+import enum
+import time
+
+
+class MacState(enum.IntEnum):
+    """
+    States of the DCF + RTS/CTS finite state machine
+    """
+    IDLE = 0
+    WAIT_FOR_NAV = 1
+    WAIT_FOR_DIFS = 2
+    BACKING_OFF = 3
+    TRANSMITTING_RTS = 4
+    TRANSMITTING_UNICAST = 5
+    WAITING_FOR_CTS = 6
+    TRANSMITTING_FRAGMENTED_PACKET = 7
+    WAIT_ACK_FRAGMENTED = 8
+    WAITING_FOR_ACK = 9
+    TRANSMITTING_CTS = 10
+    WAITING_FOR_DATA = 11
+    TX_ACK_FG = 12
+    TRANSMITTING_ACK = 13
+
+
+# Transition table: state -> states its handler may return
+TRANSITIONS = {
+    MacState.IDLE: (MacState.IDLE, MacState.TRANSMITTING_CTS, MacState.TRANSMITTING_ACK, MacState.WAIT_FOR_NAV,
+                    MacState.TRANSMITTING_RTS),
+    MacState.WAIT_FOR_NAV: (MacState.WAIT_FOR_NAV, MacState.WAIT_FOR_DIFS),
+    MacState.WAIT_FOR_DIFS: (MacState.BACKING_OFF, MacState.IDLE),
+    MacState.BACKING_OFF: (MacState.BACKING_OFF, MacState.TRANSMITTING_RTS, MacState.IDLE),
+    MacState.TRANSMITTING_RTS: (MacState.IDLE, MacState.WAITING_FOR_CTS, MacState.TRANSMITTING_UNICAST),
+    MacState.TRANSMITTING_UNICAST: (MacState.TRANSMITTING_FRAGMENTED_PACKET, MacState.WAITING_FOR_ACK),
+    MacState.WAITING_FOR_CTS: (MacState.WAITING_FOR_CTS, MacState.TRANSMITTING_UNICAST, MacState.IDLE),
+    MacState.TRANSMITTING_FRAGMENTED_PACKET: (MacState.TRANSMITTING_FRAGMENTED_PACKET, MacState.WAIT_ACK_FRAGMENTED),
+    MacState.WAIT_ACK_FRAGMENTED: (MacState.WAIT_ACK_FRAGMENTED, MacState.TRANSMITTING_FRAGMENTED_PACKET,
+                                   MacState.IDLE),
+    MacState.WAITING_FOR_ACK: (MacState.WAITING_FOR_ACK, MacState.IDLE),
+    MacState.TRANSMITTING_CTS: (MacState.TRANSMITTING_CTS, MacState.WAITING_FOR_DATA),
+    MacState.WAITING_FOR_DATA: (MacState.WAITING_FOR_DATA, MacState.TRANSMITTING_ACK, MacState.TX_ACK_FG,
+                                MacState.IDLE),
+    MacState.TX_ACK_FG: (MacState.WAITING_FOR_DATA,),
+    MacState.TRANSMITTING_ACK: (MacState.IDLE,),
+}
+
+
+class StateMachine:
+    """
+    Table-driven state machine.
+    The handler of a state is the method of the owner named after it (MacState.IDLE -> owner.idle).
+    A step runs the handler of the current state, which returns the next state; dispatch is a
+    list lookup by state code. Every transition is checked against the transition table and
+    counted, and the time spent in each state is accumulated (see stats()).
+    :param owner: object implementing the handlers (MacWifi, mac_async.AsyncDcf, or a simulator)
+    :param initial: initial state
+    :param transitions: transition table
+    """
+
+    def __init__(self, owner, initial=MacState.IDLE, transitions=TRANSITIONS):
+        self.state = MacState(initial)
+        self.handlers = [getattr(owner, state.name.lower()) for state in MacState]
+        self.allowed = [frozenset(transitions[state]) for state in MacState]
+        self.reset_stats()
+
+    def reset_stats(self):
+        n = len(MacState)
+        self.transition_count = [[0] * n for _ in range(n)]  # [from][to]
+        self.state_time = [0.0] * n  # Time spent in the handler of each state (s)
+
+    def step(self):
+        """
+        Run the handler of the current state
+        :return: next state
+        """
+        t_start = time.perf_counter()
+        next_state = self.handlers[self.state]()
+        return self._transition(next_state, time.perf_counter() - t_start)
+
+    async def step_async(self):
+        """
+        Run the handler of the current state, for coroutine handlers
+        :return: next state
+        """
+        t_start = time.perf_counter()
+        next_state = await self.handlers[self.state]()
+        return self._transition(next_state, time.perf_counter() - t_start)
+
+    def _transition(self, next_state, elapsed):
+        state = self.state
+        if next_state not in self.allowed[state]:
+            raise ValueError("Invalid transition %s -> %s" % (state.name, MacState(next_state).name))
+        self.state_time[state] += elapsed
+        self.transition_count[state][next_state] += 1
+        self.state = next_state
+        return next_state
+
+    def stats(self):
+        """
+        Profiling counters of the state machine
+        :return: {"state": current state,
+                  "transitions": {from: {to: count}},
+                  "time": {state: seconds spent in the state}}
+        """
+        transitions = {}
+        for state in MacState:
+            counts = dict((MacState(to).name, count) for to, count in enumerate(self.transition_count[state])
+                          if count)
+            if counts:
+                transitions[state.name] = counts
+        return {"state": self.state.name,
+                "transitions": transitions,
+                "time": dict((state.name, self.state_time[state]) for state in MacState if self.state_time[state])}
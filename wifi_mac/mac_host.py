@@ -0,0 +1,122 @@
+import uwicore_mac_utils as mac
+from mac_async import AsyncDcf, run_stations, print_msg
+
+MAX_NODE = 255  # Node IDs are the last byte of the MAC address, see assign_mac
+
+
+class StationPort(mac.PhyTransport):
+    """
+    Channel of one logical station to a PHY shared with other stations (see StationHost).
+    Requests go through the transport of the host; the received frames are the ones the host
+    routed to the station, kept in the queues of this port.
+    :param phy: PhyTransport of the host
+    """
+
+    def __init__(self, phy):
+        mac.PhyTransport.__init__(self)
+        self.set_queue_limits(*phy.queue_limits)
+        self.phy = phy
+        self.cca = phy.cca
+        self.subscribed = True  # Frames are pushed by the host
+
+    def send(self, pkt):
+        self.phy.send(pkt)
+
+    def request(self, pkt):
+        return self.phy.request(pkt)
+
+    async def request_async(self, pkt):
+        return await self.phy.request_async(pkt)
+
+    def subscribe(self):
+        return True
+
+    def deliver(self, header, frame):
+        """
+        Frame routed to this station by the host
+        :param header: frame type
+        :param frame: frame information (see parse_mac)
+        :return: none
+        """
+        self._queue_frame(header, frame)
+
+
+class StationHost:
+    """
+    Several logical stations behind one PHY (engine: asyncio, stations > 1 in mac_config).
+    Each station is an AsyncDcf with its own MAC address, rate controller, sequence numbers,
+    NAV and received frame queues. They all run on one event loop (no thread per station).
+    The PHY pushes every received frame to route(), which finds the station a DATA or ACK frame
+    is addressed to with one dictionary lookup; RTS and CTS frames go to every station, for
+    their NAV.
+    Station i uses node ID node + i and the upper layer buffer on MACport + i.
+    :param options: MAC options (mac_config.yaml)
+    :param phy: open PhyTransport
+    :param node: node ID of the PHY, used by the first station
+    :param t_sym: OFDM symbol duration (s)
+    """
+
+    def __init__(self, options, phy, node, t_sym):
+        n_stations = options.get('stations', 1)
+        assert 1 <= n_stations and node + n_stations - 1 <= MAX_NODE, "[%d] Invalid number of stations" % node
+        assert not node <= options['dest_node'] < node + n_stations, \
+            "[%d] Destination node ID can't be one of the local stations" % node
+        assert phy.subscribe(), "[%d] PHY refused to push received frames" % node
+
+        self.phy = phy
+        self.node = node
+        self.stations = []
+        self.ports = {}  # MAC address -> StationPort
+        for i in range(n_stations):
+            port = StationPort(phy)
+            station = AsyncDcf(dict(options, MACport=options['MACport'] + i), port, node + i, t_sym)
+            if i > 0:  # The PHY only accepts the frames addressed to its own node
+                assert phy.register_address(station.my_mac), \
+                    "[%d] PHY refused the address %s" % (node, mac.format_mac(station.my_mac))
+            self.ports[station.my_mac] = port
+            self.stations.append(station)
+            print_msg("Station %d - %s - MACport %d" % (station.node, mac.format_mac(station.my_mac),
+                                                        station.mac_port), node)
+        self._all_ports = tuple(self.ports.values())
+
+        phy.set_router(self.route)
+        for header in mac.PHY_FRAME_TYPES:  # Frames pushed before the router was set
+            frame = phy.pop_frame(header)
+            while frame is not None:
+                self.route(header, frame)
+                frame = phy.pop_frame(header)
+
+    def route(self, header, frame):
+        """
+        PhyTransport router, runs in the thread that receives the frame
+        :param header: frame type
+        :param frame: frame information (see parse_mac)
+        :return: none
+        """
+        if header == "RTS" or header == "CTS":  # Every station updates its NAV, the receiver answers
+            for port in self._all_ports:
+                port.deliver(header, frame)
+            return
+        port = self.ports.get(frame["RX_add"])
+        if port is not None:
+            port.deliver(header, frame)
+
+    async def run(self):
+        """
+        Run every station on the current event loop until stop() is called
+        """
+        try:
+            await run_stations(self.stations)
+        finally:
+            self.phy.set_router(None)
+
+    def stop(self):
+        for station in self.stations:
+            station.stop()
+
+    def stats(self):
+        """
+        Profiling counters of the state machine of each station
+        :return: {MAC address: StateMachine.stats()}
+        """
+        return dict((mac.format_mac(station.my_mac), station.fsm.stats()) for station in self.stations)
@@ -123,7 +123,8 @@ def main():
     # Configure local and destination MAC address according to the Node ID
     assert node != options.dest_node, "[%d] Destination node ID can't be set to itself's" % node
     my_mac = mac.assign_mac(node)  # MAC address for this node
-    dest_mac = mac.assign_mac(options.dest_node)  # Destination address of upper layer packets
+    default_dest_mac = mac.assign_mac(options.dest_node)  # Destination of the upper layer packets that name none
+    dest_mac = default_dest_mac
 
     # Obtain sample rate from PHY server
     reply_phy, samp_rate = mac.read_phy_response(phy_port, "SAMP_RATE")
@@ -155,7 +156,7 @@ def main():
     T_cts = CTS_empty["INFO"]["tx_time"]
     ACK_empty = mac.generate_pkt("ACK", t_sym, encoding_ctrl_frame, empty_values)
     T_ack = ACK_empty["INFO"]["tx_time"]
-    empty_values = {"payload": "x" * 2034, "address1": dest_mac, "address2": my_mac, "N_SEQ": 0, "N_FRAG": 0,
+    empty_values = {"payload": b"x" * 2034, "address1": dest_mac, "address2": my_mac, "N_SEQ": 0, "N_FRAG": 0,
                     "timestamp": 0}
     DATA_empty = mac.generate_pkt("DATA", t_sym, 0, empty_values)
     T_data_max = DATA_empty["INFO"]["tx_time"]  # maximum transmission time
@@ -187,7 +188,7 @@ def main():
     N_FRAG = 0  # Fragment number counter
     first_tx = True  # Is the first attempt to send a packet?
     frag_count = 0  # Counter used during fragmentation
-    data_temp_reass = ""  # Initial variable to perform de re-assembly process
+    data_temp_reass = b""  # Initial variable to perform de re-assembly process
     beaconing = False  # Is ON the Beaconing process?
     fragmenting = 0  # Is the packet received a fragment?
 
@@ -265,7 +266,7 @@ def main():
                         mac.format_mac(rts_pkt["RX_add"]), mac.format_mac(rts_pkt["TX_add"]), rts_pkt["tx_time"]),
                               node, print_data)
                     sleep_time = rts_pkt["tx_time"] / (1.0e3)  # Divided by 1e3 because tx_time is on milliseconds
-                    NAV = mac.update_nav(time.time(), sleep_time, tslot)
+                    NAV = mac.update_nav(time.monotonic_ns(), sleep_time, tslot)
                     print_msg("| IDLE | RTS captured (update NAV) | %s |" % state, node, print_state_trans)
 
             else:  # RTS is not received
@@ -280,8 +281,9 @@ def main():
                     print_msg("| IDLE | DATA received | %s |" % state, node, print_state_trans)
                     mac.send_ul_buff_packet(mac_port, data_pkt["packet"][24:])
                 else:  # Check upper layer buffer for data to send
-                    reply_up, PAYLOAD = mac.read_ul_buffer(mac_port)
+                    reply_up, PAYLOAD, dest = mac.read_ul_buffer(mac_port)
                     if reply_up == "YES":
+                        dest_mac = dest if dest is not None else default_dest_mac  # Peer named by the buffer
                         state = "WAIT_FOR_NAV"
                         print_msg("| IDLE | MAC has DATA to Tx | %s |" % state, node, print_state_trans)
                     elif reply_up == "BEACON":
@@ -295,16 +297,16 @@ def main():
                             tiempo = cts_pkt["tx_time"] / 1.0e3
                             state = "IDLE"
                             print_msg("[R]-[CTS]-[DA:%s]-[duration:%f]-[IFM:0]" % (
-                                mac.format_mac(cts_pkt["RX_add"]), cts_pkt["txtime"]), node, print_data)
+                                mac.format_mac(cts_pkt["RX_add"]), cts_pkt["tx_time"]), node, print_data)
                             print_msg("| IDLE | CTS captured (update NAV) | %s |" % state, node, print_state_trans)
-                            NAV = mac.update_nav(time.time(), tiempo, tslot)
+                            NAV = mac.update_nav(time.monotonic_ns(), tiempo, tslot)
 
             if state == "IDLE":
                 time.sleep(tslot)  # Time-slotted MAC
                 print_msg("=> %s (%s)" % (state, time.time()), node, False)
 
         elif state == "WAIT_FOR_NAV":
-            NAV = mac.update_nav(time.time(), NAV, tslot)
+            NAV = mac.update_nav(time.monotonic_ns(), NAV, tslot)
             if NAV > 0:
                 print_msg("| WAIT_FOR_NAV | NAV > 0 | WAIT_FOR_NAV |", node, False)
                 continue
@@ -400,7 +402,7 @@ def main():
                 packet = mac.generate_pkt("DATA", t_sym, encoding, values)
                 T_data = packet["INFO"]["tx_time"]
 
-                if PAYLOAD > RTS_THRESHOLD:
+                if len(PAYLOAD) > RTS_THRESHOLD:
                     if first_tx:
                         retx_retries = retx_max
                         fail_tx = False
@@ -509,7 +511,7 @@ def main():
                         mac.format_mac(cts_pkt["RX_add"]), cts_pkt["tx_time"]), node, print_data)
                     state = "IDLE"
                     nuevo_NAV = cts_pkt["tx_time"] / 1e3
-                    NAV = mac.update_nav(time.time(), nuevo_NAV, tslot)
+                    NAV = mac.update_nav(time.monotonic_ns(), nuevo_NAV, tslot)
                     print_msg("| WAITING_FOR_CTS | CTS captured (Update NAV = %f) | %s |" % (NAV, state),
                               node, print_state_trans)
 
@@ -699,7 +701,7 @@ def main():
                 - packet = [CTS][LENGHT][INFO]
                 - pkt = [Header: PKT][Data: packet]
             '''
-            NAV = mac.update_nav(time.time(), NAV, tslot)
+            NAV = mac.update_nav(time.monotonic_ns(), NAV, tslot)
             if NAV > 0:
                 state = "TRANSMITTING_CTS"
                 print_msg("| TRANSMITTING_CTS | NAV > 0 | %s |" % state, node, print_state_trans)
@@ -732,7 +734,7 @@ def main():
                 # /TEST/ UNCOMMENT TO CHECK RTS/CTS FUNCTIONALITY
                 #============================================================
                 # STEP 3/4: Node 1 --> DATA
-                values = {"payload":"Paquete_que_llega12", "address1":x["mac_add1"], "address2":x["mac_add2"], "N_SEQ":N_SEQ, "N_FRAG":0, "timestamp":time.time()}
+                values = {"payload":b"Paquete_que_llega12", "address1":x["mac_add1"], "address2":x["mac_add2"], "N_SEQ":N_SEQ, "N_FRAG":0, "timestamp":time.time()}
                 DATA_forced = mac.generate_pkt("DATA", t_sym, encoding, values)
                 packet_DATA_forced = mac.create_packet("PKT", DATA_forced)
                 mac.send_wo_response(packet_DATA_forced, phy_port)
@@ -7,6 +7,7 @@
 ##################################################
 import struct
 
+import numpy
 import pmt
 
 if __name__ == '__main__':
@@ -28,13 +29,9 @@ import foo
 import logging
 import ieee802_11
 import yaml
-from PyQt5 import Qt,QtWidgets
-from PyQt5.QtCore import pyqtSlot
-import sip
 import time
 import uwicore_mac_utils as mac
 import uwicore_mpif as plcp
-from collections import deque
 from gnuradio.eng_option import eng_option
 
 sys.path.append(os.environ.get('GRC_HIER_PATH', os.path.expanduser('~/.grc_gnuradio')))
@@ -42,10 +39,16 @@ sys.path.append(os.environ.get('GRC_HIER_PATH', os.path.expanduser('~/.grc_gnura
 from gnuradio import blocks
 from gnuradio import gr
 from gnuradio import uhd
-from gnuradio.qtgui import Range, RangeWidget
 from wifi_phy_hier import wifi_phy_hier  # grc-generated hier_block
 
-from gnuradio import qtgui
+try:  # Qt is only needed for the GUI, see 'headless' in phy_config.yaml
+    from PyQt5 import Qt, QtWidgets
+    from PyQt5.QtCore import pyqtSlot
+    import sip
+    from gnuradio import qtgui
+    from gnuradio.qtgui import Range, RangeWidget
+except ImportError:
+    Qt = None
 
 def load_config(config_file):
     with open(config_file, 'r') as file:
@@ -64,32 +67,121 @@ def print_msg(msg, node, log=True):
         print("[%d] %s" % (node, msg))
 
 
-class wifi_transceiver(gr.top_block, Qt.QWidget):
+def set_thread_scheduling(cores=None, priority=0, node=0):
+    """
+    Pin the calling thread to CPU cores and give it a realtime priority (Linux)
+    :param cores: CPU cores, None or empty for any core
+    :param priority: SCHED_FIFO priority, 0 to keep the scheduling policy
+    :param node: node ID (for print use only)
+    :return: none
+    """
+    try:
+        if cores:
+            os.sched_setaffinity(0, cores)
+        if priority:
+            os.sched_setscheduler(0, os.SCHED_FIFO, os.sched_param(priority))
+    except (OSError, AttributeError) as e:
+        print_msg("Warning: failed to set the scheduling of thread %s (%s)" % (threading.current_thread().name, e),
+                  node)
+
+
+class pdu_framer(gr.basic_block):
+    """
+    Prefix every received MPDU with its length (mac.RX_FRAME_PREFIX) before blocks_socket_pdu,
+    whose TCP stream has no frame boundaries. rx_client splits the stream back into frames
+    (see mac.FrameReader).
+    """
+
+    def __init__(self):
+        gr.basic_block.__init__(self, name="pdu_framer", in_sig=None, out_sig=None)
+        self.port = pmt.intern("pdus")
+        self.message_port_register_in(self.port)
+        self.message_port_register_out(self.port)
+        self.set_msg_handler(self.port, self.handle_pdu)
+
+    def handle_pdu(self, pdu):
+        # The framed vector is built from bytes, without intermediate lists of ints. A bytearray,
+        # since the pybind11 bindings of pmt only convert a vector<uint8_t> from a non-bytes sequence
+        mpdu = pmt.u8vector_elements(pmt.cdr(pdu))
+        framed = bytearray(mac.RX_FRAME_PREFIX.pack(len(mpdu)))
+        framed += bytes(mpdu)
+        self.message_port_pub(self.port, pmt.cons(pmt.car(pdu), pmt.init_u8vector(len(framed), framed)))
+
+
+class cca_detector(gr.sync_block):
+    """
+    Energy detector for carrier sensing, fed by the power average of the PHY (blocks_moving_average_xx_1).
+    Each chunk of samples updates the CCA state shared with the MAC (plcp.CcaState): last power level,
+    busy/idle against the threshold, the times the channel last turned busy and idle, and the history
+    of the samples per bin (see plcp.CcaState.sense_window). The listeners are called on every
+    threshold crossing.
+    :param threshold: CCA threshold (dBw)
+    :param sample_period: time between two input samples (s)
+    :param path: shared-memory file of the CCA state, None if it is only read in this process
+    :param history: duration of the history (s)
+    :param bin_time: duration of a bin of the history (s)
+    """
+
+    def __init__(self, threshold, sample_period, path=None, history=4.0, bin_time=1e-4):
+        gr.sync_block.__init__(self, name="cca_detector", in_sig=[numpy.float32], out_sig=None)
+        self.threshold = 10 ** (threshold / 10)
+        self.sample_period_ns = int(sample_period * 1e9)
+        self.state = plcp.CcaState(path, True, history, bin_time)
+        self.busy = False
+        self.busy_since = 0  # ns
+        self.idle_since = 0  # ns
+        self.listeners = []
+
+    def add_listener(self, callback):
+        """
+        :param callback: function (busy, t) called from the flowgraph thread at every crossing, t in ns
+        :return: none
+        """
+        self.listeners.append(callback)
+
+    def remove_listener(self, callback):
+        self.listeners.remove(callback)
+
+    def work(self, input_items, output_items):
+        levels = input_items[0]
+        n = len(levels)
+        t_end = time.monotonic_ns()  # time of the last sample
+        busy = levels > self.threshold
+        previous = numpy.concatenate(([self.busy], busy[:-1]))
+        for i in numpy.flatnonzero(busy != previous):  # threshold crossings
+            self.busy = bool(busy[i])
+            t = t_end - (n - 1 - int(i)) * self.sample_period_ns
+            if self.busy:
+                self.busy_since = t
+            else:
+                self.idle_since = t
+            for callback in self.listeners:
+                callback(self.busy, t)
+
+        # Summary of the samples per bin of the history
+        bins = (t_end - (n - 1 - numpy.arange(n)) * self.sample_period_ns) // self.state.bin_ns
+        starts = numpy.flatnonzero(numpy.concatenate(([True], bins[1:] != bins[:-1])))
+        counts = numpy.diff(numpy.append(starts, n))
+        summary = zip(bins[starts].tolist(), numpy.maximum.reduceat(levels, starts).tolist(),
+                      numpy.add.reduceat(levels, starts, dtype=numpy.float64).tolist(), counts.tolist(),
+                      numpy.add.reduceat(busy, starts, dtype=numpy.int64).tolist())
+
+        self.state.publish(t_end, float(levels[-1]), self.busy, self.busy_since, self.idle_since, summary)
+        return n
+
+    def stop(self):
+        self.state.close()
+        return True
+
+
+class wifi_transceiver_headless(gr.top_block):
+    """
+    Transceiver flowgraph without GUI: no Qt sinks nor widgets, for nodes without display
+    ('headless' in phy_config.yaml). The GUI of wifi_transceiver is built on top of it.
+    """
+
     def __init__(self, options, hostname, wireshark=False):
         gr.top_block.__init__(self, "Wifi Transceiver")
-        Qt.QWidget.__init__(self)
-        self.setWindowTitle("Wifi Transceiver")
-        qtgui.util.check_set_qss()
-        try:
-            self.setWindowIcon(Qt.QIcon.fromTheme('gnuradio-grc'))
-        except:
-            pass
-        self.top_scroll_layout = Qt.QVBoxLayout()
-        self.setLayout(self.top_scroll_layout)
-        self.top_scroll = Qt.QScrollArea()
-        self.top_scroll.setFrameStyle(Qt.QFrame.NoFrame)
-        self.top_scroll_layout.addWidget(self.top_scroll)
-        self.top_scroll.setWidgetResizable(True)
-        self.top_widget = Qt.QWidget()
-        self.top_scroll.setWidget(self.top_widget)
-        self.top_layout = Qt.QVBoxLayout(self.top_widget)
-        self.top_grid_layout = Qt.QGridLayout()
-        self.top_layout.addLayout(self.top_grid_layout)
-
-        self.settings = Qt.QSettings("GNU Radio", "wifi_transceiver")
-        if self.settings.value("geometry") is not None:
-            self.restoreGeometry(self.settings.value("geometry").toByteArray())
-
 
         ##################################################
         # Variables
@@ -103,140 +195,13 @@ class wifi_transceiver(gr.top_block, Qt.QWidget):
         self.chan_est = chan_est = options['chan_est']
         self.usrp_ip = options['usrp_ip']
 
+        # Updates of the GUI widgets by the setters, see wifi_transceiver
+        self._samp_rate_callback = self._lo_offset_callback = self._freq_callback = lambda value: None
+        self._encoding_callback = self._chan_est_callback = lambda value: None
+
         ##################################################
         # Blocks
         ##################################################
-        self._tx_gain_range = Range(0, 1, 0.01, tx_gain, 200)
-        self._tx_gain_win = RangeWidget(self._tx_gain_range, self.set_tx_gain, "tx_gain", "counter_slider", float)
-        self.top_layout.addWidget(self._tx_gain_win)
-        self._samp_rate_options = [10e6, 20e6]
-        self._samp_rate_labels = ["10 MHz", "20 MHz"]
-        self._samp_rate_tool_bar = Qt.QToolBar(self)
-        self._samp_rate_tool_bar.addWidget(Qt.QLabel("samp_rate" + ": "))
-        self._samp_rate_combo_box = Qt.QComboBox()
-        self._samp_rate_tool_bar.addWidget(self._samp_rate_combo_box)
-        for label in self._samp_rate_labels: self._samp_rate_combo_box.addItem(label)
-        self._samp_rate_callback = lambda i: Qt.QMetaObject.invokeMethod(self._samp_rate_combo_box, "setCurrentIndex",
-                                                                         Qt.Q_ARG("int",
-                                                                                  self._samp_rate_options.index(i)))
-        self._samp_rate_callback(self.samp_rate)
-        self._samp_rate_combo_box.currentIndexChanged.connect(
-            lambda i: self.set_samp_rate(self._samp_rate_options[i]))
-        self.top_layout.addWidget(self._samp_rate_tool_bar)
-        self._rx_gain_range = Range(0, 1, 0.01, rx_gain, 200)
-        self._rx_gain_win = RangeWidget(self._rx_gain_range, self.set_rx_gain, "rx_gain", "counter_slider", float)
-        self.top_layout.addWidget(self._rx_gain_win)
-        self._lo_offset_options = (0, 6e6, 11e6,)
-        self._lo_offset_labels = (
-            str(self._lo_offset_options[0]), str(self._lo_offset_options[1]), str(self._lo_offset_options[2]),)
-        self._lo_offset_tool_bar = Qt.QToolBar(self)
-        self._lo_offset_tool_bar.addWidget(Qt.QLabel("lo_offset" + ": "))
-        self._lo_offset_combo_box = Qt.QComboBox()
-        self._lo_offset_tool_bar.addWidget(self._lo_offset_combo_box)
-        for label in self._lo_offset_labels: self._lo_offset_combo_box.addItem(label)
-        self._lo_offset_callback = lambda i: Qt.QMetaObject.invokeMethod(self._lo_offset_combo_box, "setCurrentIndex",
-                                                                         Qt.Q_ARG("int",
-                                                                                  self._lo_offset_options.index(i)))
-        self._lo_offset_callback(self.lo_offset)
-        self._lo_offset_combo_box.currentIndexChanged.connect(
-            lambda i: self.set_lo_offset(self._lo_offset_options[i]))
-        self.top_layout.addWidget(self._lo_offset_tool_bar)
-        self._freq_options = [2412000000.0, 2417000000.0, 2422000000.0, 2427000000.0, 2432000000.0, 2437000000.0,
-                              2442000000.0, 2447000000.0, 2452000000.0, 2457000000.0, 2462000000.0, 2467000000.0,
-                              2472000000.0, 2484000000.0, 5170000000.0, 5180000000.0, 5190000000.0, 5200000000.0,
-                              5210000000.0, 5220000000.0, 5230000000.0, 5240000000.0, 5250000000.0, 5260000000.0,
-                              5270000000.0, 5280000000.0, 5290000000.0, 5300000000.0, 5310000000.0, 5320000000.0,
-                              5500000000.0, 5510000000.0, 5520000000.0, 5530000000.0, 5540000000.0, 5550000000.0,
-                              5560000000.0, 5570000000.0, 5580000000.0, 5590000000.0, 5600000000.0, 5610000000.0,
-                              5620000000.0, 5630000000.0, 5640000000.0, 5660000000.0, 5670000000.0, 5680000000.0,
-                              5690000000.0, 5700000000.0, 5710000000.0, 5720000000.0, 5745000000.0, 5755000000.0,
-                              5765000000.0, 5775000000.0, 5785000000.0, 5795000000.0, 5805000000.0, 5825000000.0,
-                              5860000000.0, 5870000000.0, 5880000000.0, 5890000000.0, 5900000000.0, 5910000000.0,
-                              5920000000.0]
-        self._freq_labels = ['  1 | 2412.0 | 11g', '  2 | 2417.0 | 11g', '  3 | 2422.0 | 11g', '  4 | 2427.0 | 11g',
-                             '  5 | 2432.0 | 11g', '  6 | 2437.0 | 11g', '  7 | 2442.0 | 11g', '  8 | 2447.0 | 11g',
-                             '  9 | 2452.0 | 11g', ' 10 | 2457.0 | 11g', ' 11 | 2462.0 | 11g', ' 12 | 2467.0 | 11g',
-                             ' 13 | 2472.0 | 11g', ' 14 | 2484.0 | 11g', ' 34 | 5170.0 | 11a', ' 36 | 5180.0 | 11a',
-                             ' 38 | 5190.0 | 11a', ' 40 | 5200.0 | 11a', ' 42 | 5210.0 | 11a', ' 44 | 5220.0 | 11a',
-                             ' 46 | 5230.0 | 11a', ' 48 | 5240.0 | 11a', ' 50 | 5250.0 | 11a', ' 52 | 5260.0 | 11a',
-                             ' 54 | 5270.0 | 11a', ' 56 | 5280.0 | 11a', ' 58 | 5290.0 | 11a', ' 60 | 5300.0 | 11a',
-                             ' 62 | 5310.0 | 11a', ' 64 | 5320.0 | 11a', '100 | 5500.0 | 11a', '102 | 5510.0 | 11a',
-                             '104 | 5520.0 | 11a', '106 | 5530.0 | 11a', '108 | 5540.0 | 11a', '110 | 5550.0 | 11a',
-                             '112 | 5560.0 | 11a', '114 | 5570.0 | 11a', '116 | 5580.0 | 11a', '118 | 5590.0 | 11a',
-                             '120 | 5600.0 | 11a', '122 | 5610.0 | 11a', '124 | 5620.0 | 11a', '126 | 5630.0 | 11a',
-                             '128 | 5640.0 | 11a', '132 | 5660.0 | 11a', '134 | 5670.0 | 11a', '136 | 5680.0 | 11a',
-                             '138 | 5690.0 | 11a', '140 | 5700.0 | 11a', '142 | 5710.0 | 11a', '144 | 5720.0 | 11a',
-                             '149 | 5745.0 | 11a (SRD)', '151 | 5755.0 | 11a (SRD)', '153 | 5765.0 | 11a (SRD)',
-                             '155 | 5775.0 | 11a (SRD)', '157 | 5785.0 | 11a (SRD)', '159 | 5795.0 | 11a (SRD)',
-                             '161 | 5805.0 | 11a (SRD)', '165 | 5825.0 | 11a (SRD)', '172 | 5860.0 | 11p',
-                             '174 | 5870.0 | 11p', '176 | 5880.0 | 11p', '178 | 5890.0 | 11p', '180 | 5900.0 | 11p',
-                             '182 | 5910.0 | 11p', '184 | 5920.0 | 11p']
-        self._freq_tool_bar = Qt.QToolBar(self)
-        self._freq_tool_bar.addWidget(Qt.QLabel("freq" + ": "))
-        self._freq_combo_box = Qt.QComboBox()
-        self._freq_tool_bar.addWidget(self._freq_combo_box)
-        for label in self._freq_labels: self._freq_combo_box.addItem(label)
-        self._freq_callback = lambda i: Qt.QMetaObject.invokeMethod(self._freq_combo_box, "setCurrentIndex",
-                                                                    Qt.Q_ARG("int", self._freq_options.index(i)))
-        self._freq_callback(self.freq)
-        self._freq_combo_box.currentIndexChanged.connect(
-            lambda i: self.set_freq(self._freq_options[i]))
-        self.top_layout.addWidget(self._freq_tool_bar)
-        self._encoding_options = [0, 1, 2, 3, 4, 5, 6, 7]
-        self._encoding_labels = ["BPSK 1/2", "BPSK 3/4", "QPSK 1/2", "QPSK 3/4", "16QAM 1/2", "16QAM 3/4", "64QAM 2/3",
-                                 "64QAM 3/4"]
-        self._encoding_group_box = Qt.QGroupBox("encoding")
-        self._encoding_box = Qt.QHBoxLayout()
-
-        class variable_chooser_button_group(Qt.QButtonGroup):
-            def __init__(self, parent=None):
-                Qt.QButtonGroup.__init__(self, parent)
-
-            @pyqtSlot(int)
-            def updateButtonChecked(self, button_id):
-                self.button(button_id).setChecked(True)
-
-        self._encoding_button_group = variable_chooser_button_group()
-        self._encoding_group_box.setLayout(self._encoding_box)
-        for i, label in enumerate(self._encoding_labels):
-            radio_button = Qt.QRadioButton(label)
-            self._encoding_box.addWidget(radio_button)
-            self._encoding_button_group.addButton(radio_button, i)
-        self._encoding_callback = lambda i: Qt.QMetaObject.invokeMethod(self._encoding_button_group,
-                                                                        "updateButtonChecked", Qt.Q_ARG("int",
-                                                                                                        self._encoding_options.index(
-                                                                                                            i)))
-        self._encoding_callback(self.encoding)
-        self._encoding_button_group.buttonClicked[int].connect(
-            lambda i: self.set_encoding(self._encoding_options[i]))
-        self.top_layout.addWidget(self._encoding_group_box)
-        self._chan_est_options = [ieee802_11.LS, ieee802_11.LMS, ieee802_11.STA, ieee802_11.COMB]
-        self._chan_est_labels = ["LS", "LMS", "STA", "Linear Comb"]
-        self._chan_est_group_box = Qt.QGroupBox("chan_est")
-        self._chan_est_box = Qt.QHBoxLayout()
-
-        class variable_chooser_button_group(Qt.QButtonGroup):
-            def __init__(self, parent=None):
-                Qt.QButtonGroup.__init__(self, parent)
-
-            @pyqtSlot(int)
-            def updateButtonChecked(self, button_id):
-                self.button(button_id).setChecked(True)
-
-        self._chan_est_button_group = variable_chooser_button_group()
-        self._chan_est_group_box.setLayout(self._chan_est_box)
-        for i, label in enumerate(self._chan_est_labels):
-            radio_button = Qt.QRadioButton(label)
-            self._chan_est_box.addWidget(radio_button)
-            self._chan_est_button_group.addButton(radio_button, i)
-        self._chan_est_callback = lambda i: Qt.QMetaObject.invokeMethod(self._chan_est_button_group,
-                                                                        "updateButtonChecked", Qt.Q_ARG("int",
-                                                                                                        self._chan_est_options.index(
-                                                                                                            i)))
-        self._chan_est_callback(self.chan_est)
-        self._chan_est_button_group.buttonClicked[int].connect(
-            lambda i: self.set_chan_est(self._chan_est_options[i]))
-        self.top_layout.addWidget(self._chan_est_group_box)
         self.wifi_phy_hier_0 = wifi_phy_hier(
             bandwidth=samp_rate,
             chan_est=chan_est,
@@ -244,6 +209,11 @@ class wifi_transceiver(gr.top_block, Qt.QWidget):
             frequency=freq,
             sensitivity=0.56,
         )
+        # TX path to block mapper(): message port and PDU metadata of each encoding, shared by the PDUs (see send_pkt)
+        self.mapper_port = pmt.intern("in")
+        tx_meta = pmt.dict_add(pmt.make_dict(), pmt.string_to_symbol("crc_included"), pmt.PMT_F)
+        self.tx_meta = [pmt.dict_add(tx_meta, pmt.string_to_symbol("encoding"), pmt.from_long(e))
+                        for e in range(plcp.N_ENCODINGS)]
         self.uhd_usrp_source_0 = uhd.usrp_source(
             self.usrp_ip,
             uhd.stream_args(
@@ -264,100 +234,11 @@ class wifi_transceiver(gr.top_block, Qt.QWidget):
             ),
             'packet_len',
         )
-        self.qtgui_time_sink_x_0 = qtgui.time_sink_f(
-            1024,  # size
-            samp_rate,  # samp_rate
-            "",  # name
-            1  # number of inputs
-        )
-        self.qtgui_time_sink_x_0.set_update_time(0.10)
-        self.qtgui_time_sink_x_0.set_y_axis(-1, 1)
-
-        self.qtgui_time_sink_x_0.set_y_label('Amplitude', "")
-
-        self.qtgui_time_sink_x_0.enable_tags(True)
-        self.qtgui_time_sink_x_0.set_trigger_mode(qtgui.TRIG_MODE_FREE, qtgui.TRIG_SLOPE_POS, 0.0, 0, 0, "")
-        self.qtgui_time_sink_x_0.enable_autoscale(False)
-        self.qtgui_time_sink_x_0.enable_grid(False)
-        self.qtgui_time_sink_x_0.enable_axis_labels(True)
-        self.qtgui_time_sink_x_0.enable_control_panel(False)
-
-        if not True:
-            self.qtgui_time_sink_x_0.disable_legend()
-
-        labels = ['', '', '', '', '',
-                  '', '', '', '', '']
-        widths = [1, 1, 1, 1, 1,
-                  1, 1, 1, 1, 1]
-        colors = ["blue", "red", "green", "black", "cyan",
-                  "magenta", "yellow", "dark red", "dark green", "blue"]
-        styles = [1, 1, 1, 1, 1,
-                  1, 1, 1, 1, 1]
-        markers = [-1, -1, -1, -1, -1,
-                   -1, -1, -1, -1, -1]
-        alphas = [1.0, 1.0, 1.0, 1.0, 1.0,
-                  1.0, 1.0, 1.0, 1.0, 1.0]
-
-        for i in range(1):
-            if len(labels[i]) == 0:
-                self.qtgui_time_sink_x_0.set_line_label(i, "Data {0}".format(i))
-            else:
-                self.qtgui_time_sink_x_0.set_line_label(i, labels[i])
-            self.qtgui_time_sink_x_0.set_line_width(i, widths[i])
-            self.qtgui_time_sink_x_0.set_line_color(i, colors[i])
-            self.qtgui_time_sink_x_0.set_line_style(i, styles[i])
-            self.qtgui_time_sink_x_0.set_line_marker(i, markers[i])
-            self.qtgui_time_sink_x_0.set_line_alpha(i, alphas[i])
-
-        self._qtgui_time_sink_x_0_win = sip.wrapinstance(self.qtgui_time_sink_x_0.pyqwidget(), Qt.QWidget)
-        self.top_layout.addWidget(self._qtgui_time_sink_x_0_win)
-
         self.uhd_usrp_sink_0.set_samp_rate(samp_rate)
         self.uhd_usrp_sink_0.set_time_now(uhd.time_spec(time.time()), uhd.ALL_MBOARDS)
         self.uhd_usrp_sink_0.set_center_freq(
             uhd.tune_request(freq, rf_freq=freq - lo_offset, rf_freq_policy=uhd.tune_request.POLICY_MANUAL), 0)
         self.uhd_usrp_sink_0.set_normalized_gain(tx_gain, 0)
-        self.qtgui_const_sink_x_0 = qtgui.const_sink_c(
-            48 * 10,  # size
-            "",  # name
-            1  # number of inputs
-        )
-        self.qtgui_const_sink_x_0.set_update_time(0.10)
-        self.qtgui_const_sink_x_0.set_y_axis(-2, 2)
-        self.qtgui_const_sink_x_0.set_x_axis(-2, 2)
-        self.qtgui_const_sink_x_0.set_trigger_mode(qtgui.TRIG_MODE_FREE, qtgui.TRIG_SLOPE_POS, 0.0, 0, "")
-        self.qtgui_const_sink_x_0.enable_autoscale(False)
-        self.qtgui_const_sink_x_0.enable_grid(False)
-        self.qtgui_const_sink_x_0.enable_axis_labels(True)
-
-        if not True:
-            self.qtgui_const_sink_x_0.disable_legend()
-
-        labels = ['', '', '', '', '',
-                  '', '', '', '', '']
-        widths = [1, 1, 1, 1, 1,
-                  1, 1, 1, 1, 1]
-        colors = ["blue", "red", "red", "red", "red",
-                  "red", "red", "red", "red", "red"]
-        styles = [0, 0, 0, 0, 0,
-                  0, 0, 0, 0, 0]
-        markers = [0, 0, 0, 0, 0,
-                   0, 0, 0, 0, 0]
-        alphas = [1.0, 1.0, 1.0, 1.0, 1.0,
-                  1.0, 1.0, 1.0, 1.0, 1.0]
-        for i in range(1):
-            if len(labels[i]) == 0:
-                self.qtgui_const_sink_x_0.set_line_label(i, "Data {0}".format(i))
-            else:
-                self.qtgui_const_sink_x_0.set_line_label(i, labels[i])
-            self.qtgui_const_sink_x_0.set_line_width(i, widths[i])
-            self.qtgui_const_sink_x_0.set_line_color(i, colors[i])
-            self.qtgui_const_sink_x_0.set_line_style(i, styles[i])
-            self.qtgui_const_sink_x_0.set_line_marker(i, markers[i])
-            self.qtgui_const_sink_x_0.set_line_alpha(i, alphas[i])
-
-        self._qtgui_const_sink_x_0_win = sip.wrapinstance(self.qtgui_const_sink_x_0.pyqwidget(), Qt.QWidget)
-        self.top_layout.addWidget(self._qtgui_const_sink_x_0_win)
         self.ieee802_11_parse_mac_0 = ieee802_11.parse_mac(False, False)
 
         if wireshark:  # save the captured packets in pcap for record in Wireshark
@@ -369,49 +250,43 @@ class wifi_transceiver(gr.top_block, Qt.QWidget):
 
         self.foo_packet_pad2_0 = foo.packet_pad2(False, False, 0.001, 10000, 10000)
         (self.foo_packet_pad2_0).set_min_output_buffer(100000)
-        self.blocks_pdu_to_tagged_stream_0_0 = blocks.pdu_to_tagged_stream(blocks.complex_t, 'packet_len')
         self.blocks_multiply_const_vxx_0 = blocks.multiply_const_vcc((0.6,))
         (self.blocks_multiply_const_vxx_0).set_min_output_buffer(100000)
+        self.pdu_framer_0 = pdu_framer()
         self.blocks_socket_pdu_0 = blocks.socket_pdu("TCP_CLIENT", hostname, str(options['PHYRXport']))
-        self.probe_signal = blocks.probe_signal_f()
-        
-        self.signal_value = 0
+        # Carrier sensing: the power average of the PHY, one sample per cca_resolution seconds
+        cca_decimation = max(1, int(samp_rate * options.get('cca_resolution', 1e-5)))
+        self.blocks_keep_one_in_n_0 = blocks.keep_one_in_n(gr.sizeof_float, cca_decimation)
+        # bound the delay of a CCA update to cca_max_delay
+        self.blocks_keep_one_in_n_0.set_max_noutput_items(
+            max(1, int(options.get('cca_max_delay', 1e-3) * samp_rate / cca_decimation)))
+        self.cca = cca_detector(options.get('cca_threshold', -35), cca_decimation / samp_rate,
+                                options.get('cca_path') or None, options.get('cca_history', 4.0),
+                                options.get('cca_bin', 1e-4))
         self.msg_debug = blocks.message_debug()
 
         ##################################################
         # Connections
         ##################################################
-        self.msg_connect((self.wifi_phy_hier_0, 'carrier'), (self.blocks_pdu_to_tagged_stream_0_0, 'pdus'))
         self.msg_connect((self.wifi_phy_hier_0, 'mac_out'), (self.ieee802_11_parse_mac_0, 'in'))
-        self.msg_connect((self.wifi_phy_hier_0, 'mac_out'), (self.blocks_socket_pdu_0, "pdus"))
+        self.msg_connect((self.wifi_phy_hier_0, 'mac_out'), (self.pdu_framer_0, "pdus"))
+        self.msg_connect((self.pdu_framer_0, "pdus"), (self.blocks_socket_pdu_0, "pdus"))
         self.connect((self.blocks_multiply_const_vxx_0, 0), (self.foo_packet_pad2_0, 0))
-        self.connect((self.blocks_pdu_to_tagged_stream_0_0, 0), (self.qtgui_const_sink_x_0, 0))
         self.connect((self.foo_packet_pad2_0, 0), (self.uhd_usrp_sink_0, 0))
         self.connect((self.uhd_usrp_source_0, 0), (self.wifi_phy_hier_0, 0))
         self.connect((self.wifi_phy_hier_0, 0), (self.blocks_multiply_const_vxx_0, 0))
-        self.connect((self.wifi_phy_hier_0.blocks_moving_average_xx_1, 0), (self.probe_signal, 0))
-        self.connect((self.wifi_phy_hier_0.blocks_divide_xx_0, 0), (self.qtgui_time_sink_x_0, 0))
-        
-        self.monitor_thread = threading.Thread(target=self.monitor_signal)
-        self.monitor_thread.start()
-
-    def monitor_signal(self):
-        while True:
-            time.sleep(0.1)  # Adjust the sleep time as needed
-            self.signal_value = self.probe_signal.level()
-            
-            # Create a message based on the signal_value, for example:
-            # message = struct.pack('ff', signal_value[0],signal_value[1])
-            # f1, f2 = struct.unpack('ff', message)
-            # msg_pmt = pmt.init_f32vector(2,(signal_value[0],signal_value[1]))  # Convert the message to a pmt
-            
-            # Send the message to the msg_debug block
-            # self.msg_debug.to_basic_block()._post(pmt.intern("store"), msg_pmt)
-
-    def closeEvent(self, event):
-        self.settings = Qt.QSettings("GNU Radio", "wifi_transceiver")
-        self.settings.setValue("geometry", self.saveGeometry())
-        event.accept()
+        self.connect((self.wifi_phy_hier_0.blocks_moving_average_xx_1, 0), (self.blocks_keep_one_in_n_0, 0))
+        self.connect((self.blocks_keep_one_in_n_0, 0), (self.cca, 0))
+
+        cpu_affinity = options.get('cpu_affinity') or {}
+        if cpu_affinity.get('usrp'):
+            for block in (self.uhd_usrp_source_0, self.uhd_usrp_sink_0):
+                block.set_processor_affinity(cpu_affinity['usrp'])
+        if cpu_affinity.get('phy'):  # transmit and receive chains of the PHY, carrier sensing
+            for block in (self.wifi_phy_hier_0, self.ieee802_11_parse_mac_0, self.pdu_framer_0,
+                          self.blocks_socket_pdu_0, self.foo_packet_pad2_0, self.blocks_multiply_const_vxx_0,
+                          self.blocks_keep_one_in_n_0, self.cca):
+                block.set_processor_affinity(cpu_affinity['phy'])
 
     def get_tx_gain(self):
         return self.tx_gain
@@ -479,27 +354,287 @@ class wifi_transceiver(gr.top_block, Qt.QWidget):
     def send_pkt(self, pkt, encoding):
         """
         Send a packet from PHY to air. FCS (crc32) is not included
-        :param pkt: (string) PSDU to be sent
+        :param pkt: (bytes) PSDU to be sent
         :param encoding: data rate [0, 8)
         :return: none
         """
-        port = pmt.intern("in")  # message input port name of block mapper()
-        self.set_encoding(encoding)  # select data rate
-
-        # print "TX PKT: ", ','.join(x.encode('hex') for x in pkt)
-
-        crc_dict = pmt.make_dict()
-        crc_dict = pmt.dict_add(crc_dict, pmt.string_to_symbol("crc_included"), pmt.PMT_F)
-
-        p = pmt.make_u8vector(len(pkt), 0)
-        pkt1 = list(pkt)
-        for i in range(len(pkt1)):
-            pmt.u8vector_set(p, i, ord(pkt1[i]))
-
-        self.wifi_phy_hier_0.ieee802_11_mapper_0.to_basic_block()._post(port, pmt.cons(crc_dict, p))
+        # The data rate travels with the PDU, block mapper() applies it to this frame only, so control
+        # frames and DATA frames at different rates don't retune the flowgraph.
+        # The u8vector is built in a single call, from a bytearray rather than a list of ints (see
+        # pdu_framer.handle_pdu). It belongs to the flowgraph once posted, so only the immutable metadata
+        # is reused between PDUs.
+        pdu = pmt.cons(self.tx_meta[encoding], pmt.init_u8vector(len(pkt), bytearray(pkt)))
+        self.wifi_phy_hier_0.ieee802_11_mapper_0.to_basic_block()._post(self.mapper_port, pdu)
     
     def get_signal_value(self):
-        return self.signal_value
+        return self.cca.state.level
+
+
+if Qt is not None:
+    class wifi_transceiver(wifi_transceiver_headless, Qt.QWidget):
+        def __init__(self, options, hostname, wireshark=False):
+            wifi_transceiver_headless.__init__(self, options, hostname, wireshark)
+            Qt.QWidget.__init__(self)
+            self.setWindowTitle("Wifi Transceiver")
+            qtgui.util.check_set_qss()
+            try:
+                self.setWindowIcon(Qt.QIcon.fromTheme('gnuradio-grc'))
+            except:
+                pass
+            self.top_scroll_layout = Qt.QVBoxLayout()
+            self.setLayout(self.top_scroll_layout)
+            self.top_scroll = Qt.QScrollArea()
+            self.top_scroll.setFrameStyle(Qt.QFrame.NoFrame)
+            self.top_scroll_layout.addWidget(self.top_scroll)
+            self.top_scroll.setWidgetResizable(True)
+            self.top_widget = Qt.QWidget()
+            self.top_scroll.setWidget(self.top_widget)
+            self.top_layout = Qt.QVBoxLayout(self.top_widget)
+            self.top_grid_layout = Qt.QGridLayout()
+            self.top_layout.addLayout(self.top_grid_layout)
+
+            self.settings = Qt.QSettings("GNU Radio", "wifi_transceiver")
+            if self.settings.value("geometry") is not None:
+                self.restoreGeometry(self.settings.value("geometry").toByteArray())
+
+            tx_gain, samp_rate, rx_gain = self.tx_gain, self.samp_rate, self.rx_gain
+
+            ##################################################
+            # Widgets
+            ##################################################
+            self._tx_gain_range = Range(0, 1, 0.01, tx_gain, 200)
+            self._tx_gain_win = RangeWidget(self._tx_gain_range, self.set_tx_gain, "tx_gain", "counter_slider", float)
+            self.top_layout.addWidget(self._tx_gain_win)
+            self._samp_rate_options = [10e6, 20e6]
+            self._samp_rate_labels = ["10 MHz", "20 MHz"]
+            self._samp_rate_tool_bar = Qt.QToolBar(self)
+            self._samp_rate_tool_bar.addWidget(Qt.QLabel("samp_rate" + ": "))
+            self._samp_rate_combo_box = Qt.QComboBox()
+            self._samp_rate_tool_bar.addWidget(self._samp_rate_combo_box)
+            for label in self._samp_rate_labels: self._samp_rate_combo_box.addItem(label)
+            self._samp_rate_callback = lambda i: Qt.QMetaObject.invokeMethod(self._samp_rate_combo_box, "setCurrentIndex",
+                                                                             Qt.Q_ARG("int",
+                                                                                      self._samp_rate_options.index(i)))
+            self._samp_rate_callback(self.samp_rate)
+            self._samp_rate_combo_box.currentIndexChanged.connect(
+                lambda i: self.set_samp_rate(self._samp_rate_options[i]))
+            self.top_layout.addWidget(self._samp_rate_tool_bar)
+            self._rx_gain_range = Range(0, 1, 0.01, rx_gain, 200)
+            self._rx_gain_win = RangeWidget(self._rx_gain_range, self.set_rx_gain, "rx_gain", "counter_slider", float)
+            self.top_layout.addWidget(self._rx_gain_win)
+            self._lo_offset_options = (0, 6e6, 11e6,)
+            self._lo_offset_labels = (
+                str(self._lo_offset_options[0]), str(self._lo_offset_options[1]), str(self._lo_offset_options[2]),)
+            self._lo_offset_tool_bar = Qt.QToolBar(self)
+            self._lo_offset_tool_bar.addWidget(Qt.QLabel("lo_offset" + ": "))
+            self._lo_offset_combo_box = Qt.QComboBox()
+            self._lo_offset_tool_bar.addWidget(self._lo_offset_combo_box)
+            for label in self._lo_offset_labels: self._lo_offset_combo_box.addItem(label)
+            self._lo_offset_callback = lambda i: Qt.QMetaObject.invokeMethod(self._lo_offset_combo_box, "setCurrentIndex",
+                                                                             Qt.Q_ARG("int",
+                                                                                      self._lo_offset_options.index(i)))
+            self._lo_offset_callback(self.lo_offset)
+            self._lo_offset_combo_box.currentIndexChanged.connect(
+                lambda i: self.set_lo_offset(self._lo_offset_options[i]))
+            self.top_layout.addWidget(self._lo_offset_tool_bar)
+            self._freq_options = [2412000000.0, 2417000000.0, 2422000000.0, 2427000000.0, 2432000000.0, 2437000000.0,
+                                  2442000000.0, 2447000000.0, 2452000000.0, 2457000000.0, 2462000000.0, 2467000000.0,
+                                  2472000000.0, 2484000000.0, 5170000000.0, 5180000000.0, 5190000000.0, 5200000000.0,
+                                  5210000000.0, 5220000000.0, 5230000000.0, 5240000000.0, 5250000000.0, 5260000000.0,
+                                  5270000000.0, 5280000000.0, 5290000000.0, 5300000000.0, 5310000000.0, 5320000000.0,
+                                  5500000000.0, 5510000000.0, 5520000000.0, 5530000000.0, 5540000000.0, 5550000000.0,
+                                  5560000000.0, 5570000000.0, 5580000000.0, 5590000000.0, 5600000000.0, 5610000000.0,
+                                  5620000000.0, 5630000000.0, 5640000000.0, 5660000000.0, 5670000000.0, 5680000000.0,
+                                  5690000000.0, 5700000000.0, 5710000000.0, 5720000000.0, 5745000000.0, 5755000000.0,
+                                  5765000000.0, 5775000000.0, 5785000000.0, 5795000000.0, 5805000000.0, 5825000000.0,
+                                  5860000000.0, 5870000000.0, 5880000000.0, 5890000000.0, 5900000000.0, 5910000000.0,
+                                  5920000000.0]
+            self._freq_labels = ['  1 | 2412.0 | 11g', '  2 | 2417.0 | 11g', '  3 | 2422.0 | 11g', '  4 | 2427.0 | 11g',
+                                 '  5 | 2432.0 | 11g', '  6 | 2437.0 | 11g', '  7 | 2442.0 | 11g', '  8 | 2447.0 | 11g',
+                                 '  9 | 2452.0 | 11g', ' 10 | 2457.0 | 11g', ' 11 | 2462.0 | 11g', ' 12 | 2467.0 | 11g',
+                                 ' 13 | 2472.0 | 11g', ' 14 | 2484.0 | 11g', ' 34 | 5170.0 | 11a', ' 36 | 5180.0 | 11a',
+                                 ' 38 | 5190.0 | 11a', ' 40 | 5200.0 | 11a', ' 42 | 5210.0 | 11a', ' 44 | 5220.0 | 11a',
+                                 ' 46 | 5230.0 | 11a', ' 48 | 5240.0 | 11a', ' 50 | 5250.0 | 11a', ' 52 | 5260.0 | 11a',
+                                 ' 54 | 5270.0 | 11a', ' 56 | 5280.0 | 11a', ' 58 | 5290.0 | 11a', ' 60 | 5300.0 | 11a',
+                                 ' 62 | 5310.0 | 11a', ' 64 | 5320.0 | 11a', '100 | 5500.0 | 11a', '102 | 5510.0 | 11a',
+                                 '104 | 5520.0 | 11a', '106 | 5530.0 | 11a', '108 | 5540.0 | 11a', '110 | 5550.0 | 11a',
+                                 '112 | 5560.0 | 11a', '114 | 5570.0 | 11a', '116 | 5580.0 | 11a', '118 | 5590.0 | 11a',
+                                 '120 | 5600.0 | 11a', '122 | 5610.0 | 11a', '124 | 5620.0 | 11a', '126 | 5630.0 | 11a',
+                                 '128 | 5640.0 | 11a', '132 | 5660.0 | 11a', '134 | 5670.0 | 11a', '136 | 5680.0 | 11a',
+                                 '138 | 5690.0 | 11a', '140 | 5700.0 | 11a', '142 | 5710.0 | 11a', '144 | 5720.0 | 11a',
+                                 '149 | 5745.0 | 11a (SRD)', '151 | 5755.0 | 11a (SRD)', '153 | 5765.0 | 11a (SRD)',
+                                 '155 | 5775.0 | 11a (SRD)', '157 | 5785.0 | 11a (SRD)', '159 | 5795.0 | 11a (SRD)',
+                                 '161 | 5805.0 | 11a (SRD)', '165 | 5825.0 | 11a (SRD)', '172 | 5860.0 | 11p',
+                                 '174 | 5870.0 | 11p', '176 | 5880.0 | 11p', '178 | 5890.0 | 11p', '180 | 5900.0 | 11p',
+                                 '182 | 5910.0 | 11p', '184 | 5920.0 | 11p']
+            self._freq_tool_bar = Qt.QToolBar(self)
+            self._freq_tool_bar.addWidget(Qt.QLabel("freq" + ": "))
+            self._freq_combo_box = Qt.QComboBox()
+            self._freq_tool_bar.addWidget(self._freq_combo_box)
+            for label in self._freq_labels: self._freq_combo_box.addItem(label)
+            self._freq_callback = lambda i: Qt.QMetaObject.invokeMethod(self._freq_combo_box, "setCurrentIndex",
+                                                                        Qt.Q_ARG("int", self._freq_options.index(i)))
+            self._freq_callback(self.freq)
+            self._freq_combo_box.currentIndexChanged.connect(
+                lambda i: self.set_freq(self._freq_options[i]))
+            self.top_layout.addWidget(self._freq_tool_bar)
+            self._encoding_options = [0, 1, 2, 3, 4, 5, 6, 7]
+            self._encoding_labels = ["BPSK 1/2", "BPSK 3/4", "QPSK 1/2", "QPSK 3/4", "16QAM 1/2", "16QAM 3/4", "64QAM 2/3",
+                                     "64QAM 3/4"]
+            self._encoding_group_box = Qt.QGroupBox("encoding")
+            self._encoding_box = Qt.QHBoxLayout()
+
+            class variable_chooser_button_group(Qt.QButtonGroup):
+                def __init__(self, parent=None):
+                    Qt.QButtonGroup.__init__(self, parent)
+
+                @pyqtSlot(int)
+                def updateButtonChecked(self, button_id):
+                    self.button(button_id).setChecked(True)
+
+            self._encoding_button_group = variable_chooser_button_group()
+            self._encoding_group_box.setLayout(self._encoding_box)
+            for i, label in enumerate(self._encoding_labels):
+                radio_button = Qt.QRadioButton(label)
+                self._encoding_box.addWidget(radio_button)
+                self._encoding_button_group.addButton(radio_button, i)
+            self._encoding_callback = lambda i: Qt.QMetaObject.invokeMethod(self._encoding_button_group,
+                                                                            "updateButtonChecked", Qt.Q_ARG("int",
+                                                                                                            self._encoding_options.index(
+                                                                                                                i)))
+            self._encoding_callback(self.encoding)
+            self._encoding_button_group.buttonClicked[int].connect(
+                lambda i: self.set_encoding(self._encoding_options[i]))
+            self.top_layout.addWidget(self._encoding_group_box)
+            self._chan_est_options = [ieee802_11.LS, ieee802_11.LMS, ieee802_11.STA, ieee802_11.COMB]
+            self._chan_est_labels = ["LS", "LMS", "STA", "Linear Comb"]
+            self._chan_est_group_box = Qt.QGroupBox("chan_est")
+            self._chan_est_box = Qt.QHBoxLayout()
+
+            class variable_chooser_button_group(Qt.QButtonGroup):
+                def __init__(self, parent=None):
+                    Qt.QButtonGroup.__init__(self, parent)
+
+                @pyqtSlot(int)
+                def updateButtonChecked(self, button_id):
+                    self.button(button_id).setChecked(True)
+
+            self._chan_est_button_group = variable_chooser_button_group()
+            self._chan_est_group_box.setLayout(self._chan_est_box)
+            for i, label in enumerate(self._chan_est_labels):
+                radio_button = Qt.QRadioButton(label)
+                self._chan_est_box.addWidget(radio_button)
+                self._chan_est_button_group.addButton(radio_button, i)
+            self._chan_est_callback = lambda i: Qt.QMetaObject.invokeMethod(self._chan_est_button_group,
+                                                                            "updateButtonChecked", Qt.Q_ARG("int",
+                                                                                                            self._chan_est_options.index(
+                                                                                                                i)))
+            self._chan_est_callback(self.chan_est)
+            self._chan_est_button_group.buttonClicked[int].connect(
+                lambda i: self.set_chan_est(self._chan_est_options[i]))
+            self.top_layout.addWidget(self._chan_est_group_box)
+            self.qtgui_time_sink_x_0 = qtgui.time_sink_f(
+                1024,  # size
+                samp_rate,  # samp_rate
+                "",  # name
+                1  # number of inputs
+            )
+            self.qtgui_time_sink_x_0.set_update_time(0.10)
+            self.qtgui_time_sink_x_0.set_y_axis(-1, 1)
+
+            self.qtgui_time_sink_x_0.set_y_label('Amplitude', "")
+
+            self.qtgui_time_sink_x_0.enable_tags(True)
+            self.qtgui_time_sink_x_0.set_trigger_mode(qtgui.TRIG_MODE_FREE, qtgui.TRIG_SLOPE_POS, 0.0, 0, 0, "")
+            self.qtgui_time_sink_x_0.enable_autoscale(False)
+            self.qtgui_time_sink_x_0.enable_grid(False)
+            self.qtgui_time_sink_x_0.enable_axis_labels(True)
+            self.qtgui_time_sink_x_0.enable_control_panel(False)
+
+            if not True:
+                self.qtgui_time_sink_x_0.disable_legend()
+
+            labels = ['', '', '', '', '',
+                      '', '', '', '', '']
+            widths = [1, 1, 1, 1, 1,
+                      1, 1, 1, 1, 1]
+            colors = ["blue", "red", "green", "black", "cyan",
+                      "magenta", "yellow", "dark red", "dark green", "blue"]
+            styles = [1, 1, 1, 1, 1,
+                      1, 1, 1, 1, 1]
+            markers = [-1, -1, -1, -1, -1,
+                       -1, -1, -1, -1, -1]
+            alphas = [1.0, 1.0, 1.0, 1.0, 1.0,
+                      1.0, 1.0, 1.0, 1.0, 1.0]
+
+            for i in range(1):
+                if len(labels[i]) == 0:
+                    self.qtgui_time_sink_x_0.set_line_label(i, "Data {0}".format(i))
+                else:
+                    self.qtgui_time_sink_x_0.set_line_label(i, labels[i])
+                self.qtgui_time_sink_x_0.set_line_width(i, widths[i])
+                self.qtgui_time_sink_x_0.set_line_color(i, colors[i])
+                self.qtgui_time_sink_x_0.set_line_style(i, styles[i])
+                self.qtgui_time_sink_x_0.set_line_marker(i, markers[i])
+                self.qtgui_time_sink_x_0.set_line_alpha(i, alphas[i])
+
+            self._qtgui_time_sink_x_0_win = sip.wrapinstance(self.qtgui_time_sink_x_0.pyqwidget(), Qt.QWidget)
+            self.top_layout.addWidget(self._qtgui_time_sink_x_0_win)
+
+            self.qtgui_const_sink_x_0 = qtgui.const_sink_c(
+                48 * 10,  # size
+                "",  # name
+                1  # number of inputs
+            )
+            self.qtgui_const_sink_x_0.set_update_time(0.10)
+            self.qtgui_const_sink_x_0.set_y_axis(-2, 2)
+            self.qtgui_const_sink_x_0.set_x_axis(-2, 2)
+            self.qtgui_const_sink_x_0.set_trigger_mode(qtgui.TRIG_MODE_FREE, qtgui.TRIG_SLOPE_POS, 0.0, 0, "")
+            self.qtgui_const_sink_x_0.enable_autoscale(False)
+            self.qtgui_const_sink_x_0.enable_grid(False)
+            self.qtgui_const_sink_x_0.enable_axis_labels(True)
+
+            if not True:
+                self.qtgui_const_sink_x_0.disable_legend()
+
+            labels = ['', '', '', '', '',
+                      '', '', '', '', '']
+            widths = [1, 1, 1, 1, 1,
+                      1, 1, 1, 1, 1]
+            colors = ["blue", "red", "red", "red", "red",
+                      "red", "red", "red", "red", "red"]
+            styles = [0, 0, 0, 0, 0,
+                      0, 0, 0, 0, 0]
+            markers = [0, 0, 0, 0, 0,
+                       0, 0, 0, 0, 0]
+            alphas = [1.0, 1.0, 1.0, 1.0, 1.0,
+                      1.0, 1.0, 1.0, 1.0, 1.0]
+            for i in range(1):
+                if len(labels[i]) == 0:
+                    self.qtgui_const_sink_x_0.set_line_label(i, "Data {0}".format(i))
+                else:
+                    self.qtgui_const_sink_x_0.set_line_label(i, labels[i])
+                self.qtgui_const_sink_x_0.set_line_width(i, widths[i])
+                self.qtgui_const_sink_x_0.set_line_color(i, colors[i])
+                self.qtgui_const_sink_x_0.set_line_style(i, styles[i])
+                self.qtgui_const_sink_x_0.set_line_marker(i, markers[i])
+                self.qtgui_const_sink_x_0.set_line_alpha(i, alphas[i])
+
+            self._qtgui_const_sink_x_0_win = sip.wrapinstance(self.qtgui_const_sink_x_0.pyqwidget(), Qt.QWidget)
+            self.top_layout.addWidget(self._qtgui_const_sink_x_0_win)
+            self.blocks_pdu_to_tagged_stream_0_0 = blocks.pdu_to_tagged_stream(blocks.complex_t, 'packet_len')
+
+            ##################################################
+            # Connections
+            ##################################################
+            self.msg_connect((self.wifi_phy_hier_0, 'carrier'), (self.blocks_pdu_to_tagged_stream_0_0, 'pdus'))
+            self.connect((self.blocks_pdu_to_tagged_stream_0_0, 0), (self.qtgui_const_sink_x_0, 0))
+            self.connect((self.wifi_phy_hier_0.blocks_divide_xx_0, 0), (self.qtgui_time_sink_x_0, 0))
+
+        def closeEvent(self, event):
+            self.settings = Qt.QSettings("GNU Radio", "wifi_transceiver")
+            self.settings.setValue("geometry", self.saveGeometry())
+            event.accept()
 
 
 class rx_client(threading.Thread):
@@ -512,13 +647,16 @@ class rx_client(threading.Thread):
     :param print_buffer: flag of printing buffer size
     :param print_beacon: flag of printing beacons
     :param short_beacon_info: True - print partial Beacon info
+    :param rx_queues: queues of the received frames (mac.RxQueues), shared with proc_mac_request
     :return: none
     """
 
-    def __init__(self, PHYRXport, my_mac, node, print_buffer=False, print_beacon=False, short_beacon_info=True):
+    def __init__(self, PHYRXport, my_mac, node, print_buffer=False, print_beacon=False, short_beacon_info=True,
+                 rx_queues=None):
         threading.Thread.__init__(self)
 
         self.my_mac = my_mac
+        self.my_macs = {my_mac}  # DATA / ACK receivers served by this PHY (logical stations, see add_address)
         self.node = node
         self.print_buffer = print_buffer
         self.print_beacon = print_beacon
@@ -533,55 +671,98 @@ class rx_client(threading.Thread):
         self.start_time = time.time()
         self.running = True
 
+        self.subscriber = None  # callback of a MAC session subscribed to frame events
+        self.subscriber_lock = threading.Lock()
+        self.rx_queues = rx_queues if rx_queues is not None else mac.RxQueues()
+
+        self.neighbours = mac.NeighbourTable()  # nodes heard through their beacons
+        self.signal_level = None  # function returning the power level of the probe (wifi_transceiver)
+
+    def subscribe(self, callback):
+        """
+        Push every classified frame to callback(packet) instead of queueing it for TAIL requests.
+        Frames already queued are pushed first.
+        :param callback: function taking the raw MPDU
+        :return: none
+        """
+        with self.subscriber_lock:
+            for frame in self.rx_queues.drain(("RTS", "DATA", "CTS", "ACK")):
+                callback(frame["packet"])
+            self.subscriber = callback
+
+    def unsubscribe(self, callback=None):
+        """
+        Stop pushing frames
+        :param callback: only stop if it is the subscribed callback (e.g. the session that closes), None: always
+        :return: none
+        """
+        with self.subscriber_lock:
+            if callback is None or self.subscriber == callback:
+                self.subscriber = None
+
+    def add_address(self, mac_addr):
+        """
+        Accept the DATA and ACK frames addressed to another local MAC address
+        :param mac_addr: MAC address (6 bytes)
+        :return: none
+        """
+        self.my_macs = self.my_macs | {mac_addr}
+
+    def deliver(self, info, queue):
+        """
+        Hand a received frame to the subscribed MAC, or queue it until the MAC asks for it
+        :param info: received frame (see mac.MacFrame)
+        :param queue: frame type in rx_queues, None if frames of this type are not queued
+        :return: none
+        """
+        with self.subscriber_lock:
+            if self.subscriber is not None:
+                try:
+                    self.subscriber(info["packet"])
+                    return
+                except (ConnectionError, OSError):  # MAC session lost
+                    self.subscriber = None
+            if queue is not None:
+                self.rx_queues.put(queue, info)
+
+    def dispatch(self, frames):
+        """
+        Classify a batch of received frames and hand them to the MAC
+        :param frames: list of mac.MacFrame
+        :return: none
+        """
+        for frame in frames:
+            header = frame.header
+
+            if "DATA" == header or "DATA_FRAG" == header:  # DATA
+                if frame.addr1 in self.my_macs:  # Is DATA addressed to this node?
+                    self.deliver(frame, "DATA")
+                    self.total_received_bytes += len(frame) - mac.DATA_HEADER_LEN
+                else:
+                    self.rx_queues.put("OTHER", frame)
+            elif "ACK" == header:  # ACK
+                if frame.addr1 in self.my_macs:  # Is ACK addressed to this node?
+                    self.deliver(frame, "ACK")
+            elif "RTS" == header:  # RTS
+                self.deliver(frame, "RTS")
+            elif "CTS" == header:  # CTS
+                self.deliver(frame, "CTS")
+            elif "BEACON" == header:  # BEACON
+                self.deliver(frame, None)
+                rssi = self.signal_level() if self.signal_level is not None else 0.0
+                self.neighbours.update(frame, rssi)  # Update the state of the AP
+
     def run(self):
         print_msg("rx_client starts to check received packets from PHY (class wifi_transceiver)", self.node)
         self.phy_rx_client, _ = self.phy_rx_server.accept()  # accept connections from outside
+        reader = mac.FrameReader(self.phy_rx_client)
 
         while self.running:
-            # PHY 802.11 frame arrival from the wireless medium
-            pkt = self.phy_rx_client.recv(10000)
-            arrived_packet = mac.parse_mac(pkt)
-
-            if "DATA" == arrived_packet["HEADER"] or "DATA_FRAG" == arrived_packet["HEADER"]:  # DATA
-                if self.my_mac == arrived_packet["DATA"]["mac_add1"]:  # Is DATA addressed to this node?
-                    data.put(arrived_packet["DATA"])
-                    self.total_received_bytes += len(arrived_packet["DATA"]["DATA"])
-                else:
-                    other.put("random data")
-            elif "ACK" == arrived_packet["HEADER"]:  # ACK
-                if self.my_mac == arrived_packet["DATA"]["RX_add"]:  # Is ACK addressed to this node?
-                    ack.put(arrived_packet["DATA"])
-            elif "RTS" == arrived_packet["HEADER"]:  # RTS
-                rts.put(arrived_packet["DATA"])
-            elif "CTS" == arrived_packet["HEADER"]:  # CTS
-                cts.put(arrived_packet["DATA"])
-            elif "BEACON" == arrived_packet["HEADER"]:  # BEACON
-                beacon = arrived_packet["DATA"]
-                msg = plcp.new_beacon()
-                msg["MAC"] = beacon["mac_add2"]
-                msg["SSID"] = beacon["SSID"]
-                msg["timestamp"] = beacon["timestamp"]
-                msg["BI"] = beacon["BI"]
-                msg["OFFSET"] = time.time() - beacon["timestamp"]
-                x = bcn.qsize()
-                updated = False
-                mac_bcn = msg["MAC"]
-
-                # Update the beacon list
-                while x > 0:
-                    tmp = bcn.get()
-                    if mac_bcn != tmp["MAC"]:
-                        bcn.put(tmp)
-                        x -= 1
-                    else:  # Update the AP state
-                        bcn.put(msg)
-                        updated = True
-                        break
-
-                if not updated:  # AP is not in the list
-                    bcn.put(msg)
-            else:
-                continue
+            # PHY 802.11 frame arrivals from the wireless medium, all the frames received so far at once
+            frames = reader.read_batch()
+            if frames is None:  # PHY flowgraph stopped
+                break
+            self.dispatch(frames)
 
             if (time.time() - self.start_time) >= 1:  # Update throughput every 1 second
                 throughput = self.total_received_bytes / (time.time() - self.start_time)
@@ -592,33 +773,26 @@ class rx_client(threading.Thread):
             if self.print_buffer:
                 # Queue size
                 print_msg("=========== BUFFER STATUS ===========", self.node)
-                print_msg("DATA   [%i]" % data.qsize(), self.node)
-                print_msg("ACK    [%i]" % ack.qsize(), self.node)
-                print_msg("RTS    [%i]" % rts.qsize(), self.node)
-                print_msg("CTS    [%i]" % cts.qsize(), self.node)
-                print_msg("BEACON [%i]" % bcn.qsize(), self.node)
-                print_msg("OTHER  [%i]" % other.qsize(), self.node)
+                print_msg("         QUEUED RECEIVED OVERFLOW EXPIRED", self.node)
+                for header, stats in self.rx_queues.stats().items():
+                    print_msg("%-6s %8i %8i %8i %7i" % (header, stats["queued"], stats["received"], stats["overflow"],
+                                                        stats["expired"]), self.node)
+                print_msg("BEACON %8i" % len(self.neighbours), self.node)
 
             if self.print_beacon:
                 # Beacon list
                 print_msg("===== NEIGHBOR NODES INFORMATION ====", self.node)
-                x = bcn.qsize()
                 if self.short_beacon_info:
                     print_msg("      MAC             SSID", self.node)
-                    while x > 0:
-                        item = bcn.get()
+                    for item in self.neighbours.snapshot():
                         print_msg("%s %s" % (mac.format_mac(item["MAC"]), item["SSID"]), self.node)
-                        bcn.put(item)
-                        x -= 1
 
                 else:
-                    print_msg("      MAC           Timestamp   BI      OFFSET         SSID", self.node)
-                    while x > 0:
-                        item = bcn.get()
-                        print_msg("%s %d %s %d %s" % (
-                            mac.format_mac(item["MAC"]), item["timestamp"], item["BI"], item["OFFSET"], item["SSID"]), self.node)
-                        bcn.put(item)
-                        x -= 1
+                    print_msg("      MAC           Timestamp   BI      OFFSET         SSID   RSSI   LAST SEEN", self.node)
+                    for item in self.neighbours.snapshot():
+                        print_msg("%s %d %s %d %s %.3f %.3f" % (
+                            mac.format_mac(item["MAC"]), item["timestamp"], item["BI"], item["OFFSET"], item["SSID"],
+                            item["RSSI"], item["last_seen"]), self.node)
                 print_msg("=====================================", self.node)
 
     def stop(self):
@@ -633,20 +807,46 @@ class rx_client(threading.Thread):
 class proc_mac_request(threading.Thread):
     """
     Process request from MAC layer
+    Requests arrive on a persistent TCP session (see mac.TcpTransport), on a Unix socket session
+    with MPDUs in shared memory (see mac.UnixTransport, only if 'unix_path' is configured), or as
+    direct calls to handle() when the MAC runs in the same process (see mac.InProcessTransport).
     :param options: TX parameters
     :param wifi_transceiver: wifi_transceiver class
+    :param rx_client: rx_client thread, pushes received frames to a subscribed MAC
+    :param rx_queues: queues of the received frames (mac.RxQueues), default: the ones of rx_client
     :return: none
     """
 
-    def __init__(self, options, wifi_transceiver):
+    def __init__(self, options, wifi_transceiver, rx_client=None, rx_queues=None):
         threading.Thread.__init__(self)
 
         self.wifi_transceiver = wifi_transceiver
+        self.rx_client = rx_client
+        if rx_queues is None:
+            rx_queues = rx_client.rx_queues if rx_client is not None else mac.RxQueues()
+        self.rx_queues = rx_queues
+        self.send_lock = threading.Lock()  # answers and pushed frames share the MAC session
         self.node = options['node']
         self.samp_rate = options['samp_rate']
         self.verbose = options['verbose']
         self.msg_debug = blocks.message_debug()
+        # Scheduling of the threads serving the MAC sessions, set once when they start
+        self.cpu_affinity = (options.get('cpu_affinity') or {}).get('mac_request')
+        self.priority = options.get('mac_request_priority', 0)
 
+        # Initial values of variables used in time measurement
+        self.t_socket_TOTAL = 0  # Total time of socket communication
+        self.T_sense_USRP2 = 0  # Time of the USRP2 measuring the power
+        self.T_sense_PHY = 0  # Time elapsed in PHY layer due to a carrier sensing request
+        self.T_transmit_USRP2 = 0  # USRP2 TX time
+        self.T_configure_USRP2 = 0  # Time due to USRP2 graph management
+        self.T_transmit_PHY = 0  # Time elapsed in PHY layer due to a packet tx request
+
+        self.n_ack_rx = 0  # Number of ACK received
+        self.n_data_tx = 0  # Number of packets sent
+        self.n_data_retx = 0  # Number of retransmitted DATA frame
+        self.n_data_rx = 0  # Number of DATA frame received (always equal to n_ack_tx)
+        self.n_cca = 0  # Number of power measurements (0: disable carrier sensing)
 
         # Stream sockets to ensure no packet loss during PHY<-->MAC communication
         self.server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
@@ -654,145 +854,253 @@ class proc_mac_request(threading.Thread):
         self.server.bind((socket.gethostname(), options['PHYport']))
         self.server.listen(1)  # PHY is ready to attend MAC requests
 
+        # Unix socket for a MAC running on the same host (no TCP/IP stack, MPDUs in shared memory)
+        self.unix_path = options.get('unix_path')
+        self.unix_server = None
+        if self.unix_path:
+            if os.path.exists(self.unix_path):  # Stale socket of a previous run
+                os.unlink(self.unix_path)
+            self.unix_server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            self.unix_server.bind(self.unix_path)
+            self.unix_server.listen(1)
+
         self.running = True
 
     def run(self):
-        # Initial values of variables used in time measurement
-        t_socket_TOTAL = 0  # Total time of socket communication
-        T_sense_USRP2 = 0  # Time of the USRP2 measuring the power
-        T_sense_PHY = 0  # Time elapsed in PHY layer due to a carrier sensing request
-        T_transmit_USRP2 = 0  # USRP2 TX time
-        T_configure_USRP2 = 0  # Time due to USRP2 graph management
-        T_transmit_PHY = 0  # Time elapsed in PHY layer due to a packet tx request
-
-        n_ack_rx = 0  # Number of ACK received
-        n_data_tx = 0  # Number of packets sent
-        n_data_retx = 0  # Number of retransmitted DATA frame
-        n_data_rx = 0  # Number of DATA frame received (always equal to n_ack_tx)
-        n_cca = 0  # Number of power measurements (0: disable carrier sensing)
-
+        set_thread_scheduling(self.cpu_affinity, self.priority, self.node)
+        if self.unix_server is not None:
+            unix_thread = threading.Thread(target=self._serve, args=(self.unix_server,), name="phy-unix")
+            unix_thread.daemon = True
+            unix_thread.start()
+        self._serve(self.server)
+
+    def _serve(self, server):
+        """
+        Accept MAC sessions on a listening socket, each one served by its own thread, so that a
+        persistent MAC session doesn't keep other MACs or tools waiting
+        :param server: listening socket (TCP or Unix)
+        :return: none
+        """
         while self.running:
-            socket_client, _ = self.server.accept()  # Waiting a request from the MAC layer
-            arrived_packet = plcp.receive_from_mac(socket_client)  # Packet received from MAC
+            try:
+                socket_client, _ = server.accept()  # Waiting for a MAC layer to open its session
+            except OSError:  # Server closed by stop()
+                break
+            session = threading.Thread(target=self._serve_session, args=(socket_client,), name="phy-session")
+            session.daemon = True
+            session.start()
+
+    def _serve_session(self, socket_client):
+        """
+        Serve the requests of one MAC session until the MAC closes it
+        :param socket_client: socket of the session
+        :return: none
+        """
+        set_thread_scheduling(self.cpu_affinity, self.priority, self.node)
+        if socket_client.family == socket.AF_INET:
+            socket_client.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        mac_session = plcp.MessageReader(socket_client)
+        ring = None  # Shared-memory ring of the MAC, if it sends MPDUs out of band
 
-            print_stat = False
-            if "PKT" == arrived_packet["HEADER"]:
-                print_msg("Mac requests a packet transmission", self.node, False)
+        def push(pkt, sd=socket_client):
+            self.push_frame(sd, pkt)
+
+        try:
+            while self.running:
+                try:
+                    arrived_packet = mac_session.read()  # Packet received from MAC
+                except plcp.MessageError as error:  # Malformed message, the next ones can still be read
+                    print_msg("Invalid MAC request %s: %s" % (error.header, error), self.node)
+                    if error.header in ("PKT", "PKT_SHM") or self._reply(socket_client, plcp.create_packet("NO", ""),
+                                                                         error.req_id):
+                        continue
+                    break
+                except (ValueError, OSError) as error:  # Corrupted stream or broken connection: drop the session
+                    print_msg("MAC session closed: %s" % error, self.node)
+                    break
+                if arrived_packet is None:  # MAC closed the session
+                    break
+
+                try:
+                    if "SHM" == arrived_packet["HEADER"]:  # MAC shares its ring for the MPDUs
+                        try:
+                            ring = plcp.ShmRing(arrived_packet["DATA"].decode())
+                            reply = plcp.create_packet("YES", "")
+                        except (OSError, ValueError):
+                            reply = plcp.create_packet("NO", "")
+                    else:
+                        if "PKT_SHM" == arrived_packet["HEADER"]:  # Copy the MPDU out of the ring
+                            if ring is None:
+                                raise ValueError("PKT_SHM before the MAC shared its ring (SHM)")
+                            info = arrived_packet["DATA"]["INFO"]
+                            info["packet"] = ring.get(*info.pop("shm"))
+                            arrived_packet["HEADER"] = "PKT"
+                        reply = self.handle(arrived_packet, push)
+                except (KeyError, ValueError, TypeError, struct.error) as error:  # Request with an invalid payload
+                    print_msg("Invalid MAC request %s: %s" % (arrived_packet["HEADER"], error), self.node)
+                    reply = None if arrived_packet["HEADER"] in ("PKT", "PKT_SHM") else plcp.create_packet("NO", "")
+                if reply is not None and not self._reply(socket_client, reply, arrived_packet["ID"]):
+                    break
+        finally:  # Also if the session thread fails on an unexpected error
+            if self.rx_client is not None:
+                self.rx_client.unsubscribe(push)  # Only if this session is the subscribed one
+            if ring is not None:
+                ring.close()
+            socket_client.close()
+
+    def handle(self, arrived_packet, push=None):
+        """
+        Serve one request of the MAC layer
+        :param arrived_packet: crosslayer packet received from MAC
+        :param push: function taking a raw MPDU, used to push received frames if the MAC subscribes
+        :return: answer to the MAC, None if the request expects no answer
+        """
+        reply = None
+        print_stat = False
+        if "PKT" == arrived_packet["HEADER"]:
+            print_msg("Mac requests a packet transmission", self.node, False)
+            print_stat = True
+            pkt_type = arrived_packet["DATA"]["HEADER"]
+            if "DATA" == pkt_type:
+                self.n_data_tx += 1
+            elif "DATA_RETX" == pkt_type:
+                self.n_data_retx += 1
+            t_socket = time.time() - arrived_packet["DATA"]["INFO"]["timestamp"]
+            self.t_socket_TOTAL += t_socket  # Update the time used in the socket communication.
+
+            t_sendA = time.time()
+            item = plcp.to_bytes(arrived_packet["DATA"]["INFO"]["packet"])  # Copy the packet to send from the MAC message
+
+            t_2 = time.time()  # TODO: fix the timestamps
+            t_sendB = time.time()
+
+            self.wifi_transceiver.send_pkt(item, arrived_packet["DATA"]["INFO"]["encoding"])
+
+            t_sendC = time.time()
+            t_sendD = time.time()
+            print_msg("Time elapsed on graph configuration (TX Packet) = %f" % (t_sendB - t_2), self.node,
+                      self.verbose)
+            self.T_transmit_USRP2 += t_sendC - t_sendB
+            self.T_configure_USRP2 += t_sendD - t_sendA - (t_sendC - t_sendB)
+            self.T_transmit_PHY += t_sendD - t_sendA
+
+        elif "CCA" == arrived_packet["HEADER"]:  # Carrier sensing request
+            print_msg("Mac requests a CCA", self.node, False)
+            t_senseA = time.time()
+            t_reconfig = time.time() - t_senseA
+            signal_value = self.wifi_transceiver.get_signal_value()  # Last power level of the energy detector
+            t_senseB = time.time()
+
+            reply = plcp.create_packet("CCA", float(signal_value))
+            t_senseC = time.time()
+            self.T_sense_USRP2 += t_senseB - t_senseA
+            self.T_sense_PHY += t_senseC - t_senseA
+            self.n_cca += 1
+            print_msg("Time elapsed on graph configuration (Carrier Sensing) = %f" % t_reconfig, self.node,
+                      self.verbose)
+
+        elif "TAIL" == arrived_packet["HEADER"]:  # MAC requests an incoming packet from the PHY
+            header_pkt = plcp.to_bytes(arrived_packet["DATA"]).decode("latin-1")
+            print_msg("Mac requests PHY to report a %s pkt" % header_pkt, self.node, False)
+
+            frame = self.rx_queues.get(header_pkt) if header_pkt in mac.RX_QUEUE_TYPES else None
+
+            if header_pkt == "DATA" and frame is not None:  # There are Data packets?
                 print_stat = True
-                pkt_type = arrived_packet["DATA"]["HEADER"]
-                if "DATA" == pkt_type:
-                    n_data_tx += 1
-                elif "DATA_RETX" == pkt_type:
-                    n_data_retx += 1
-                t_socket = time.time() - arrived_packet["DATA"]["INFO"]["timestamp"]
-                t_socket_TOTAL = t_socket_TOTAL + t_socket  # Update the time used in the socket communication.
-
-                t_sendA = time.time()
-                item = arrived_packet["DATA"]["INFO"]["packet"]  # Copy the packet to send from the MAC message
-
-                r = gr.enable_realtime_scheduling()
-                print_msg("Warning: failed to enable realtime scheduling", self.node, r != gr.RT_OK)
-                t_2 = time.time()  # TODO: fix the timestamps
-                t_sendB = time.time()
-
-                self.wifi_transceiver.send_pkt(item, arrived_packet["DATA"]["INFO"]["encoding"])
-
-                t_sendC = time.time()
-                t_sendD = time.time()
-                print_msg("Time elapsed on graph configuration (TX Packet) = %f" % (t_sendB - t_2), self.node,
-                          self.verbose)
-                T_transmit_USRP2 = T_transmit_USRP2 + t_sendC - t_sendB
-                T_configure_USRP2 = T_configure_USRP2 + t_sendD - t_sendA - (t_sendC - t_sendB)
-                T_transmit_PHY = T_transmit_PHY + t_sendD - t_sendA
-
-            elif "CCA" == arrived_packet["HEADER"]:  # Carrier sensing request
-                print_msg("Mac requests a CCA", self.node, False)
-                t_senseA = time.time()
-                
-                # Check if there's a message available
-                # if self.msg_debug.num_messages() > 0:
-
-                # msg_pmt = self.msg_debug.get_message()
-                # msg_data = pmt.to_python(msg_pmt)  # Convert the message from pmt to a Python object
-                
-                t_reconfig = time.time() - t_senseA
-                signal_value = self.wifi_transceiver.get_signal_value()
-                # Unpack the message data
-                # msgdata = struct.unpack('%df' % (int(len(msg_data) / 4),), msg_data)
-                # sensed_power = msgdata[0]
-                t_senseB = time.time()
-
-                packet = plcp.create_packet("CCA", signal_value)
-                plcp.send_to_mac(socket_client, packet)
-                t_senseC = time.time()
-                T_sense_USRP2 = T_sense_USRP2 + (t_senseB - t_senseA)
-                T_sense_PHY = T_sense_PHY + (t_senseC - t_senseA)
-                n_cca += 1
-                print_msg("Time elapsed on graph configuration (Carrier Sensing) = %f" % t_reconfig, self.node,
-                        self.verbose)
-
-            elif "TAIL" == arrived_packet["HEADER"]:  # MAC requests an incoming packet from the PHY
-                header_pkt = arrived_packet["DATA"]
-                print_msg("Mac requests PHY to report a %s pkt" % header_pkt, self.node, False)
-
-                if header_pkt == "DATA" and not len(data)==0:  # There are Data packets?
-                    print_stat = True
-                    n_data_rx += 1
-                    phy_pkt = plcp.create_packet("YES", data.get())
-
-                elif header_pkt == "ACK" and not len(ack)==0:  # There are ACK packets?
-                    print_stat = True
-                    n_ack_rx += 1
-                    phy_pkt = plcp.create_packet("YES", ack.get())
-
-                elif header_pkt == "RTS" and not len(rts)==0:  # There are RTS packets?
-                    phy_pkt = plcp.create_packet("YES", rts.get())
-
-                elif header_pkt == "CTS" and not len(cts)==0:  # There are CTS packets?
-                    phy_pkt = plcp.create_packet("YES", cts.get())
-
-                elif header_pkt == "NODE":
-                    phy_pkt = plcp.create_packet("YES", self.node)
-
-                elif header_pkt == "SAMP_RATE":
-                    phy_pkt = plcp.create_packet("YES", self.samp_rate)
-
-                else:  # There are no packets
-                    phy_pkt = plcp.create_packet("NO", [])
-
-                plcp.send_to_mac(socket_client, phy_pkt)  # Send the result (PHY packet) to MAC layer
-
-            if self.verbose and n_cca > 0:
-                print_msg("===================== Average statistics ====================", self.node)
-                print_msg("No. of carrier sensing requests = %d" % n_cca, self.node)
-                print_msg("Time spent by USRP2 on sensing channel = %f" % (T_sense_USRP2 / n_cca), self.node)
-                print_msg("Time spent by PHY layer on sensing channel = %f" % (T_sense_PHY / n_cca), self.node)
-                n_ack_rx = 0  # Number of ACK received
-                n_data_tx = 0  # Number of packets sent
-                n_data_retx = 0  # Number of retransmitted DATA frame
-                n_data_rx = 0  # Number of DATA frame received
-            print_msg("CCA: %d, DATA TX: %d, DATA RETX: %d, ACK RX: %d, DATA RX: %d" % (
-                n_cca, n_data_tx, n_data_retx, n_ack_rx, n_data_rx), self.node, print_stat)
-            if self.verbose and n_data_tx > 1:
-                print_msg("Time spent by USRP2 on sending a packet = %f" % (T_transmit_USRP2 / n_data_tx), self.node)
-                print_msg("Time spent by USRP2 on configuring the graphs = %f" % (T_configure_USRP2 / n_data_tx),
-                          self.node)
-                print_msg("Time spent by PHY on sending a packet = %f" % (T_transmit_PHY / n_data_tx), self.node)
-                print_msg("Time spent on Socket Communication = %f" % (t_socket_TOTAL / n_data_tx), self.node)
-                print_msg("=============================================================", self.node)
+                self.n_data_rx += 1
+                reply = plcp.create_packet("YES", frame["packet"])
+
+            elif header_pkt == "ACK" and frame is not None:  # There are ACK packets?
+                print_stat = True
+                self.n_ack_rx += 1
+                reply = plcp.create_packet("YES", frame["packet"])
+
+            elif header_pkt in ("RTS", "CTS") and frame is not None:  # There are RTS / CTS packets?
+                reply = plcp.create_packet("YES", frame["packet"])
+
+            elif header_pkt == "NODE":
+                reply = plcp.create_packet("YES", self.node)
+
+            elif header_pkt == "SAMP_RATE":
+                reply = plcp.create_packet("YES", float(self.samp_rate))
+
+            else:  # There are no packets
+                reply = plcp.create_packet("NO", [])
+
+        elif "SUBSCRIBE" == arrived_packet["HEADER"]:  # MAC wants received frames pushed as they arrive
+            print_msg("Mac subscribes to received frames", self.node, False)
+            if self.rx_client is not None and push is not None:
+                self.rx_client.subscribe(push)
+                reply = plcp.create_packet("YES", "")
+            else:
+                reply = plcp.create_packet("NO", "")
+
+        elif "ADDR" == arrived_packet["HEADER"]:  # MAC hosts another station behind this PHY
+            mac_addr = plcp.to_bytes(arrived_packet["DATA"])
+            print_msg("Mac adds the local address %s" % mac.format_mac(mac_addr), self.node, False)
+            if self.rx_client is not None and len(mac_addr) == 6:
+                self.rx_client.add_address(mac_addr)
+                reply = plcp.create_packet("YES", "")
+            else:
+                reply = plcp.create_packet("NO", "")
+
+        if self.verbose and self.n_cca > 0:
+            print_msg("===================== Average statistics ====================", self.node)
+            print_msg("No. of carrier sensing requests = %d" % self.n_cca, self.node)
+            print_msg("Time spent by USRP2 on sensing channel = %f" % (self.T_sense_USRP2 / self.n_cca), self.node)
+            print_msg("Time spent by PHY layer on sensing channel = %f" % (self.T_sense_PHY / self.n_cca), self.node)
+            self.n_ack_rx = 0  # Number of ACK received
+            self.n_data_tx = 0  # Number of packets sent
+            self.n_data_retx = 0  # Number of retransmitted DATA frame
+            self.n_data_rx = 0  # Number of DATA frame received
+        print_msg("CCA: %d, DATA TX: %d, DATA RETX: %d, ACK RX: %d, DATA RX: %d" % (
+            self.n_cca, self.n_data_tx, self.n_data_retx, self.n_ack_rx, self.n_data_rx), self.node, print_stat)
+        if self.verbose and self.n_data_tx > 1:
+            print_msg("Time spent by USRP2 on sending a packet = %f" % (self.T_transmit_USRP2 / self.n_data_tx),
+                      self.node)
+            print_msg("Time spent by USRP2 on configuring the graphs = %f" % (self.T_configure_USRP2 / self.n_data_tx),
+                      self.node)
+            print_msg("Time spent by PHY on sending a packet = %f" % (self.T_transmit_PHY / self.n_data_tx), self.node)
+            print_msg("Time spent on Socket Communication = %f" % (self.t_socket_TOTAL / self.n_data_tx), self.node)
+            print_msg("=============================================================", self.node)
+
+        return reply
+
+    def _reply(self, sd, reply, req_id):
+        """
+        Answer a request of a MAC session
+        :return: False if the MAC is gone
+        """
+        try:
+            with self.send_lock:
+                plcp.send_to_mac(sd, reply, req_id)
+        except OSError:
+            return False
+        return True
+
+    def push_frame(self, sd, packet):
+        """
+        Push a received frame to the subscribed MAC (runs in the rx_client thread)
+        :param sd: socket of the MAC session
+        :param packet: raw MPDU
+        :return: none
+        """
+        with self.send_lock:
+            plcp.send_to_mac(sd, plcp.create_packet("FRAME", packet))
 
     def stop(self):
         self.running = False
         self.server.shutdown(socket.SHUT_RDWR)
         self.server.close()
+        if self.unix_server is not None:
+            self.unix_server.shutdown(socket.SHUT_RDWR)
+            self.unix_server.close()
+            try:
+                os.unlink(self.unix_path)
+            except FileNotFoundError:  # Already removed, e.g. by another PHY started on the same path
+                pass
 
 
-data = deque()
-ack = deque()
-rts = deque()
-cts = deque()
-bcn = deque()
-other = deque()
 
 class Phy(threading.Thread):
     def __init__(self, options):
@@ -800,6 +1108,8 @@ class Phy(threading.Thread):
         self.options = options
         self.options['samp_rate'] = float(self.options['samp_rate'])
         self.options['freq'] = float(self.options['freq'])
+        # Received frames waiting for the MAC, shared by rx_client and proc_mac_request
+        self.rx_queues = mac.RxQueues(self.options.get('rx_queue_len', 64), self.options.get('rx_max_age'))
 
     def print_msg(self, msg, node, log=True):
         """
@@ -812,8 +1122,12 @@ class Phy(threading.Thread):
         if log:
             print("[%d] %s" % (node, msg))
 
-    def run(self, top_block_cls=wifi_transceiver):
-        qapp = QtWidgets.QApplication(sys.argv)
+    def run(self, top_block_cls=None):
+        headless = self.options.get('headless', False) or Qt is None
+        if top_block_cls is None:
+            top_block_cls = wifi_transceiver_headless if headless else wifi_transceiver
+        if not headless:
+            qapp = QtWidgets.QApplication(sys.argv)
 
         usrp_ip = self.options['usrp_ip']
         if "" != usrp_ip and not usrp_ip.startswith("addr="):  # USRP address, if specified, must start with "addr="
@@ -830,21 +1144,43 @@ class Phy(threading.Thread):
         print_msg("USRP IP: %s" % self.options['usrp_ip'],self.options['node'])
         print_msg("-------------------------", self.options['node'])
 
-        rx_client_thread = rx_client(self.options['PHYRXport'], my_mac,self.options['node'])
+        if self.options.get('realtime', True):  # Inherited by the threads of the flowgraph and of the PHY
+            r = gr.enable_realtime_scheduling()
+            print_msg("Warning: failed to enable realtime scheduling", self.options['node'], r != gr.RT_OK)
+
+        rx_client_thread = rx_client(self.options['PHYRXport'], my_mac, self.options['node'],
+                                     rx_queues=self.rx_queues)
         rx_client_thread.start()
 
-        tb = top_block_cls(self.options, socket.gethostname())
+        tb = self.tb = top_block_cls(self.options, socket.gethostname())
+        rx_client_thread.signal_level = tb.get_signal_value  # RSSI of the neighbours
         tb.start()
-        tb.show()
+        if not headless:
+            tb.show()
 
-        proc_mac_thread = proc_mac_request(self.options, tb)
+        proc_mac_thread = proc_mac_request(self.options, tb, rx_client_thread, self.rx_queues)
         proc_mac_thread.start()
+        # for a MAC in this process, which also reads the CCA state directly
+        mac.register_inproc_phy(self.options['PHYport'], proc_mac_thread.handle, tb.cca.state)
 
         def quitting():
             tb.stop()
             tb.wait()
             rx_client_thread.stop()
+            self.rx_queues.close()
+            mac.unregister_inproc_phy(self.options['PHYport'])
             proc_mac_thread.stop()
-        qapp.aboutToQuit.connect(quitting)
 
-        qapp.exec_()
+        if headless:  # No event loop: serve until the flowgraph is stopped (see stop())
+            tb.wait()
+            quitting()
+        else:
+            qapp.aboutToQuit.connect(quitting)
+            qapp.exec_()
+
+    def stop(self):
+        """
+        Stop the flowgraph of a headless PHY, run() then releases the threads and returns
+        :return: none
+        """
+        self.tb.stop()
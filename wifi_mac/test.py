@@ -5,7 +5,9 @@ from mac import load_config, MacWifi
 from phy_wifi import Phy
 
 if __name__ == '__main__':
-    buffer_thread = threading.Thread(target=run_ul_buffer)
+    config_mac = "wifi_mac/mac_config.yaml"
+    config = load_config(config_mac)
+    buffer_thread = threading.Thread(target=run_ul_buffer, args=(config,))
     traffic_thread = threading.Thread(target=run_ul_traffic)
     buffer_thread.start()
     time.sleep(2)
@@ -18,8 +20,7 @@ if __name__ == '__main__':
 
     # start MAC
     time.sleep(5)
-    config_mac = "wifi_mac/mac_config.yaml"
-    config = load_config(config_mac)
+    config['transport'] = "inproc"  # PHY runs in this process, skip the loopback socket
     mac_wifi_thread = MacWifi(config)
     mac_wifi_thread.start()
     mac_wifi_thread.join()
@@ -0,0 +1,198 @@
+import socket
+import threading
+
+import data_generator
+import uwicore_mac_utils as mac
+import uwicore_mpif as plcp
+
+
+class FakePhy:
+    """
+    PHY stand-in for the MAC tests, reached through InProcessTransport (transport: inproc), or on
+    a TCP port for the MACs that connect per request (see serve_tcp).
+    It answers the requests of the MAC the way phy_wifi.proc_mac_request.handle does: fixed node ID
+    and sample rate, a channel that is always free, received frames pushed to a subscribed MAC or
+    kept for TAIL requests. The peers are assumed in range: each DATA frame the MAC sends is
+    acknowledged and each RTS answered by a CTS, reply_delay seconds later.
+    :param port: PHYport the fake PHY is registered on (see register_inproc_phy)
+    :param node: node ID of the PHY
+    :param samp_rate: sample rate (Hz)
+    :param reply_delay: delay of the ACK and CTS answers (s)
+    :param ack: acknowledge the DATA frames
+    """
+
+    def __init__(self, port, node=1, samp_rate=20e6, reply_delay=0.005, ack=True):
+        self.port = port
+        self.node = node
+        self.samp_rate = samp_rate
+        self.t_sym = mac.cal_sym_duration(samp_rate)
+        self.reply_delay = reply_delay
+        self.ack = ack
+        self.sent = []  # MacFrame of each frame the MAC transmitted
+        self.addresses = []  # MAC addresses registered by the MAC (ADDR)
+        self.rx_queues = mac.RxQueues()  # received frames kept for TAIL requests
+        self._push = None
+        self._timers = []
+        self._lock = threading.Lock()
+        mac.register_inproc_phy(port, self.handle)
+
+    def handle(self, arrived_packet, push):
+        """
+        Serve one request of the MAC layer
+        :param arrived_packet: crosslayer packet received from MAC
+        :param push: function taking a raw MPDU, used to push received frames if the MAC subscribes
+        :return: answer to the MAC, None if the request expects no answer
+        """
+        header = arrived_packet["HEADER"]
+        if header == "PKT":
+            self._transmit(mac.MacFrame(plcp.to_bytes(arrived_packet["DATA"]["INFO"]["packet"])))
+            return None
+
+        if header == "CCA":
+            return plcp.create_packet("CCA", 1e-9)  # -90 dBw
+
+        if header == "TAIL":
+            header_pkt = plcp.to_bytes(arrived_packet["DATA"]).decode("latin-1")
+            if header_pkt == "NODE":
+                return plcp.create_packet("YES", self.node)
+            if header_pkt == "SAMP_RATE":
+                return plcp.create_packet("YES", float(self.samp_rate))
+            frame = self.rx_queues.get(header_pkt) if header_pkt in mac.RX_QUEUE_TYPES else None
+            if frame is not None:
+                return plcp.create_packet("YES", frame)
+            return plcp.create_packet("NO", [])
+
+        if header == "SUBSCRIBE":
+            if push is None:
+                return plcp.create_packet("NO", "")
+            self._push = push
+            return plcp.create_packet("YES", "")
+
+        if header == "ADDR":
+            with self._lock:
+                self.addresses.append(plcp.to_bytes(arrived_packet["DATA"]))
+            return plcp.create_packet("YES", "")
+
+        return plcp.create_packet("NO", "")
+
+    def serve_tcp(self):
+        """
+        Also serve MAC sessions on a free TCP port, each one in a daemon thread. The port stays
+        open after close(): the MACs that connect per request run until the process exits
+        :return: PHYport of the sessions
+        """
+        server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        server.bind((socket.gethostname(), 0))
+        server.listen(16)
+        thread = threading.Thread(target=self._serve, args=(server,))
+        thread.daemon = True
+        thread.start()
+        return server.getsockname()[1]
+
+    def _serve(self, server):
+        while True:
+            try:
+                sd, _ = server.accept()
+            except OSError:
+                return
+            session = threading.Thread(target=self._serve_session, args=(sd,))
+            session.daemon = True
+            session.start()
+
+    def _serve_session(self, sd):
+        reader = plcp.MessageReader(sd)
+        try:
+            arrived_packet = reader.read()
+            while arrived_packet is not None:
+                reply = self.handle(arrived_packet, None)
+                if reply is not None:
+                    plcp.send_to_mac(sd, reply, arrived_packet["ID"])
+                arrived_packet = reader.read()
+        except OSError:
+            pass
+        finally:
+            sd.close()
+
+    def receive(self, mpdu):
+        """
+        Deliver a frame to the MAC as if it was received on air
+        :param mpdu: raw MPDU (see generate_pkt)
+        :return: none
+        """
+        if self._push is not None:
+            self._push(mpdu)
+        else:
+            header = mac.MacFrame(mpdu).header
+            self.rx_queues.put("DATA" if header == "DATA_FRAG" else header, mpdu)
+
+    def frames(self, *headers):
+        """
+        :param headers: frame types
+        :return: frames of these types transmitted by the MAC, in order
+        """
+        with self._lock:
+            return [frame for frame in self.sent if frame.header in headers]
+
+    def close(self):
+        mac.unregister_inproc_phy(self.port)
+        with self._lock:
+            for timer in self._timers:
+                timer.cancel()
+
+    def _transmit(self, frame):
+        with self._lock:
+            self.sent.append(frame)
+        if frame.header in ("DATA", "DATA_FRAG", "DATA_RETX") and self.ack:
+            answer = mac.generate_pkt("ACK", self.t_sym, 0, {"duration": 0, "mac_ra": frame["TX_add"],
+                                                              "timestamp": 0})
+        elif frame.header == "RTS":
+            answer = mac.generate_pkt("CTS", self.t_sym, 0, {"duration": 0, "mac_ra": frame["TX_add"],
+                                                              "timestamp": 0})
+        else:
+            return
+        timer = threading.Timer(self.reply_delay, self.receive, (answer["INFO"]["packet"],))
+        timer.daemon = True
+        with self._lock:
+            self._timers.append(timer)
+        timer.start()
+
+
+def start_ul_buffers(n, first_port=18001, scheduling="rr", quantum=1500):
+    """
+    Upper layer buffers (data_generator.UlBuffer) on n consecutive free ports, each one served by
+    a daemon thread, for the MACport of n stations
+    :param n: number of buffers
+    :param first_port: lowest port tried
+    :return: list of UlBuffer, the first one on MACport
+    """
+    port = first_port
+    while True:
+        buffers = []
+        try:
+            for i in range(n):
+                buffers.append(data_generator.UlBuffer(port + i, scheduling, quantum))
+        except OSError:  # Port in use, try the next range
+            stop_ul_buffers(buffers)
+            port += n
+            continue
+        for ul_buffer in buffers:
+            thread = threading.Thread(target=_serve_ul_buffer, args=(ul_buffer,))
+            thread.daemon = True
+            thread.start()
+        return buffers
+
+
+def stop_ul_buffers(buffers):
+    for ul_buffer in buffers:
+        try:
+            ul_buffer.server.shutdown(socket.SHUT_RDWR)  # Wakes up the thread blocked in accept()
+        except OSError:
+            pass
+        ul_buffer.server.close()
+
+
+def _serve_ul_buffer(ul_buffer):
+    try:
+        ul_buffer.run()
+    except OSError:  # Server closed by stop_ul_buffers
+        pass
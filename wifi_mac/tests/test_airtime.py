@@ -0,0 +1,51 @@
+import math
+
+import pytest
+
+import uwicore_mac_utils as mac
+
+T_SYM = 4e-6  # 20 MHz channel
+
+
+def _formula(length, encoding, t_sym=T_SYM):
+    n_sym = math.ceil((54 + 8 * length) / mac.N_DBPS[encoding])
+    return int((5 + n_sym) * t_sym * 1e6) + 2
+
+
+def test_tables_match_formula():
+    table = mac.Airtime(T_SYM, max_len=300)
+    for encoding in range(len(mac.N_DBPS)):
+        assert [table.tx_time(length, encoding) for length in range(400)] == \
+            [_formula(length, encoding) for length in range(400)]  # beyond max_len too
+
+
+def test_known_values():
+    table = mac.airtime(T_SYM)
+    assert table.tx_time(100, 0) == 166  # 36 symbols at 6 Mbps
+    assert table.tx_time(mac.ACK_LEN, 0) == _formula(mac.ACK_LEN, 0)
+    assert table.data_time(1500, 7) == table.tx_time(mac.DATA_HEADER_LEN + 1500, 7)
+    assert mac.airtime(T_SYM) is table
+    assert mac.airtime(T_SYM / 2) is not table
+
+
+def test_throughput():
+    rates = mac.airtime(T_SYM).throughput(1500)
+    assert rates == sorted(rates)
+    assert all(rate < nominal for rate, nominal in zip(rates, mac.DATA_RATES))
+    assert rates[7] > 40
+
+
+def test_tx_times():
+    table = mac.Airtime(T_SYM, max_len=300)
+    lengths = [0, 14, 24, 300]
+    assert list(table.tx_times(lengths, 3)) == [table.tx_time(length, 3) for length in lengths]
+    assert list(table.tx_times(lengths + [1000], 3)) == [_formula(length, 3) for length in lengths + [1000]]
+
+
+def test_tx_times_numpy():
+    np = pytest.importorskip("numpy")
+    table = mac.Airtime(T_SYM)
+    lengths = np.arange(mac.MAX_MPDU_LEN + 1)
+    times = table.tx_times(lengths, 5)
+    assert times.dtype == np.int64
+    assert times.tolist() == table.tables[5]
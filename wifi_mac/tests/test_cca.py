@@ -0,0 +1,111 @@
+import threading
+import time
+
+import pytest
+
+import uwicore_mac_utils as mac
+import uwicore_mpif as plcp
+
+BIN_NS = 100000  # bin_time=1e-4
+
+
+def _history(bins, capacity_s=0.001):
+    """
+    CCA state of this process with one sample per bin: (bin, power, busy)
+    """
+    cca = plcp.CcaState(None, True, capacity_s, 1e-4)
+    for bin_id, power, busy in bins:
+        cca.publish(bin_id * BIN_NS, power, busy, 0, 0, [(bin_id, power, power, 1, int(busy))])
+    return cca
+
+
+def test_publish_read():
+    cca = plcp.CcaState()
+    cca.publish(10, 2e-3, True, 5, 1)
+    assert cca.read() == (10, 2e-3, True, 5, 1)
+    assert cca.level == 2e-3 and cca.busy
+    assert cca.busy_after(100)
+    cca.publish(20, 1e-6, False, 5, 15)
+    assert cca.busy_after(10) and not cca.busy_after(15)
+
+
+def test_shared_memory_record(tmp_path):
+    path = str(tmp_path / "cca")
+    writer = plcp.CcaState(path, True, 0.001, 1e-4)
+    reader = plcp.CcaState(path)
+    try:
+        writer.publish(BIN_NS, 0.5, True, 0, 0, [(1, 0.5, 0.5, 1, 1)])
+        assert reader.read()[1] == 0.5
+        assert reader.capacity == writer.capacity == 10
+        assert reader.sense_window(0, 2 * BIN_NS) == (0.5, 0.5, 1.0)
+    finally:
+        reader.close()
+        writer.close()
+
+
+def test_reader_waits_for_the_writer():
+    cca = plcp.CcaState()
+    cca.publish(1, 1.0, False, 0, 0)
+    plcp.CcaState.SEQ.pack_into(cca.buf, 0, 3)  # update in progress
+    result = []
+    reader = threading.Thread(target=lambda: result.append(cca.read()))
+    reader.start()
+    time.sleep(0.05)
+    assert reader.is_alive() and not result
+    plcp.CcaState.SEQ.pack_into(cca.buf, 0, 4)
+    reader.join(1)
+    assert result == [(1, 1.0, False, 0, 0)]
+
+
+def test_reads_are_consistent_during_updates():
+    cca = plcp.CcaState()
+    stop = threading.Event()
+
+    def write():
+        t = 0
+        while not stop.is_set():
+            t += 1
+            cca.publish(t, float(t), t % 2 == 1, t, t)
+
+    writer = threading.Thread(target=write)
+    writer.start()
+    try:
+        for _ in range(20000):
+            t, level, busy, busy_since, idle_since = cca.read()
+            assert level == float(t) and busy == (t % 2 == 1) and busy_since == idle_since == t
+    finally:
+        stop.set()
+        writer.join()
+
+
+def test_sense_window():
+    cca = _history([(1, 0.1, False), (2, 0.4, True), (3, 0.2, False), (4, 0.3, True)])
+    power_max, mean, busy = cca.sense_window(2 * BIN_NS, 3 * BIN_NS + 1)
+    assert power_max == 0.4 and mean == pytest.approx(0.3) and busy == 0.5
+    assert cca.sense_window(0, 10 * BIN_NS) == (0.4, pytest.approx(0.25), 0.5)  # clipped to the history
+    assert cca.sense_window(10 * BIN_NS, 20 * BIN_NS) is None  # no sample yet
+    assert plcp.CcaState().sense_window(0, BIN_NS) is None  # no history
+
+
+def test_sense_window_empty_bins_and_wrap():
+    cca = _history([(1, 0.9, True), (5, 0.1, False)])
+    assert cca.sense_window(2 * BIN_NS, 4 * BIN_NS) is None  # bins without samples
+    assert cca.sense_window(BIN_NS, 5 * BIN_NS) == (0.9, pytest.approx(0.5), 0.5)
+
+    for bin_id in range(8, 14):
+        cca.publish(bin_id * BIN_NS, 0.2, False, 0, 0, [(bin_id, 0.2, 0.2, 1, 0)])
+    assert cca.sense_window(BIN_NS, 5 * BIN_NS) == (0.1, pytest.approx(0.1), 0.0)  # bin 1 left the history
+    power_max, mean, busy = cca.sense_window(8 * BIN_NS, 13 * BIN_NS)  # wraps around the end of the ring
+    assert power_max == 0.2 and mean == pytest.approx(0.2) and busy == 0.0
+
+
+def test_mac_sense_window():
+    port = mac.PhyTransport()
+    port.cca = _history([(1, 1e-2, True), (2, 1e-6, False)])
+    assert mac.has_cca_history(port)
+    status, busy, power = mac.sense_window(port, BIN_NS, 2 * BIN_NS)
+    assert status == "OCCUPIED" and busy == 0.5 and power == pytest.approx(-20)
+    status, busy, power = mac.sense_window(port, 2 * BIN_NS, 2 * BIN_NS)
+    assert status == "FREE" and busy == 0.0
+    # outside the history: falls back to the last level
+    assert mac.sense_window(port, 50 * BIN_NS, 60 * BIN_NS)[0] == "FREE"
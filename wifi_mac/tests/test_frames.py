@@ -0,0 +1,190 @@
+import socket
+import struct
+
+import pytest
+
+import uwicore_mac_utils as mac
+
+T_SYM = 4e-6
+STA1 = mac.assign_mac(1)
+STA2 = mac.assign_mac(2)
+
+
+def _data(header="DATA", payload=b"hello", seq=5, frag=0, dest=STA2):
+    values = {"payload": payload, "address1": dest, "address2": STA1, "N_SEQ": seq, "N_FRAG": frag, "timestamp": 0}
+    return mac.generate_pkt(header, T_SYM, 3, values)
+
+
+def test_data_frame():
+    info = _data("DATA_FRAG", seq=4095, frag=2)["INFO"]
+    frame = mac.MacFrame(info["packet"])
+    assert frame.header == "DATA_FRAG"
+    assert frame["RX_add"] == STA2 and frame["TX_add"] == STA1
+    assert frame["N_SEQ"] == 4095 and frame["N_FRAG"] == 2
+    assert frame["PAYLOAD"] == b"hello"
+    assert frame["tx_time"] == info["mac_duration"] == mac.airtime(T_SYM).tx_time(len(info["packet"]), 3)
+    assert len(frame) == mac.DATA_HEADER_LEN + 5
+    assert mac.parse_mac(info["packet"])["HEADER"] == "DATA_FRAG"
+
+
+def test_data_header_template():
+    retx = _data("DATA_RETX", seq=7, frag=1)["INFO"]["packet"]
+    other_peer = _data("DATA", payload=b"x" * 100, seq=8, dest=mac.assign_mac(9))["INFO"]["packet"]
+    fc, flags, duration, addr1, addr2, addr3, seq_control = struct.unpack_from("<BBH6s6s6sH", retx)
+    assert (fc, flags, addr1, addr2, addr3, seq_control) == (0x08, 0x08, STA2, STA1, mac.BROADCAST_MAC, 7 << 4 | 1)
+    assert mac.MacFrame(other_peer)["RX_add"] == mac.assign_mac(9)
+    assert mac.MacFrame(other_peer)["N_SEQ"] == 8
+    assert mac.MacFrame(_data()["INFO"]["packet"]).header == "DATA"  # cached header of another type
+
+
+def test_control_frames():
+    ack = mac.MacFrame(mac.generate_pkt("ACK", T_SYM, 0, {"mac_ra": STA1})["INFO"]["packet"])
+    assert (ack.header, ack["RX_add"], len(ack)) == ("ACK", STA1, mac.ACK_LEN)
+
+    cts_info = mac.generate_pkt("CTS", T_SYM, 0, {"mac_ra": STA2, "duration": 100, "timestamp": 0})["INFO"]
+    cts = mac.MacFrame(cts_info["packet"])
+    assert (cts.header, cts["RX_add"], cts["tx_time"]) == ("CTS", STA2, cts_info["mac_duration"])
+
+    rts = mac.MacFrame(mac.generate_pkt("RTS", T_SYM, 0, {"mac_ra": STA2, "mac_ta": STA1, "duration": 100,
+                                                          "timestamp": 0})["INFO"]["packet"])
+    assert (rts.header, rts["RX_add"], rts["TX_add"], len(rts)) == ("RTS", STA2, STA1, mac.RTS_LEN)
+
+
+def test_beacon_frame():
+    info = mac.generate_pkt("BEACON", T_SYM, 0, {"address2": STA1, "N_SEQ": 3, "N_FRAG": 0, "BI": 0.1})["INFO"]
+    beacon = mac.MacFrame(info["packet"])
+    assert (beacon.header, beacon["RX_add"], beacon["TX_add"]) == ("BEACON", mac.BROADCAST_MAC, STA1)
+    assert beacon["N_SEQ"] == 3 and beacon["timestamp"] == info["timestamp"]
+    assert beacon["BI"] == mac._cal_beacon_interval(0.1)
+    assert beacon["SSID"] == ""
+
+
+def test_short_and_unknown_frames():
+    assert mac.MacFrame(b"\x08\x00").header == ""
+    assert mac.MacFrame(b"\x50" + b"\x00" * 9).header == ""  # probe response
+
+
+def _truncated():
+    beacon = mac.generate_pkt("BEACON", T_SYM, 0, {"address2": STA1, "N_SEQ": 3, "N_FRAG": 0, "BI": 0.1})["INFO"]
+    rts = mac.generate_pkt("RTS", T_SYM, 0, {"mac_ra": STA2, "mac_ta": STA1, "duration": 10, "timestamp": 0})["INFO"]
+    return [beacon["packet"][:10], beacon["packet"][:mac._BEACON.size - 1], rts["packet"][:mac.RTS_LEN - 1],
+            _data()["INFO"]["packet"][:mac.DATA_HEADER_LEN - 1]]
+
+
+def test_truncated_frames():
+    assert [mac.MacFrame(frame).header for frame in _truncated()] == ["", "", "", ""]
+
+
+def test_parse_frames_truncated():
+    pytest.importorskip("numpy")
+    frame_list = _truncated()
+    frames = mac.parse_frames(b"".join(frame_list), [len(f) for f in frame_list])
+    assert list(frames["type"]) == [-1, -1, -1, -1]
+    assert list(frames["payload_offset"]) == [-1, -1, -1, -1]
+
+
+def test_generate_pkt_checks():
+    with pytest.raises(ValueError):
+        mac.generate_pkt("PROBE", T_SYM, 0, {})
+    with pytest.raises(ValueError):
+        _data(payload=b"x" * mac.MAX_MPDU_LEN)
+    with pytest.raises(TypeError):
+        _data(payload="text")
+
+
+def test_fragment_and_seq_num():
+    assert mac.fragment(b"abcdefg", 3) == [b"abc", b"def", b"g"]
+    assert mac.next_seq_num(4095) == 0
+
+
+def _batch():
+    return [_data(seq=1)["INFO"]["packet"],
+            mac.generate_pkt("ACK", T_SYM, 0, {"mac_ra": STA1})["INFO"]["packet"],
+            mac.generate_pkt("RTS", T_SYM, 0, {"mac_ra": STA2, "mac_ta": STA1, "duration": 10,
+                                               "timestamp": 0})["INFO"]["packet"],
+            _data("DATA_FRAG", payload=b"abc", seq=2, frag=1)["INFO"]["packet"],
+            b"\x08\x00"]  # truncated
+
+
+def _check_batch(frames, data, frame_list):
+    types = [mac.plcp.FRAME_TYPES[t] if t >= 0 else None for t in frames["type"]]
+    assert types == ["DATA", "ACK", "RTS", "DATA_FRAG", None]
+    assert list(frames["length"]) == [len(f) for f in frame_list]
+    assert frames["addr1"][0] == mac.mac_to_int(STA2) and frames["addr2"][0] == mac.mac_to_int(STA1)
+    assert frames["addr1"][1] == mac.mac_to_int(STA1)
+    assert frames["addr2"][2] == mac.mac_to_int(STA1)
+    assert list(frames["seq"][[0, 3]]) == [1, 2] and frames["frag"][3] == 1
+    assert list(frames["payload_offset"][[1, 2, 4]]) == [-1, -1, -1]
+    start = frames["payload_offset"][3]
+    assert bytes(data[start:frames["offset"][3] + frames["length"][3]]) == b"abc"
+    for frame, record in zip(frame_list[:4], frames[:4]):
+        assert record["duration"] == mac.MacFrame(frame)["tx_time"]
+
+
+def test_parse_frames():
+    np = pytest.importorskip("numpy")
+    frame_list = _batch()
+    buf = b"".join(frame_list)
+    frames = mac.parse_frames(buf, [len(f) for f in frame_list])
+    _check_batch(frames, np.frombuffer(buf, dtype=np.uint8), frame_list)
+
+
+@pytest.mark.parametrize("radiotap", [False, True])
+def test_parse_pcap(tmp_path, radiotap):
+    pytest.importorskip("numpy")
+    frame_list = _batch()
+    prefix = struct.pack("<BBHI", 0, 0, 8, 0) if radiotap else b""
+    records = [struct.pack("<IIII", 10 + i, 500000, len(prefix + f), len(prefix + f)) + prefix + f
+               for i, f in enumerate(frame_list)]
+    path = tmp_path / "capture.pcap"
+    path.write_bytes(struct.pack("<IHHiIII", 0xa1b2c3d4, 2, 4, 0, 0, 65535, 127 if radiotap else 105)
+                     + b"".join(records) + records[0][:20])  # the last record is truncated
+    frames, data = mac.parse_pcap(str(path))
+    assert list(frames["time"]) == [10.5, 11.5, 12.5, 13.5, 14.5]
+    _check_batch(frames, data, frame_list)
+
+
+def test_parse_pcap_rejects_other_files(tmp_path):
+    pytest.importorskip("numpy")
+    path = tmp_path / "capture.pcap"
+    path.write_bytes(b"\x00" * 24)
+    with pytest.raises(ValueError):
+        mac.parse_pcap(str(path))
+    path.write_bytes(struct.pack("<IHHiIII", 0xa1b2c3d4, 2, 4, 0, 0, 65535, 1))  # Ethernet
+    with pytest.raises(ValueError):
+        mac.parse_pcap(str(path))
+
+
+def _framed(frames):
+    return b"".join(mac.RX_FRAME_PREFIX.pack(len(f)) + f for f in frames)
+
+
+def test_frame_reader_merged_frames():
+    frame_list = _batch()[:4]
+    rx, tx = socket.socketpair()
+    with rx, tx:
+        tx.sendall(_framed(frame_list))
+        frames = mac.FrameReader(rx).read_batch()
+        assert [f.header for f in frames] == ["DATA", "ACK", "RTS", "DATA_FRAG"]
+        assert frames[3]["PAYLOAD"] == b"abc"
+        tx.close()
+        assert mac.FrameReader(rx).read_batch() is None
+
+
+@pytest.mark.parametrize("chunk", [1, 3, 17])
+def test_frame_reader_split_frames(chunk):
+    frame_list = [_data(payload=b"p" * 200, seq=n)["INFO"]["packet"] for n in range(3)]
+    data = _framed(frame_list)
+    rx, tx = socket.socketpair()
+    with rx, tx:
+        reader = mac.FrameReader(rx, bufsize=16)  # grows to the longest frame
+        frames = []
+        for start in range(0, len(data), chunk):
+            tx.sendall(data[start:start + chunk])
+            assert reader.fill()
+            frames += reader.next_frames()
+        while len(frames) < len(frame_list):  # bytes the full buffer left in the socket
+            frames += reader.read_batch()
+        assert [f["N_SEQ"] for f in frames] == [0, 1, 2]
+        assert all(f["PAYLOAD"] == b"p" * 200 for f in frames)
+        assert reader.next_frames() == []
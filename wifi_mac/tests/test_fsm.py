@@ -0,0 +1,70 @@
+import asyncio
+
+import pytest
+
+from mac_async import AsyncDcf
+from mac_fsm import MacState, StateMachine, TRANSITIONS
+
+
+class _Scripted:
+    """
+    Owner whose handlers return the next states of a script
+    """
+
+    def __init__(self, script):
+        self.script = list(script)
+        for state in MacState:
+            setattr(self, state.name.lower(), self._next)
+
+    def _next(self):
+        return self.script.pop(0)
+
+
+class _ScriptedAsync(_Scripted):
+
+    async def _next(self):
+        await asyncio.sleep(0)
+        return self.script.pop(0)
+
+
+def test_transition_table_complete():
+    assert set(TRANSITIONS) == set(MacState)
+    assert all(set(targets) <= set(MacState) for targets in TRANSITIONS.values())
+    assert all(hasattr(AsyncDcf, state.name.lower()) for state in MacState)
+
+
+def test_steps_and_stats():
+    fsm = StateMachine(_Scripted([MacState.IDLE, MacState.WAIT_FOR_NAV, MacState.WAIT_FOR_DIFS,
+                                  MacState.BACKING_OFF, MacState.BACKING_OFF, MacState.IDLE]))
+    for _ in range(6):
+        fsm.step()
+    assert fsm.state == MacState.IDLE
+    stats = fsm.stats()
+    assert stats["state"] == "IDLE"
+    assert stats["transitions"] == {"IDLE": {"IDLE": 1, "WAIT_FOR_NAV": 1},
+                                    "WAIT_FOR_NAV": {"WAIT_FOR_DIFS": 1},
+                                    "WAIT_FOR_DIFS": {"BACKING_OFF": 1},
+                                    "BACKING_OFF": {"BACKING_OFF": 1, "IDLE": 1}}
+    assert set(stats["time"]) <= {"IDLE", "WAIT_FOR_NAV", "WAIT_FOR_DIFS", "BACKING_OFF"}
+    fsm.reset_stats()
+    assert fsm.stats() == {"state": "IDLE", "transitions": {}, "time": {}}
+
+
+def test_invalid_transition():
+    fsm = StateMachine(_Scripted([MacState.WAITING_FOR_ACK]), initial=MacState.WAIT_FOR_DIFS)
+    with pytest.raises(ValueError, match="WAIT_FOR_DIFS -> WAITING_FOR_ACK"):
+        fsm.step()
+    assert fsm.state == MacState.WAIT_FOR_DIFS  # the state and the counters are left unchanged
+    assert fsm.stats()["transitions"] == {}
+
+
+def test_step_async():
+    fsm = StateMachine(_ScriptedAsync([MacState.TRANSMITTING_CTS, MacState.WAITING_FOR_DATA,
+                                       MacState.TX_ACK_FG, MacState.WAITING_FOR_DATA]))
+
+    async def run():
+        return [await fsm.step_async() for _ in range(4)]
+
+    assert asyncio.run(run()) == [MacState.TRANSMITTING_CTS, MacState.WAITING_FOR_DATA, MacState.TX_ACK_FG,
+                                  MacState.WAITING_FOR_DATA]
+    assert fsm.stats()["transitions"]["WAITING_FOR_DATA"] == {"TX_ACK_FG": 1}
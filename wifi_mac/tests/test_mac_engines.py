@@ -0,0 +1,175 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+import uwicore_mac_utils as mac
+from fake_phy import FakePhy, start_ul_buffers, stop_ul_buffers
+from mac_async import AsyncDcf
+from mac_host import StationHost
+
+PHY_PORT = 9990
+NODE = 1
+PEER = mac.assign_mac(2)
+
+
+@pytest.fixture
+def options():
+    return {"PHYport": PHY_PORT, "transport": "inproc", "subscribe": True, "MACport": 0, "dest_node": 2,
+            "encoding": 0, "retx_max": 1, "beta": 100, "time_slot": 9e-5, "SIFS": 16e-6, "rate_control": "none",
+            "RTS": False, "BI": 1, "engine": "asyncio", "stations": 1}
+
+
+@pytest.fixture
+def phy():
+    fake = FakePhy(PHY_PORT, NODE)
+    yield fake
+    fake.close()
+
+
+@pytest.fixture
+def ul_buffers():
+    buffers = []
+
+    def start(n=1):
+        buffers.extend(start_ul_buffers(n))
+        return buffers
+
+    yield start
+    stop_ul_buffers(buffers)
+
+
+def _run(engine, done, timeout=10):
+    """
+    Run an AsyncDcf or a StationHost until done() or the timeout
+    :return: True if done
+    """
+    async def main():
+        task = asyncio.ensure_future(engine.run())
+        deadline = time.monotonic() + timeout
+        while not done() and not task.done() and time.monotonic() < deadline:
+            await asyncio.sleep(0.01)
+        engine.stop()
+        await asyncio.wait_for(task, 5)
+        return done()
+
+    return asyncio.run(main())
+
+
+def _station(options, phy, ul_buffer, subscribe=True):
+    transport = mac.connect_phy(dict(options, MACport=ul_buffer.MACport))
+    if subscribe:
+        assert transport.subscribe()
+    return AsyncDcf(dict(options, MACport=ul_buffer.MACport), transport, NODE, phy.t_sym)
+
+
+@pytest.mark.parametrize("subscribe", [True, False])
+def test_async_dcf_sends_the_buffer(options, phy, ul_buffers, subscribe):
+    ul_buffer, = ul_buffers()
+    for n in range(3):
+        ul_buffer.cs.push(None, b"packet %d" % n)
+    station = _station(options, phy, ul_buffer, subscribe)
+    assert _run(station, ul_buffer.cs.isEmpty)
+    data = phy.frames("DATA")
+    assert [frame["PAYLOAD"] for frame in data] == [b"packet 0", b"packet 1", b"packet 2"]
+    assert [frame["N_SEQ"] for frame in data] == [0, 1, 2]
+    assert all(frame["RX_add"] == PEER and frame["TX_add"] == mac.assign_mac(NODE) for frame in data)
+    assert station.fsm.stats()["transitions"]["WAITING_FOR_ACK"] == {"IDLE": 3}
+
+
+def test_async_dcf_peer_and_fragments_after_rts(options, phy, ul_buffers):
+    ul_buffer, = ul_buffers()
+    other_peer = mac.assign_mac(7)
+    ul_buffer.cs.push(other_peer, b"x" * 1500)
+    # beta 1000: the CTS timeout (SIFS) is longer than the reply delay of the fake PHY
+    station = _station(dict(options, RTS=True, beta=1000), phy, ul_buffer)
+    assert _run(station, ul_buffer.cs.isEmpty)
+    sent = phy.frames("RTS", "DATA", "DATA_FRAG")
+    assert [frame.header for frame in sent] == ["RTS", "DATA_FRAG", "DATA"]
+    assert all(frame["RX_add"] == other_peer for frame in sent)
+    assert [frame["N_SEQ"] for frame in sent[1:]] == [0, 0]
+    assert [frame["N_FRAG"] for frame in sent[1:]] == [0, 1]
+    assert b"".join(frame["PAYLOAD"] for frame in sent[1:]) == b"x" * 1500
+
+
+def test_async_dcf_retries_then_drops(options, phy, ul_buffers):
+    phy.ack = False
+    ul_buffer, = ul_buffers()
+    ul_buffer.cs.push(None, b"lost")
+    station = _station(options, phy, ul_buffer)
+    assert _run(station, ul_buffer.cs.isEmpty)
+    assert [frame.header for frame in phy.frames("DATA", "DATA_RETX")] == ["DATA", "DATA_RETX"]
+
+
+def test_async_dcf_receives_data(options, phy, ul_buffers):
+    ul_buffer, = ul_buffers()
+    station = _station(options, phy, ul_buffer)
+    data = mac.generate_pkt("DATA", phy.t_sym, 0, {"payload": b"from peer", "address1": mac.assign_mac(NODE),
+                                                   "address2": PEER, "N_SEQ": 9, "N_FRAG": 0, "timestamp": 0})
+    threading.Timer(0.05, phy.receive, (data["INFO"]["packet"],)).start()
+    assert _run(station, lambda: ul_buffer.cs2.length() == 1 and phy.frames("ACK"))
+    assert ul_buffer.cs2.elements == [b"from peer"]
+    assert phy.frames("ACK")[0]["RX_add"] == PEER
+
+
+def test_station_host(options, phy, ul_buffers):
+    buffers = ul_buffers(3)
+    for i, ul_buffer in enumerate(buffers):
+        for n in range(2):
+            ul_buffer.cs.push(None, b"station %d packet %d" % (i, n))
+    options = dict(options, MACport=buffers[0].MACport, stations=3, dest_node=9)
+    transport = mac.connect_phy(options)
+    host = StationHost(options, transport, NODE, phy.t_sym)
+    assert phy.addresses == [mac.assign_mac(NODE + 1), mac.assign_mac(NODE + 2)]
+    data = mac.generate_pkt("DATA", phy.t_sym, 0, {"payload": b"to station 2", "address1": mac.assign_mac(NODE + 2),
+                                                   "address2": PEER, "N_SEQ": 0, "N_FRAG": 0, "timestamp": 0})
+    threading.Timer(0.05, phy.receive, (data["INFO"]["packet"],)).start()
+
+    assert _run(host, lambda: all(ul_buffer.cs.isEmpty() for ul_buffer in buffers) and buffers[2].cs2.length())
+    for i in range(3):
+        sent = [frame for frame in phy.frames("DATA") if frame["TX_add"] == mac.assign_mac(NODE + i)]
+        assert [frame["PAYLOAD"] for frame in sent] == [b"station %d packet %d" % (i, n) for n in range(2)]
+        assert [frame["N_SEQ"] for frame in sent] == [0, 1]  # sequence numbers per station
+    assert buffers[2].cs2.elements == [b"to station 2"]
+    assert [buffer.cs2.length() for buffer in buffers[:2]] == [0, 0]
+    assert set(host.stats()) == set(mac.format_mac(mac.assign_mac(NODE + i)) for i in range(3))
+
+
+def test_mac_wifi_thread_engine(options, phy):
+    pytest.importorskip("gnuradio")
+    from mac import MacWifi
+
+    ul_buffer, = start_ul_buffers(1)  # Left open: the thread engine runs until the process exits
+    for n in range(2):
+        ul_buffer.cs.push(None, b"packet %d" % n)
+    mac_wifi = MacWifi(dict(options, MACport=ul_buffer.MACport, engine="thread"))
+    mac_wifi.daemon = True
+    mac_wifi.start()
+    deadline = time.monotonic() + 10
+    while not ul_buffer.cs.isEmpty() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert ul_buffer.cs.isEmpty()
+    assert [frame["PAYLOAD"] for frame in phy.frames("DATA")] == [b"packet 0", b"packet 1"]
+
+
+def test_mac_wifi_legacy_entry_point(phy, monkeypatch):
+    pytest.importorskip("gnuradio")
+    import mac_wifi
+
+    phy_port = phy.serve_tcp()
+    ul_buffer, = start_ul_buffers(1)  # Left open: the legacy MAC runs until the process exits
+    ul_buffer.cs.push(None, b"legacy packet")
+    ul_buffer.cs.push(None, b"y" * 200)  # above the RTS threshold
+    monkeypatch.setattr("sys.argv", ["mac_wifi.py", "--PHYport=%d" % phy_port, "--MACport=%d" % ul_buffer.MACport,
+                                     "--encoding=0", "--beta=1000", "-t", "9e-5", "-r", "1", "-R", "aarf", "--RTS",
+                                     "--dest_node=2"])
+    thread = threading.Thread(target=mac_wifi.main)
+    thread.daemon = True
+    thread.start()
+    deadline = time.monotonic() + 10
+    while not ul_buffer.cs.isEmpty() and thread.is_alive() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert ul_buffer.cs.isEmpty()
+    assert [frame["PAYLOAD"] for frame in phy.frames("DATA")][:1] == [b"legacy packet"]
+    assert phy.frames("RTS")[0]["RX_add"] == PEER
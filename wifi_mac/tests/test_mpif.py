@@ -0,0 +1,159 @@
+import asyncio
+import socket
+
+import pytest
+
+import uwicore_mpif as plcp
+
+
+def _packet(header, data):
+    return plcp.create_packet(header, data)
+
+
+class _ChunkedSocket:
+    """
+    Socket stand-in returning the bytes it was given in fixed-size chunks
+    """
+
+    def __init__(self, data, chunk):
+        self.data = data
+        self.chunk = chunk
+
+    def recv_into(self, view):
+        n = min(self.chunk, len(view), len(self.data))
+        view[:n] = self.data[:n]
+        self.data = self.data[n:]
+        return n
+
+
+def test_encode_decode_round_trip():
+    for header, data in [("YES", b"payload"), ("NO", b""), ("TAIL", "DATA"), ("CCA", 1.5e-6), ("YES", 42)]:
+        code = plcp.encode_message(_packet(header, data), 7)
+        msg = plcp.MessageReader(_ChunkedSocket(code, len(code))).read()
+        assert msg["HEADER"] == header
+        assert msg["ID"] == 7
+        assert msg["DATA"] == plcp.to_bytes(data)
+
+
+def test_encode_decode_pkt():
+    pkt = _packet("PKT", {"HEADER": "DATA_FRAG", "INFO": {"packet": b"\x08" * 30, "encoding": 3, "timestamp": 1.25}})
+    msg = plcp.MessageReader(_ChunkedSocket(plcp.encode_message(pkt, 1), 1024)).read()
+    assert msg["DATA"]["HEADER"] == "DATA_FRAG"
+    assert msg["DATA"]["INFO"] == {"packet": b"\x08" * 30, "encoding": 3, "timestamp": 1.25}
+
+
+def test_scalar_payloads():
+    assert plcp.decode_int(plcp.to_bytes(-3)) == -3
+    assert plcp.decode_float(plcp.to_bytes(2.5e6)) == 2.5e6
+    with pytest.raises(TypeError):
+        plcp.to_bytes(True)
+
+
+@pytest.mark.parametrize("chunk", [1, 3, 10, 4096])
+def test_reader_reassembles_split_and_merged_messages(chunk):
+    payloads = [b"a" * n for n in (0, 1, 9, 300)] + [b"b" * 70000]  # the last one outgrows the buffer
+    stream = b"".join(plcp.encode_message(_packet("YES", p), i) for i, p in enumerate(payloads))
+    reader = plcp.MessageReader(_ChunkedSocket(stream, chunk), bufsize=64)
+    for i, payload in enumerate(payloads):
+        msg = reader.read()
+        assert (msg["ID"], msg["DATA"]) == (i, payload)
+    assert reader.read() is None
+
+
+def test_reader_skips_malformed_message():
+    stream = plcp.MSG_HEADER.pack(200, 5, 2) + b"xx" + plcp.encode_message(_packet("YES", b"ok"), 6)
+    reader = plcp.MessageReader(_ChunkedSocket(stream, 4))
+    with pytest.raises(plcp.MessageError) as error:
+        reader.read()
+    assert error.value.header is None and error.value.req_id == 5
+    assert reader.read()["DATA"] == b"ok"
+
+
+@pytest.mark.parametrize("header", ["PKT", "PKT_SHM"])
+def test_reader_rejects_unknown_encoding(header):
+    prefix = plcp.PKT_INFO.pack(0, plcp.N_ENCODINGS, 0.0)
+    body = prefix + (plcp.SHM_DESCRIPTOR.pack(0, 30) if header == "PKT_SHM" else b"\x08" * 30)
+    stream = plcp.MSG_HEADER.pack(plcp.MSG_CODES[header], 3, len(body)) + body
+    reader = plcp.MessageReader(_ChunkedSocket(stream + plcp.encode_message(_packet("YES", b"ok"), 4), 4096))
+    with pytest.raises(plcp.MessageError) as error:
+        reader.read()
+    assert (error.value.header, error.value.req_id) == (header, 3)
+    assert reader.read()["DATA"] == b"ok"
+
+
+def test_reader_rejects_corrupted_length():
+    reader = plcp.MessageReader(_ChunkedSocket(plcp.MSG_HEADER.pack(3, 1, plcp.MSG_MAX_LEN + 1), 64))
+    with pytest.raises(ValueError):
+        reader.read()
+
+
+def test_receive_from_mac_leaves_following_messages():
+    a, b = socket.socketpair()
+    with a, b:
+        a.sendall(plcp.encode_message(_packet("YES", b"one"), 1) + plcp.encode_message(_packet("NO", b"two"), 2))
+        assert plcp.receive_from_mac(b)["DATA"] == b"one"
+        assert plcp.MessageReader(b).read()["DATA"] == b"two"
+        a.close()
+        assert plcp.receive_from_mac(b) is None
+
+
+def test_read_message_from_stream():
+    async def read_all(stream):
+        reader = asyncio.StreamReader()
+        reader.feed_data(stream)
+        reader.feed_eof()
+        return [await plcp.read_message(reader), await plcp.read_message(reader), await plcp.read_message(reader)]
+
+    stream = plcp.encode_message(_packet("YES", b"x"), 1) + plcp.encode_message(_packet("BEACON", b""), 2)
+    first, second, end = asyncio.run(read_all(stream))
+    assert (first["HEADER"], first["DATA"], second["HEADER"], end) == ("YES", b"x", "BEACON", None)
+
+
+@pytest.fixture
+def ring(tmp_path):
+    writer = plcp.ShmRing(str(tmp_path / "ring"), 100)
+    reader = plcp.ShmRing(str(tmp_path / "ring"))
+    yield writer, reader
+    reader.close()
+    writer.close()
+
+
+def test_shm_ring_put_get(ring):
+    writer, reader = ring
+    first = writer.put(b"a" * 40)
+    second = writer.put(b"b" * 40)
+    assert first == (0, 40) and second == (40, 40)
+    assert writer.put(b"c" * 40) is None  # full
+    assert reader.get(*first) == b"a" * 40
+    assert reader.get(*second) == b"b" * 40
+
+
+def test_shm_ring_never_wraps_a_payload(ring):
+    writer, reader = ring
+    reader.get(*writer.put(b"a" * 70))
+    position, length = writer.put(b"b" * 50)  # doesn't fit in the last 30 bytes
+    assert position == 100 and position % writer.capacity == 0
+    assert reader.get(position, length) == b"b" * 50
+
+
+@pytest.mark.parametrize("descriptor", [(0, 40), (60, 10), (40, 30)])  # released, past the writer, overlapping
+def test_shm_ring_rejects_bad_descriptor(ring, descriptor):
+    writer, reader = ring
+    reader.get(*writer.put(b"a" * 40))
+    assert writer.put(b"b" * 20) == (40, 20)
+    with pytest.raises(ValueError):
+        reader.get(*descriptor)
+    assert reader.get(40, 20) == b"b" * 20
+
+
+def test_shm_ring_rejects_wrapping_descriptor(tmp_path):
+    writer = plcp.ShmRing(str(tmp_path / "ring"), 100)
+    reader = plcp.ShmRing(str(tmp_path / "ring"))
+    try:
+        reader.get(*writer.put(b"a" * 90))
+        writer.put(b"b" * 50)  # written at 100, after the skipped end of the ring
+        with pytest.raises(ValueError):
+            reader.get(90, 20)
+    finally:
+        reader.close()
+        writer.close()
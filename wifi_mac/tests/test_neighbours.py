@@ -0,0 +1,40 @@
+import uwicore_mac_utils as mac
+
+
+def _beacon(node, bi=0.1):
+    values = {"address2": mac.assign_mac(node), "N_SEQ": 0, "N_FRAG": 0, "BI": bi}
+    return mac.MacFrame(mac.generate_pkt("BEACON", 4e-6, 0, values)["INFO"]["packet"])
+
+
+def test_update_and_get():
+    table = mac.NeighbourTable()
+    beacon = _beacon(2)
+    table.update(beacon, rssi=-40.0, now=100.0)
+    entry = table.get(mac.assign_mac(2), now=100.0)
+    assert entry["MAC"] == mac.assign_mac(2) and entry["RSSI"] == -40.0
+    assert entry["BI"] == beacon["BI"] and entry["OFFSET"] == 100.0 - beacon["timestamp"]
+    assert mac.assign_mac(2) in table and len(table) == 1
+
+    table.update(_beacon(2), rssi=-50.0, now=100.05)  # same neighbour: one entry
+    assert len(table) == 1 and table.get(mac.assign_mac(2), now=100.05)["RSSI"] == -50.0
+
+
+def test_entries_are_copies():
+    table = mac.NeighbourTable()
+    table.update(_beacon(2), now=1.0)
+    table.get(mac.assign_mac(2), now=1.0)["RSSI"] = 99.0
+    table.snapshot(now=1.0)[0]["RSSI"] = 99.0
+    assert table.get(mac.assign_mac(2), now=1.0)["RSSI"] == 0.0
+
+
+def test_expire_after_missed_beacons():
+    table = mac.NeighbourTable(max_missed=3)
+    beacon = _beacon(2)
+    interval = beacon["BI"] * 1024e-6  # beacon interval (s)
+    table.update(beacon, now=10.0)
+    table.update(_beacon(3, bi=1.0), now=10.0)
+    assert table.expire(now=10.0 + 2 * interval) == []
+    assert table.get(mac.assign_mac(2), now=10.0 + 4 * interval) is None  # expired, not dropped yet
+    assert len(table) == 2
+    assert table.expire(now=10.0 + 4 * interval) == [mac.assign_mac(2)]
+    assert [entry["MAC"] for entry in table.snapshot(now=10.0 + 4 * interval)] == [mac.assign_mac(3)]
@@ -0,0 +1,68 @@
+import pytest
+
+import buffer_lib
+
+A = b"\x00\x01\x02\x03\x04\x0a"
+B = b"\x00\x01\x02\x03\x04\x0b"
+
+
+def _drain(queues):
+    sent = []
+    while not queues.isEmpty():
+        dest, packet = queues.head()
+        assert queues.head() == (dest, packet)  # handed out again until removed
+        assert queues.remove() == (dest, packet)
+        sent.append((dest, packet))
+    return sent
+
+
+def test_rr_interleaves_destinations():
+    queues = buffer_lib.PeerQueues()
+    for n in range(3):
+        queues.push(A, "a%d" % n)
+    queues.push(B, "b0")
+    queues.push(None, "broadcast")
+    assert queues.lengths() == {A: 3, B: 1, None: 1}
+    assert _drain(queues) == [(A, "a0"), (B, "b0"), (None, "broadcast"), (A, "a1"), (A, "a2")]
+    assert queues.head() is None and queues.remove() is None
+
+
+def test_rr_retries_the_head_packet():
+    queues = buffer_lib.PeerQueues()
+    queues.push(A, "a0")
+    queues.push(B, "b0")
+    assert queues.head() == (A, "a0")
+    queues.push(A, "a1")  # pushing doesn't change the packet being sent
+    assert queues.head() == (A, "a0")
+    assert queues.remove() == (A, "a0")
+    assert queues.head() == (B, "b0")
+
+
+@pytest.mark.parametrize("quantum", [500, 1500])
+def test_drr_shares_bytes(quantum):
+    queues = buffer_lib.PeerQueues("drr", quantum)
+    for n in range(12):
+        queues.push(A, b"a" * 1500)
+    for n in range(36):
+        queues.push(B, b"b" * 500)
+    sent = _drain(queues)
+    served = {A: 0, B: 0}
+    for dest, packet in sent[:24]:  # both queues still backlogged
+        served[dest] += len(packet)
+    assert abs(served[A] - served[B]) <= 1500
+    assert len(sent) == 48 and queues.length() == 0
+
+
+def test_drr_empty_queue_keeps_no_credit():
+    queues = buffer_lib.PeerQueues("drr", 1000)
+    queues.push(A, b"a" * 100)
+    assert _drain(queues) == [(A, b"a" * 100)]
+    assert queues.deficit[A] == 0
+    queues.push(A, b"a" * 1500)  # needs two turns of credit
+    queues.push(B, b"b" * 100)
+    assert [dest for dest, packet in _drain(queues)] == [B, A]
+
+
+def test_invalid_scheduling():
+    with pytest.raises(AssertionError):
+        buffer_lib.PeerQueues("fifo")
@@ -0,0 +1,77 @@
+import threading
+import time
+
+import uwicore_mac_utils as mac
+
+
+def test_capacity_evicts_the_oldest():
+    queues = mac.RxQueues(2)
+    for frame in ("a", "b", "c"):
+        assert queues.put("DATA", frame)
+    assert queues.drain(["DATA"]) == ["b", "c"]
+    assert queues.stats()["DATA"] == {"queued": 0, "received": 3, "overflow": 1, "expired": 0}
+
+
+def test_per_type_capacity():
+    queues = mac.RxQueues({"ACK": 1})
+    assert not queues.put("DATA", "d")  # only counted
+    assert queues.put("ACK", "a1") and queues.put("ACK", "a2")
+    assert queues.get("DATA") is None
+    assert queues.get("ACK") == "a2"
+    assert queues.stats()["DATA"]["received"] == 1
+
+
+def test_max_age_drops_stale_frames():
+    queues = mac.RxQueues(8, {"ACK": 0.05})
+    queues.put("ACK", "stale")
+    queues.put("DATA", "kept")
+    time.sleep(0.08)
+    queues.put("ACK", "fresh")
+    assert queues.get("ACK") == "fresh"
+    assert queues.get("ACK") is None
+    assert queues.get("DATA") == "kept"
+    assert queues.stats()["ACK"]["expired"] == 1
+
+
+def test_get_waits_for_a_frame():
+    queues = mac.RxQueues()
+    threading.Timer(0.05, queues.put, ("CTS", "c")).start()
+    assert queues.get("CTS", 1) == "c"
+    assert queues.get("CTS", 0.01) is None
+
+
+def test_wait_any_type_and_close():
+    queues = mac.RxQueues()
+    threading.Timer(0.05, queues.put, ("ACK", "a")).start()
+    assert queues.wait(["DATA", "ACK"], 1)
+    assert not queues.wait(["DATA"], 0.01)
+    queues.close()
+    started = time.monotonic()
+    assert queues.get("DATA", 1) is None
+    assert time.monotonic() - started < 0.5
+
+
+def test_phy_transport_queues():
+    phy = mac.PhyTransport()
+    phy.set_queue_limits(2, {"ACK": 0.05})
+    notified = []
+    phy.add_listener(notified.append)
+    for n in range(3):
+        phy._queue_frame("DATA", n)
+    phy._queue_frame("ACK", "late")
+    time.sleep(0.08)
+    assert not phy.wait_frame(("ACK",), 0)
+    assert phy.pop_frame("DATA") == 1  # frame 0 was evicted
+    assert phy.queue_stats()["DATA"]["overflow"] == 1
+    assert phy.queue_stats()["ACK"]["expired"] == 1
+    assert notified == ["DATA"] * 3 + ["ACK"]
+
+
+def test_phy_transport_router():
+    phy = mac.PhyTransport()
+    routed = []
+    phy.set_router(lambda header, frame: routed.append((header, frame["RX_add"])))
+    ack = mac.generate_pkt("ACK", 4e-6, 0, {"mac_ra": mac.assign_mac(3)})["INFO"]["packet"]
+    phy._push_frame(ack)
+    assert routed == [("ACK", mac.assign_mac(3))]
+    assert phy.pop_frame("ACK") is None
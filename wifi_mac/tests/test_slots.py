@@ -0,0 +1,98 @@
+import threading
+import time
+
+import pytest
+
+import uwicore_mac_utils as mac
+from mac_fsm import MacState
+
+MS = 1000000  # ns
+
+
+def test_wait_until():
+    scheduler = mac.SlotScheduler()
+    deadline = scheduler.now() + 2 * MS
+    drift = scheduler.wait_until(deadline)
+    assert drift is not None and drift >= 0
+    assert scheduler.now() >= deadline
+    stats = scheduler.stats()
+    assert stats["waits"] == 1 and stats["overruns"] == {}
+
+
+def test_overruns_per_state():
+    scheduler = mac.SlotScheduler()
+    assert scheduler.wait_until(scheduler.now() - MS, MacState.BACKING_OFF) is None
+    assert scheduler.wait_until(scheduler.now() - 3 * MS, MacState.BACKING_OFF) is None
+    assert scheduler.wait_until(scheduler.now() - MS, MacState.WAIT_FOR_DIFS) is None
+    stats = scheduler.stats()
+    assert stats["waits"] == 0
+    assert stats["overruns"] == {"BACKING_OFF": 2, "WAIT_FOR_DIFS": 1}
+    assert stats["overrun_max_us"] >= 3000
+    assert stats["beta_scale"] == 1.0  # not adaptive
+    scheduler.reset_stats()
+    assert scheduler.stats()["overruns"] == {}
+
+
+def test_realign():
+    now = mac.SlotScheduler.now()
+    next_end, skipped = mac.SlotScheduler.realign(now - 2500 * MS, 1000 * MS)
+    assert skipped == 3
+    assert next_end == now + 500 * MS
+
+
+def test_adaptive_beta_raise():
+    scheduler = mac.SlotScheduler(adaptive=True, max_scale=4)
+    for n in range(scheduler.RAISE_AFTER - 1):
+        scheduler.wait_until(scheduler.now() - MS)
+    assert scheduler.scale == 1.0
+    scheduler.wait_until(scheduler.now() - MS)
+    assert scheduler.scale == 2.0
+    for n in range(2 * scheduler.RAISE_AFTER):
+        scheduler.wait_until(scheduler.now() - MS)
+    assert scheduler.scale == 4.0  # max_scale
+    assert scheduler.stats()["beta_scale_changes"] == 2
+
+
+def test_adaptive_beta_isolated_overruns():
+    scheduler = mac.SlotScheduler(spin=1, adaptive=True, max_scale=4)  # spin only, no sleep
+    for n in range(2 * scheduler.OVERRUN_WINDOW):
+        if n % (scheduler.OVERRUN_WINDOW // 2) == 0:
+            scheduler.wait_until(scheduler.now() - MS)
+        else:
+            scheduler.wait_until(scheduler.now() + MS)
+    assert scheduler.scale == 1.0
+
+
+def test_adaptive_beta_lower(monkeypatch):
+    monkeypatch.setattr(mac.SlotScheduler, "LOWER_AFTER", 4)
+    scheduler = mac.SlotScheduler(spin=1, adaptive=True, max_scale=2)
+    for n in range(scheduler.RAISE_AFTER):
+        scheduler.wait_until(scheduler.now() - MS)
+    assert scheduler.scale == 2.0
+    for n in range(3):
+        scheduler.wait_until(scheduler.now() + MS)
+    assert scheduler.scale == 2.0
+    scheduler.wait_until(scheduler.now() + MS)
+    assert scheduler.scale == 1.0
+
+
+def test_wait_frame_until():
+    scheduler = mac.SlotScheduler()
+    phy = mac.PhyTransport()
+    assert not scheduler.wait_frame_until(phy, ("ACK",), scheduler.now() + MS)  # unsubscribed: plain wait
+    phy.subscribed = True
+    timer = threading.Timer(0.01, phy._queue_frame, ("ACK", "ack"))
+    timer.start()
+    started = time.monotonic()
+    assert scheduler.wait_frame_until(phy, ("ACK",), scheduler.now() + 1000 * MS)
+    assert time.monotonic() - started < 0.5
+    assert phy.pop_frame("ACK") == "ack"
+    assert not scheduler.wait_frame_until(phy, ("ACK",), scheduler.now() + 5 * MS)
+    timer.join()
+
+
+@pytest.mark.parametrize("nav, slot, remaining", [(0, 0.01, 0), (0.001, 0.01, 0), (0.05, 0.001, 0.049)])
+def test_update_nav(nav, slot, remaining):
+    start = time.monotonic_ns()
+    assert mac.update_nav(start, nav, slot) == pytest.approx(remaining, abs=0.003)
+    assert time.monotonic_ns() - start >= min(nav, slot) * 1e9
@@ -47,7 +47,6 @@
 #	Dr. Javier Gozalvez (j.gozalvez@umh.es)
 
 
-import pickle
 import socket
 import time
 from optparse import OptionParser
@@ -70,8 +69,7 @@ class Client(Thread):
         self.print_buffer = print_buffer
 
     def run(self):
-        pkt = self.socket.recv(1000)
-        arrived_packet = pickle.loads(pkt)
+        arrived_packet = plcp.receive_from_mac(self.socket)
 
         if "no_packet" == arrived_packet["HEADER"]:  # check whether the queue is empty
             if self.cs.isEmpty():
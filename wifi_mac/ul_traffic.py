@@ -47,7 +47,6 @@
 #	Dr. Javier Gozalvez (j.gozalvez@umh.es)
 
 
-import pickle
 import random
 import socket
 import time
@@ -55,6 +54,8 @@ from optparse import OptionParser
 
 from gnuradio.eng_option import eng_option
 
+import uwicore_mpif as plcp
+
 if __name__ == '__main__':
 
     parser = OptionParser(option_class=eng_option, conflict_handler="resolve")
@@ -102,7 +103,6 @@ if __name__ == '__main__':
         elif num == 3:
             pkt = create_packet("PAYLOAD", "TEST_4")
 
-        packet = pickle.dumps(pkt, 1)
-        s.send(packet)
+        plcp.send_to_mac(s, pkt)
         s.close()
         time.sleep(interval)
@@ -68,82 +68,560 @@
 #	Dr. Javier Gozalvez (j.gozalvez@umh.es)
 
 
+import asyncio
+import functools
 import math
-import pickle
+import os
 import random
 import socket
+import struct
+import threading
 import time
+from collections import deque
+
+import uwicore_mpif as plcp
+
+try:
+    import numpy as np
+except ImportError:  # Vectorized airtime lookups fall back to lists
+    np = None
+
+
+# Types of received frames the PHY reports to the MAC
+PHY_FRAME_TYPES = ("DATA", "ACK", "RTS", "CTS", "BEACON")
+
+# Types of received frames the PHY queues for the MAC (see RxQueues). OTHER: DATA for other nodes, only counted
+RX_QUEUE_TYPES = ("DATA", "ACK", "RTS", "CTS", "OTHER")
+
+# OFDM data bits per symbol and nominal data rate (Mbps at 20 MHz) of each encoding
+N_DBPS = (24, 36, 48, 72, 96, 144, 192, 216)
+DATA_RATES = (6, 9, 12, 18, 24, 36, 48, 54)
+
+# MPDU lengths in bytes, FCS not included
+MAX_MPDU_LEN = 2304
+DATA_HEADER_LEN = 24
+RTS_LEN = 16
+CTS_LEN = 10
+ACK_LEN = 10
+
+# Length prefix of every MPDU on the PHYRXport stream (see phy_wifi.pdu_framer and FrameReader)
+RX_FRAME_PREFIX = struct.Struct("<H")
+
+# MAC header layouts (little endian): frame control, duration, addresses, sequence control, ...
+_CTRL_HEADER = struct.Struct("<BBH6s")  # CTS, ACK
+_RTS_HEADER = struct.Struct("<BBH6s6s")
+_DATA_HEADER = struct.Struct("<BBH6s6s6sH")
+_BEACON = struct.Struct("<BBH6s6s6sHQHH")  # + timestamp, beacon interval, capability info
+_BEACON_BODY = struct.Struct("<QHH")
+_SEQ_CONTROL = struct.Struct("<H")
+_DATA_TEMPLATE = struct.Struct("<2sH18sH")  # cached frame control | duration | cached addresses | sequence control
+
+# Columns of the batch frame parsers (parse_frames, parse_pcap).
+# type indexes uwicore_mpif.FRAME_TYPES (-1: unknown frame), addresses are integers (see mac_to_int),
+# payload_offset is -1 for frames without a body
+if np is not None:
+    FRAME_DTYPE = np.dtype([("type", np.int8), ("length", np.int32), ("duration", np.uint16),
+                            ("addr1", np.uint64), ("addr2", np.uint64), ("seq", np.uint16), ("frag", np.uint8),
+                            ("offset", np.int64), ("payload_offset", np.int64)])
+    PCAP_FRAME_DTYPE = np.dtype([("time", np.float64)] + FRAME_DTYPE.descr)
+
+    _FRAME_TYPE_CODES = np.full((256, 256), -1, dtype=np.int8)  # [type/subtype byte, flags byte]
+    for _fc, _name in ((0x80, "BEACON"), (0xc4, "CTS"), (0xb4, "RTS"), (0xd4, "ACK")):
+        _FRAME_TYPE_CODES[_fc, :] = plcp.FRAME_TYPES.index(_name)
+    for _flags, _name in ((0x00, "DATA"), (0x04, "DATA_FRAG"), (0x08, "DATA_RETX")):
+        _FRAME_TYPE_CODES[0x08, _flags] = plcp.FRAME_TYPES.index(_name)
+_DATA_TYPE_CODES = [plcp.FRAME_TYPES.index(name) for name in ("DATA", "DATA_FRAG", "DATA_RETX")]
+_FRAME_TYPE_BEACON = plcp.FRAME_TYPES.index("BEACON")
+_FRAME_TYPE_RTS = plcp.FRAME_TYPES.index("RTS")
+
+_PCAP_HEADER_LEN = 24
+_LINKTYPE_IEEE802_11 = 105
+_LINKTYPE_RADIOTAP = 127
+
+# Frame types by frame control field (type/subtype byte, then flags byte of DATA frames)
+_CTRL_FRAME_TYPES = {0x80: "BEACON", 0xc4: "CTS", 0xb4: "RTS", 0xd4: "ACK"}
+_DATA_FRAME_TYPES = {0x00: "DATA", 0x04: "DATA_FRAG", 0x08: "DATA_RETX"}
+# Shortest frame of each type, the shorter ones are truncated and left unclassified
+_MIN_FRAME_LEN = {"DATA": DATA_HEADER_LEN, "DATA_FRAG": DATA_HEADER_LEN, "DATA_RETX": DATA_HEADER_LEN,
+                  "RTS": RTS_LEN, "CTS": CTS_LEN, "ACK": ACK_LEN, "BEACON": _BEACON.size}
+
+MAC_PREFIX = b"\x00\x50\xc2\x85\x33"  # first 5 bytes of the station addresses, see assign_mac
+BROADCAST_MAC = b"\xff" * 6
+
+
+class MacFrame:
+    """
+    Read-only view of a received MPDU.
+    Frame type, duration and first address are decoded with a single struct.unpack_from, enough
+    to classify the frame and drop it if it is not for us. The other fields are decoded from the
+    buffer only when accessed, without copying the frame.
+    Items can be read with the keys of the frame information of the frame builders
+    (frame["RX_add"], frame["PAYLOAD"], ...).
+    :param pkt: input frame (bytes-like)
+    """
+
+    __slots__ = ("buf", "header", "duration", "addr1")
+
+    _KEYS = {"packet": "buf", "tx_time": "duration", "mac_duration": "duration",
+             "RX_add": "addr1", "mac_add1": "addr1", "TX_add": "addr2", "mac_add2": "addr2",
+             "N_SEQ": "seq", "N_FRAG": "frag", "MF": "frag", "PAYLOAD": "payload",
+             "timestamp": "timestamp", "BI": "beacon_interval", "SSID": "ssid"}
+
+    def __init__(self, pkt):
+        self.buf = memoryview(pkt)
+        if len(self.buf) < _CTRL_HEADER.size:
+            self.header, self.duration, self.addr1 = "", 0, None
+            return
+        fc_type, fc_flags, self.duration, self.addr1 = _CTRL_HEADER.unpack_from(self.buf)
+        if fc_type == 0x08:
+            header = _DATA_FRAME_TYPES.get(fc_flags, "")
+        else:
+            header = _CTRL_FRAME_TYPES.get(fc_type, "")
+        self.header = header if len(self.buf) >= _MIN_FRAME_LEN.get(header, 0) else ""
+
+    def __getitem__(self, key):
+        return getattr(self, self._KEYS[key])
+
+    def __len__(self):
+        return len(self.buf)
+
+    @property
+    def addr2(self):
+        return bytes(self.buf[10:16])
+
+    @property
+    def seq(self):
+        return _SEQ_CONTROL.unpack_from(self.buf, 22)[0] >> 4
+
+    @property
+    def frag(self):
+        return self.buf[22] & 0xf
+
+    @property
+    def payload(self):
+        return bytes(self.buf[DATA_HEADER_LEN:])
+
+    @property
+    def timestamp(self):
+        return _BEACON_BODY.unpack_from(self.buf, 24)[0]
+
+    @property
+    def beacon_interval(self):
+        return _BEACON_BODY.unpack_from(self.buf, 24)[1]
+
+    @property
+    def ssid(self):
+        if len(self.buf) <= _BEACON.size:  # optional SSID is not included
+            return ""
+        ssid_len = self.buf[37]
+        return bytes(self.buf[38:38 + ssid_len]).decode("latin-1")
 
 
 def parse_mac(pkt, log=False):
     """
     Parse the frame
-    :param pkt: input frame (string)
+    :param pkt: input frame (bytes-like)
     :param log: Print input
-    :return: MAC parameters
+    :return: frame type and MAC parameters (MacFrame)
     """
-    header = info = ""
-
     if log:
-        print("The content of pkt: ", pkt)
-
-    if pkt[0] == chr(0x80):
-        header = "BEACON"
-        mac_duration = ord(pkt[2]) + (ord(pkt[3]) << 8)
-        mac_da = pkt[4:10]  # Destination address
-        mac_sa = pkt[10:16]  # Source address
-        mac_bssid = pkt[16:22]  # BSS ID
-        mac_seq = (ord(pkt[22]) >> 4) + (ord(pkt[23]) << 4)  # Seq-ctrl
-        mac_frag = (ord(pkt[22]) & 0xf)
-        timestamp = ord(pkt[24]) + (ord(pkt[25]) << 8) + (ord(pkt[26]) << 16) + (ord(pkt[27]) << 24) + \
-                    (ord(pkt[28]) << 32) + (ord(pkt[29]) << 40) + (ord(pkt[30]) << 48) + (ord(pkt[31]) << 56)
-        bi = ord(pkt[32]) + (ord(pkt[33]) << 8)  # Beacon interval
-        capability_info = ord(pkt[34]) + (ord(pkt[35]) << 8)  # Capability info
-        ssid = ""
-        if len(pkt) > 36:  # optional SSID is included
-            ssid_len = ord(pkt[37])
-            ssid = "".join(pkt[38:(38 + ssid_len)])
-        info = {"packet": pkt, "mac_duration": mac_duration, "mac_add1": mac_da, "mac_add2": mac_sa,
-                "N_SEQ": mac_seq, "N_FRAG": mac_frag, "MF": mac_frag, "timestamp": timestamp, "BI": bi, "SSID": ssid}
-
-    elif pkt[0] == chr(0xc4):
-        header = "CTS"
-        tx_time = ord(pkt[2]) + (ord(pkt[3]) << 8)
-        mac_ra = pkt[4:10]
-        info = {"packet": pkt, "tx_time": tx_time, "RX_add": mac_ra}
-
-    elif pkt[0] == chr(0xb4):
-        header = "RTS"
-        tx_time = ord(pkt[2]) + (ord(pkt[3]) << 8)
-        mac_ra = pkt[4:10]
-        mac_ta = pkt[10:16]
-        info = {"packet": pkt, "tx_time": tx_time, "RX_add": mac_ra, "TX_add": mac_ta}
-
-    elif pkt[0] == chr(0xd4):
-        header = "ACK"
-        tx_time = ord(pkt[2]) + (ord(pkt[3]) << 8)
-        mac_ra = pkt[4:10]
-        info = {"packet": pkt, "tx_time": tx_time, "RX_add": mac_ra}
-
-    elif pkt[0] == chr(0x08) and (pkt[1] == chr(0x00) or pkt[1] == chr(0x04) or pkt[1] == chr(0x08)):  # DATA frames
-        if pkt[1] == chr(0x00):
-            header = "DATA"
-        elif pkt[1] == chr(0x04):
-            header = "DATA_FRAG"
-        elif pkt[1] == chr(0x08):
-            header = "DATA_RETX"
-
-        tx_time = ord(pkt[2]) + (ord(pkt[3]) << 8)
-        mac_da = pkt[4:10]
-        mac_sa = pkt[10:16]
-        mac_bssid = pkt[16:22]
-        mac_seq = (ord(pkt[22]) >> 4) + (ord(pkt[23]) << 4)  # Seq-ctrl
-        mac_frag = (ord(pkt[22]) & 0xf)
-        payload = pkt[24:]
-        info = {"packet": pkt, "tx_time": tx_time, "mac_add1": mac_da, "mac_add2": mac_sa, "N_SEQ": mac_seq,
-                "N_FRAG": mac_frag, "MF": mac_frag, "PAYLOAD": payload}
-
-    return create_packet(header, info)
+        print("The content of pkt: ", bytes(pkt))
+
+    frame = MacFrame(pkt)
+    return create_packet(frame.header, frame)
+
+
+def parse_frames(buf, lengths):
+    """
+    Parse a batch of frames at once, e.g. a bulk receive buffer. Needs numpy.
+    The fields of all the frames are decoded with array operations, no per-frame object is built.
+    :param buf: concatenated frames (bytes-like)
+    :param lengths: length of each frame in bytes
+    :return: structured array of FRAME_DTYPE, one record per frame. The payload offsets index buf.
+    """
+    if np is None:
+        raise ImportError("parse_frames requires numpy")
+    lengths = np.asarray(lengths, dtype=np.int64)
+    offsets = np.zeros(len(lengths), dtype=np.int64)
+    np.cumsum(lengths[:-1], out=offsets[1:])
+    return _parse_frame_arrays(np.frombuffer(buf, dtype=np.uint8), offsets, lengths)
+
+
+def parse_pcap(path):
+    """
+    Parse a whole pcap capture (e.g. /tmp/wifi.pcap of foo.wireshark_connector, or the simulation
+    results) at once. Needs numpy.
+    Records are IEEE 802.11 frames (link type 105), optionally behind a radiotap header (link type 127).
+    :param path: pcap file
+    :return: structured array of PCAP_FRAME_DTYPE, one record per captured frame,
+             and the content of the file (uint8 array) the payload offsets index
+    """
+    if np is None:
+        raise ImportError("parse_pcap requires numpy")
+    with open(path, "rb") as f:
+        raw = f.read()
+
+    magic = raw[:4]
+    if magic in (b"\xd4\xc3\xb2\xa1", b"\x4d\x3c\xb2\xa1"):
+        order = "<"
+    elif magic in (b"\xa1\xb2\xc3\xd4", b"\xa1\xb2\x3c\x4d"):
+        order = ">"
+    else:
+        raise ValueError("%s is not a pcap file" % path)
+    ts_scale = 1e-9 if magic in (b"\x4d\x3c\xb2\xa1", b"\xa1\xb2\x3c\x4d") else 1e-6
+    linktype = struct.unpack_from(order + "I", raw, 20)[0]
+    if linktype not in (_LINKTYPE_IEEE802_11, _LINKTYPE_RADIOTAP):
+        raise ValueError("Unsupported pcap link type %d" % linktype)
+
+    # Walk the record headers, the only per-frame Python step
+    record = struct.Struct(order + "IIII")
+    radiotap_len = struct.Struct("<H")  # radiotap headers are always little endian
+    times, offsets, lengths = [], [], []
+    pos, end = _PCAP_HEADER_LEN, len(raw) - record.size
+    while pos <= end:
+        ts_sec, ts_frac, incl_len, _ = record.unpack_from(raw, pos)
+        pos += record.size
+        if pos + incl_len > len(raw):  # truncated capture
+            break
+        skip = radiotap_len.unpack_from(raw, pos + 2)[0] if linktype == _LINKTYPE_RADIOTAP else 0
+        times.append(ts_sec + ts_frac * ts_scale)
+        offsets.append(pos + skip)
+        lengths.append(incl_len - skip)
+        pos += incl_len
+
+    data = np.frombuffer(raw, dtype=np.uint8)
+    frames = _parse_frame_arrays(data, np.array(offsets, dtype=np.int64), np.array(lengths, dtype=np.int64))
+    records = np.empty(len(frames), dtype=PCAP_FRAME_DTYPE)
+    for name in FRAME_DTYPE.names:
+        records[name] = frames[name]
+    records["time"] = times
+    return records, data
+
+
+def _parse_frame_arrays(data, offsets, lengths):
+    frames = np.zeros(len(offsets), dtype=FRAME_DTYPE)
+    frames["offset"] = offsets
+    frames["length"] = lengths
+    frames["payload_offset"] = -1
+
+    def field(pos, width, valid):
+        # little endian field of width bytes at pos of each valid frame
+        value = np.zeros(len(offsets), dtype=np.uint64)
+        start = offsets[valid] + pos
+        for i in range(width):
+            value[valid] |= data[start + i].astype(np.uint64) << np.uint64(8 * i)
+        return value
+
+    def address(pos, valid):
+        # 6 bytes in transmission order, see mac_to_int
+        value = np.zeros(len(offsets), dtype=np.uint64)
+        start = offsets[valid] + pos
+        for i in range(6):
+            value[valid] |= data[start + i].astype(np.uint64) << np.uint64(8 * (5 - i))
+        return value
+
+    has_header = lengths >= _CTRL_HEADER.size
+    fc = field(0, 2, has_header).astype(np.int64)
+    frame_type = np.where(has_header, _FRAME_TYPE_CODES[fc & 0xff, fc >> 8], -1)
+    min_len = np.array([_MIN_FRAME_LEN[name] for name in plcp.FRAME_TYPES] + [0])  # [-1]: unknown frame
+    frame_type[lengths < min_len[frame_type]] = -1
+    frames["type"] = frame_type
+    frames["duration"] = field(2, 2, has_header)
+    frames["addr1"] = address(4, has_header)
+
+    is_data = np.isin(frame_type, _DATA_TYPE_CODES)
+    is_beacon = frame_type == _FRAME_TYPE_BEACON
+    is_rts = frame_type == _FRAME_TYPE_RTS
+    frames["addr2"] = address(10, is_data | is_beacon | is_rts)
+    seq_control = field(22, 2, is_data | is_beacon)
+    frames["seq"] = seq_control >> np.uint64(4)
+    frames["frag"] = seq_control & np.uint64(0xf)
+    frames["payload_offset"][is_data] = offsets[is_data] + DATA_HEADER_LEN
+    frames["payload_offset"][is_beacon] = offsets[is_beacon] + _BEACON.size
+    return frames
+
+
+def mac_to_int(mac_str):
+    """
+    Address in the form of the addr1 / addr2 columns of parse_frames and parse_pcap
+    :param mac_str: mac address (6 bytes)
+    :return: address as integer
+    """
+    return int.from_bytes(mac_str, "big")
+
+
+class FrameReader:
+    """
+    Streaming reader of the received MPDUs the PHY forwards on PHYRXport, each one behind its
+    length (RX_FRAME_PREFIX).
+    Bytes are received into a reusable buffer, frames split over several reads are reassembled
+    and all the frames merged in one read are returned together.
+    :param sd: connected stream socket
+    :param bufsize: initial size of the receive buffer
+    """
+
+    def __init__(self, sd, bufsize=65536):
+        self.sd = sd
+        self._buf = bytearray(bufsize)
+        self._start = 0  # first byte not consumed yet
+        self._end = 0  # end of the received bytes
+
+    def read_batch(self):
+        """
+        Wait for at least one complete frame
+        :return: list of MacFrame, None if the PHY closed the connection
+        """
+        while True:
+            frames = self.next_frames()
+            if frames:
+                return frames
+            if not self.fill():
+                return None
+
+    def next_frames(self):
+        """
+        Complete frames already received. Each frame is copied out of the buffer once.
+        :return: list of MacFrame, empty if there is none
+        """
+        frames = []
+        start, end = self._start, self._end
+        with memoryview(self._buf) as view:
+            while end - start >= RX_FRAME_PREFIX.size:
+                length, = RX_FRAME_PREFIX.unpack_from(view, start)
+                if start + RX_FRAME_PREFIX.size + length > end:
+                    break
+                start += RX_FRAME_PREFIX.size
+                frames.append(MacFrame(bytes(view[start:start + length])))
+                start += length
+        self._start = start
+        return frames
+
+    def fill(self):
+        """
+        Receive more bytes from the socket
+        :return: False if the PHY closed the connection
+        """
+        pending = self._end - self._start
+        if self._start > 0:  # move the partial frame to the front of the buffer
+            self._buf[:pending] = self._buf[self._start:self._end]
+            self._start, self._end = 0, pending
+        if pending >= RX_FRAME_PREFIX.size:  # make room for the whole frame
+            length = RX_FRAME_PREFIX.size + RX_FRAME_PREFIX.unpack_from(self._buf)[0]
+            if length > len(self._buf):
+                self._buf.extend(bytearray(length - len(self._buf)))
+        with memoryview(self._buf) as view:
+            n = self.sd.recv_into(view[self._end:])
+        self._end += n
+        return n > 0
+
+
+class NeighbourTable:
+    """
+    Neighbour nodes heard through their beacons, by MAC address.
+    A beacon updates the entry of its sender in O(1). A neighbour expires when none of its beacons
+    was heard for max_missed of its beacon intervals. rx_client writes the table while the PHY
+    request handlers and the MAC read it, so entries are only handed out as copies.
+    :param max_missed: beacons missed in a row before a neighbour is dropped
+    """
+
+    def __init__(self, max_missed=3):
+        self.max_missed = max_missed
+        self._entries = {}  # MAC address -> entry (see uwicore_mpif.new_beacon)
+        self._lock = threading.Lock()
+
+    def update(self, beacon, rssi=0.0, now=None):
+        """
+        Record a received beacon
+        :param beacon: received BEACON frame (MacFrame)
+        :param rssi: power level of the probe at reception
+        :param now: reception time (time.time())
+        :return: none
+        """
+        now = time.time() if now is None else now
+        entry = plcp.new_beacon()
+        entry["MAC"] = beacon["mac_add2"]
+        entry["SSID"] = beacon["SSID"]
+        entry["timestamp"] = beacon["timestamp"]
+        entry["BI"] = beacon["BI"]
+        entry["OFFSET"] = now - entry["timestamp"]
+        entry["RSSI"] = rssi
+        entry["last_seen"] = now
+        with self._lock:
+            self._entries[entry["MAC"]] = entry
+
+    def _expired(self, entry, now):
+        return now - entry["last_seen"] > self.max_missed * max(entry["BI"], 1) * 1024e-6
+
+    def expire(self, now=None):
+        """
+        Drop the neighbours whose beacons are no longer heard
+        :param now: current time (time.time())
+        :return: MAC addresses of the dropped neighbours
+        """
+        now = time.time() if now is None else now
+        with self._lock:
+            lost = [mac_addr for mac_addr, entry in self._entries.items() if self._expired(entry, now)]
+            for mac_addr in lost:
+                del self._entries[mac_addr]
+        return lost
+
+    def get(self, mac_addr, now=None):
+        """
+        :return: copy of the entry of a neighbour, None if it is unknown or expired
+        """
+        now = time.time() if now is None else now
+        with self._lock:
+            entry = self._entries.get(mac_addr)
+            if entry is None or self._expired(entry, now):
+                return None
+            return dict(entry)
+
+    def snapshot(self, now=None):
+        """
+        Expire the lost neighbours and copy the table
+        :param now: current time (time.time())
+        :return: list of entries (see uwicore_mpif.new_beacon), in order of first reception
+        """
+        self.expire(now)
+        with self._lock:
+            return [dict(entry) for entry in self._entries.values()]
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, mac_addr):
+        return mac_addr in self._entries
+
+
+class RxQueues:
+    """
+    Received frames waiting for the MAC, one queue per frame type, between rx_client (producer)
+    and the TAIL requests of proc_mac_request (consumers).
+    A queue is bounded: a frame arriving at a full queue evicts the oldest one. Frames older than
+    the age limit of their type are dropped instead of being handed out, so that a stale ACK is
+    never matched to a later transmission. Consumers can block until a frame arrives.
+    The MAC keeps the frames pushed by a subscribed PHY in the same kind of queues (see PhyTransport).
+    :param capacity: frames kept per type, or {type: frames}. A type with capacity 0 is only counted
+    :param max_age: age limits {type: s}, frames of the other types are kept until they are read
+    :param headers: frame types
+    """
+
+    def __init__(self, capacity=64, max_age=None, headers=RX_QUEUE_TYPES):
+        if not isinstance(capacity, dict):
+            capacity = dict((header, capacity) for header in headers if header != "OTHER")
+        self.headers = headers
+        self.capacity = dict((header, capacity.get(header, 0)) for header in headers)
+        self.max_age = dict(max_age or {})
+        self._queues = dict((header, deque()) for header in headers)  # (arrival time, frame)
+        self.received = dict.fromkeys(headers, 0)
+        self.overflow = dict.fromkeys(headers, 0)  # frames evicted by a newer one
+        self.expired = dict.fromkeys(headers, 0)  # frames dropped for their age
+        self._cond = threading.Condition()
+        self._closed = False
+
+    def put(self, header, frame):
+        """
+        Queue a received frame
+        :param header: frame type (see RX_QUEUE_TYPES)
+        :param frame: received frame (MacFrame)
+        :return: True if the frame was queued
+        """
+        with self._cond:
+            self.received[header] += 1
+            capacity = self.capacity[header]
+            if capacity == 0:
+                return False
+            queue = self._queues[header]
+            if len(queue) >= capacity:
+                queue.popleft()
+                self.overflow[header] += 1
+            queue.append((time.monotonic(), frame))
+            self._cond.notify_all()
+            return True
+
+    def _purge(self, header, now):
+        limit = self.max_age.get(header)
+        if limit is None:
+            return
+        queue = self._queues[header]
+        while queue and now - queue[0][0] > limit:
+            queue.popleft()
+            self.expired[header] += 1
+
+    def get(self, header, timeout=0):
+        """
+        Take the oldest frame of a type that is not too old
+        :param header: frame type (see RX_QUEUE_TYPES)
+        :param timeout: maximum waiting time (s), 0 to return at once
+        :return: received frame (MacFrame), None if there is none
+        """
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            while True:
+                now = time.monotonic()
+                self._purge(header, now)
+                queue = self._queues[header]
+                if queue:
+                    return queue.popleft()[1]
+                if now >= deadline or self._closed:
+                    return None
+                self._cond.wait(deadline - now)
+
+    def wait(self, headers, timeout):
+        """
+        Block until a frame of one of the given types that is not too old is queued
+        :param headers: frame types
+        :param timeout: maximum waiting time (s)
+        :return: True if a frame is available, False if the timeout expired
+        """
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            while True:
+                now = time.monotonic()
+                for header in headers:
+                    self._purge(header, now)
+                    if self._queues[header]:
+                        return True
+                if now >= deadline or self._closed:
+                    return False
+                self._cond.wait(deadline - now)
+
+    def drain(self, headers):
+        """
+        Take every queued frame of the given types that is not too old
+        :param headers: frame types, in the order their frames are returned
+        :return: list of received frames (MacFrame)
+        """
+        frames = []
+        with self._cond:
+            now = time.monotonic()
+            for header in headers:
+                self._purge(header, now)
+                frames.extend(frame for _, frame in self._queues[header])
+                self._queues[header].clear()
+        return frames
+
+    def qsize(self, header):
+        with self._cond:
+            return len(self._queues[header])
+
+    def stats(self):
+        """
+        :return: {type: {"queued", "received", "overflow", "expired"}}
+        """
+        with self._cond:
+            return dict((header, {"queued": len(self._queues[header]), "received": self.received[header],
+                                  "overflow": self.overflow[header], "expired": self.expired[header]})
+                        for header in self.headers)
+
+    def close(self):
+        """
+        Wake up the blocked consumers, get() no longer waits
+        :return: none
+        """
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
 
 
 def generate_pkt(header, t_sym, encoding, payload):
@@ -156,6 +634,8 @@ def generate_pkt(header, t_sym, encoding, payload):
     :param payload: payload
     :return: assembled MPDU
     """
+    assert encoding in range(0, 8)
+
     if header == "DATA":
         info = _make_data(payload, encoding, t_sym, re_tx=False, frag=False)
     elif header == "DATA_FRAG":
@@ -185,6 +665,16 @@ def generate_pkt(header, t_sym, encoding, payload):
     return {"HEADER": header, "INFO": info}
 
 
+def fragment(payload, threshold):
+    """
+    Split an upper layer packet into fragments
+    :param payload: packet to fragment
+    :param threshold: maximum fragment length in bytes (dot11FragmentationThreshold)
+    :return: list of fragments
+    """
+    return [payload[i:i + threshold] for i in range(0, len(payload), threshold)]
+
+
 def retry(count, CWmin):
     """
     Update the CWslot based on the value of the Backoff retries counter
@@ -201,19 +691,18 @@ def assign_mac(node):
     """
     Assign the MAC address according to the node ID
     :param node: node id
-    :return: none
+    :return: MAC address (6 bytes)
     """
-    return chr(0x00) + chr(0x50) + chr(0xc2) + chr(0x85) + chr(0x33) + chr(node)
+    return MAC_PREFIX + bytes((node,))
 
 
 def format_mac(mac_str):
     """
-    Convert mac address string to HEX display
-    :param mac_str: string of mac address (6-char-long)
+    Convert mac address to HEX display
+    :param mac_str: mac address (6 bytes)
     :return: human-readable MAC address xx:xx:xx:xx:xx:xx
     """
-    # return ':'.join(c.encode('hex') for c in mac_str)
-    return ':'.join(format(ord(b), '02x') for b in mac_str)
+    return bytes(mac_str).hex(':')
 
 
 def cal_sym_duration(samp_rate):
@@ -226,6 +715,124 @@ def cal_sym_duration(samp_rate):
     return 80 / samp_rate
 
 
+class Airtime:
+    """
+    Airtime of the frames of one symbol duration, precomputed per encoding for every MPDU length.
+    The lookups are O(1); longer MPDUs fall back to the formula. Shared through airtime(t_sym)
+    by the frame builders, the DCF timing and the rate adaptation.
+    :param t_sym: OFDM symbol duration (s)
+    :param max_len: longest MPDU in the tables (bytes, FCS not included)
+    """
+
+    def __init__(self, t_sym, max_len=MAX_MPDU_LEN):
+        self.t_sym = t_sym
+        self.max_len = max_len
+        self.tables = [[self._tx_time(length, encoding) for length in range(max_len + 1)]
+                       for encoding in range(len(N_DBPS))]
+        self._arrays = None  # numpy copies of the tables, see tx_times
+
+    def _tx_time(self, length, encoding):
+        # 54 bits (16-bit for SERVICE, 32-bit for CRC and 6-bit for TAIL) need to be included
+        n_sym = -(-(54 + 8 * length) // N_DBPS[encoding])
+
+        # airtime of frame in microseconds
+        # the additional 2 at the end of this formula is not in the
+        # standard encoding rules but in the annex G reference frame it is there!
+        return int((5 + n_sym) * self.t_sym * 1e6) + 2
+
+    def tx_time(self, length, encoding):
+        """
+        :param length: MPDU length in bytes (FCS not included)
+        :param encoding: data rate (int [0, 8))
+        :return: frame transmission time (us)
+        """
+        if length > self.max_len:
+            return self._tx_time(length, encoding)
+        return self.tables[encoding][length]
+
+    def tx_times(self, lengths, encoding):
+        """
+        Vectorized tx_time
+        :param lengths: MPDU lengths in bytes (FCS not included)
+        :param encoding: data rate (int [0, 8))
+        :return: frame transmission times (us), a numpy array if numpy is available
+        """
+        if np is None:
+            return [self.tx_time(length, encoding) for length in lengths]
+        if self._arrays is None:
+            self._arrays = np.array(self.tables, dtype=np.int64)
+        lengths = np.asarray(lengths, dtype=np.int64)
+        if lengths.size and lengths.max() > self.max_len:
+            n_sym = -(-(54 + 8 * lengths) // N_DBPS[encoding])
+            return ((5 + n_sym) * self.t_sym * 1e6).astype(np.int64) + 2
+        return self._arrays[encoding][lengths]
+
+    def data_time(self, payload_len, encoding):
+        """
+        :param payload_len: length of the frame body in bytes
+        :param encoding: data rate (int [0, 8))
+        :return: transmission time of a DATA frame (us)
+        """
+        return self.tx_time(DATA_HEADER_LEN + payload_len, encoding)
+
+    def throughput(self, payload_len):
+        """
+        Effective data rate of each encoding, preamble and MAC header included
+        :param payload_len: length of the frame body in bytes
+        :return: list of data rates (Mbps)
+        """
+        return [8.0 * payload_len / self.data_time(payload_len, encoding) for encoding in range(len(N_DBPS))]
+
+
+_airtime_tables = {}
+
+
+def airtime(t_sym):
+    """
+    Shared airtime table of a symbol duration
+    :param t_sym: OFDM symbol duration (s)
+    :return: Airtime
+    """
+    table = _airtime_tables.get(t_sym)
+    if table is None:
+        table = _airtime_tables[t_sym] = Airtime(t_sym)
+    return table
+
+
+def dcf_timing(options, t_sym):
+    """
+    DCF timing parameters, scaled by the beta parameter
+    :param options: MAC options ('time_slot', 'SIFS', 'beta')
+    :param t_sym: OFDM symbol duration (s)
+    :return: tslot, SIFS, DIFS, ACK_time, air_delay_max, t_ack_timeout (s) and
+             T_cts, T_ack, T_data_max (TX time of a CTS, an ACK and the longest DATA frame, us)
+    """
+    beta = options['beta']  # scaling time parameter
+    tslot = options['time_slot'] * beta
+    SIFS = options['SIFS'] * beta
+    DIFS = SIFS + 2 * tslot
+    Preamble = DIFS  # 16e-6
+    PLCP_header = 4e-6 * beta
+    encoding_ctrl_frame = 0  # control frames use the lowest data rate
+
+    # TX time estimation for a CTS and an ACK packet
+    table = airtime(t_sym)
+    T_cts = table.tx_time(CTS_LEN, encoding_ctrl_frame) + 1  # as a CTS with a null duration, see _make_cts
+    T_ack = table.tx_time(ACK_LEN, encoding_ctrl_frame)
+    T_data_max = table.data_time(2034, 0)  # maximum transmission time
+
+    # ACK Timeout = 2 * Air Propagation Time (max) + SIFS + Time to transmit 14 byte ACK frame [14*8 / bitrate in Mbps]
+    air_delay_max = 200 / 299792458  # 20 meters / speed of light
+
+    # Consider increase processing_delay if the generated ack from RX can't be captured within the timeout window
+    processing_delay = 0.2  # data processing delay
+    t_ack_timeout = (T_data_max + T_ack) * 1e-6 + SIFS + 2 * air_delay_max + processing_delay
+
+    return {"tslot": tslot, "SIFS": SIFS, "DIFS": DIFS, "ACK_time": Preamble + PLCP_header,
+            "air_delay_max": air_delay_max, "t_ack_timeout": t_ack_timeout,
+            "T_cts": T_cts, "T_ack": T_ack, "T_data_max": T_data_max}
+
+
 def create_packet(header, data):
     """
     Define the packet format used for crosslayer communication
@@ -237,59 +844,720 @@ def create_packet(header, data):
 def sense_channel(port, thre=-35):
     """
     Check the channel occupancy status
-    :param port: socket port
+    :param port: socket port number or an open PhyTransport
     :param thre: voltage threshold. The channel is considered BUSY if the measured voltage is larger than the threshold
     :return: 1) channel status ("OCCUPIED" or "FREE")
              2) carrier sensing processing time
              3) measured voltage
     """
     time1 = time.time()
-    sensed = _send_for_response(create_packet("CCA", ""), port)
-    maximo = sensed["DATA"]
-    maximo_dBw = 10 * math.log10(maximo)  # Save the data in dBw
+    if isinstance(port, PhyTransport) and port.cca is not None:  # Energy detector state shared by the PHY
+        maximo = port.cca.level
+    else:
+        sensed = _send_for_response(create_packet("CCA", ""), port)
+        maximo = plcp.decode_float(sensed["DATA"])
+    maximo_dBw = 10 * math.log10(maximo) if maximo > 0 else -math.inf  # Save the data in dBw
     time2 = time.time()
     return "OCCUPIED" if maximo_dBw > thre else "FREE", time2 - time1, maximo_dBw
 
 
+async def sense_channel_async(port, thre=-35):
+    """
+    Awaitable sense_channel() for the asyncio engine (see mac_async): the CCA request to the PHY
+    is awaited instead of blocking the event loop
+    :param port: open PhyTransport
+    """
+    if port.cca is not None:  # Read locally, no round trip
+        return sense_channel(port, thre)
+    time1 = time.time()
+    sensed = await port.request_async(create_packet("CCA", ""))
+    maximo = plcp.decode_float(sensed["DATA"])
+    maximo_dBw = 10 * math.log10(maximo) if maximo > 0 else -math.inf
+    return "OCCUPIED" if maximo_dBw > thre else "FREE", time.time() - time1, maximo_dBw
+
+
+def has_cca_history(port):
+    """
+    :param port: socket port number or an open PhyTransport
+    :return: True if the power history of the PHY can be read locally (see sense_window)
+    """
+    return isinstance(port, PhyTransport) and port.cca is not None and port.cca.capacity > 0
+
+
+def sense_window(port, t0, t1, thre=-35):
+    """
+    Check the channel occupancy over a whole interval, from the power history of the PHY.
+    Falls back to a single sample (sense_channel) if the history has no sample of the interval.
+    :param port: socket port number or an open PhyTransport
+    :param t0: start of the interval (ns, time.monotonic_ns())
+    :param t1: end of the interval (ns)
+    :param thre: voltage threshold. The channel is considered BUSY if the voltage exceeded the threshold
+    :return: 1) channel status ("OCCUPIED" or "FREE")
+             2) fraction of the interval the PHY detected the channel busy
+             3) maximum measured voltage
+    """
+    sensed = port.cca.sense_window(t0, t1) if has_cca_history(port) else None
+    if sensed is None:
+        channel_status, _, maximo_dBw = sense_channel(port, thre)
+        return channel_status, float(channel_status == "OCCUPIED"), maximo_dBw
+    maximo, _, busy = sensed
+    maximo_dBw = 10 * math.log10(maximo) if maximo > 0 else -math.inf
+    return "OCCUPIED" if maximo_dBw > thre else "FREE", busy, maximo_dBw
+
+
 def update_nav(timetick, nav, timeslot):
     """
-    Method that keeps updated the Network Allocation Vector (NAV) of the station
+    Method that keeps updated the Network Allocation Vector (NAV) of the station.
+    Waits one slot, or until the end of the NAV if it ends within the slot
+    :param timetick: time the NAV was last updated (ns, time.monotonic_ns())
+    :param nav: remaining NAV at timetick (s)
+    :param timeslot: slot duration (s)
+    :return: remaining NAV (s), 0 once it has expired
     """
-    if nav == 0:
+    if nav <= 0:
         return 0
 
-    time.sleep(timeslot)
-    nav = nav - (time.time() - timetick)
-    if timeslot >= nav > 0:
-        time.sleep(nav)
-        nav = 0
-    return nav
+    slot_ns = int(timeslot * 1e9)
+    nav_end = timetick + int(nav * 1e9)
+    scheduler = SlotScheduler()
+    scheduler.wait_until(min(nav_end, time.monotonic_ns() + slot_ns))
+    remaining = nav_end - time.monotonic_ns()
+    if remaining > slot_ns:
+        return remaining * 1e-9
+    if remaining > 0:
+        scheduler.wait_until(nav_end)
+    return 0
+
+
+class SlotScheduler:
+    """
+    Slot timing of the MAC on the monotonic clock (time.monotonic_ns), immune to wall-clock jumps.
+    Deadlines are absolute, so a late slot doesn't shift the following ones. A wait sleeps
+    until spin seconds before its deadline and busy-waits the rest, which keeps the wake-up
+    error well below the sleep granularity of the OS.
+    Drift is how late a wait returns after its deadline. An overrun is a deadline that had
+    already passed when the wait started (e.g. a slow CCA round trip); overruns are counted
+    per state instead of stopping the MAC (see stats()).
+    With adaptive set, the scheduler doubles its beta scale (up to max_scale) while overruns
+    persist, and halves it back after a long run of waits on time. The MAC multiplies its slot
+    timing by scale.
+    :param spin: busy-wait margin before a deadline (s)
+    :param adaptive: adapt the beta scale to the overruns
+    :param max_scale: maximum beta scale
+    """
+
+    OVERRUN_WINDOW = 32  # Waits considered to raise the scale
+    RAISE_AFTER = 3  # Overruns within the window that raise the scale
+    LOWER_AFTER = 256  # Waits on time that lower the scale
+
+    def __init__(self, spin=200e-6, adaptive=False, max_scale=1.0):
+        self.spin_ns = int(spin * 1e9)
+        self.adaptive = adaptive
+        self.max_scale = max(max_scale, 1.0)
+        self.scale = 1.0
+        self._window = deque(maxlen=self.OVERRUN_WINDOW)  # True for each overrun among the last waits
+        self._window_overruns = 0
+        self._on_time = 0  # Waits on time since the last overrun
+        self.reset_stats()
+
+    @staticmethod
+    def now():
+        """
+        :return: current time of the monotonic clock (ns)
+        """
+        return time.monotonic_ns()
+
+    def reset_stats(self):
+        self.n_waits = 0
+        self.drift_total_ns = 0
+        self.drift_max_ns = 0
+        self.overruns = {}  # state -> number of overruns
+        self.overrun_total_ns = 0
+        self.overrun_max_ns = 0
+        self.n_scale_changes = 0
+
+    def wait_until(self, deadline, state=None):
+        """
+        Block until an absolute deadline
+        :param deadline: monotonic time (ns)
+        :param state: MAC state the overrun is accounted to, if the deadline has already passed
+        :return: drift (ns), None if the deadline was overrun
+        """
+        remaining = deadline - time.monotonic_ns()
+        if remaining <= 0:
+            self._overrun(state, -remaining)
+            return None
+        if remaining > self.spin_ns:
+            time.sleep((remaining - self.spin_ns) * 1e-9)
+        now = time.monotonic_ns()
+        while now < deadline:
+            now = time.monotonic_ns()
+        return self._record(now - deadline)
+
+    def wait_frame_until(self, port, headers, deadline, state=None):
+        """
+        Like wait_until, but a subscribed PhyTransport ends the wait as soon as a frame of one of
+        the given types is pushed (see wait_phy_frame)
+        :param port: socket port connecting MAC and PHY, or an open PhyTransport
+        :param headers: frame types to wait for
+        :param deadline: monotonic time (ns)
+        :param state: MAC state the overrun is accounted to, if the deadline has already passed
+        :return: True if a frame is available
+        """
+        if not (isinstance(port, PhyTransport) and port.subscribed):
+            self.wait_until(deadline, state)
+            return False
+
+        remaining = deadline - time.monotonic_ns()
+        if remaining <= 0:
+            self._overrun(state, -remaining)
+            return port.wait_frame(headers, 0)
+        if port.wait_frame(headers, max(remaining - self.spin_ns, 0) * 1e-9):
+            return True
+        self.wait_until(deadline, state)
+        return port.wait_frame(headers, 0)
+
+    @staticmethod
+    def realign(deadline, period):
+        """
+        Next boundary of a slot grid after an overrun
+        :param deadline: overrun slot boundary (ns)
+        :param period: slot duration (ns)
+        :return: first boundary of the grid still ahead (ns), number of slots skipped to reach it
+        """
+        skipped = (time.monotonic_ns() - deadline) // period + 1
+        return deadline + skipped * period, skipped
+
+    def _record(self, drift):
+        self.n_waits += 1
+        self.drift_total_ns += drift
+        if drift > self.drift_max_ns:
+            self.drift_max_ns = drift
+        self._adapt(False)
+        return drift
+
+    def _overrun(self, state, late):
+        self.overruns[state] = self.overruns.get(state, 0) + 1
+        self.overrun_total_ns += late
+        if late > self.overrun_max_ns:
+            self.overrun_max_ns = late
+        self._adapt(True)
+
+    def _adapt(self, overrun):
+        if not self.adaptive:
+            return
+        if len(self._window) == self._window.maxlen:
+            self._window_overruns -= self._window[0]
+        self._window.append(overrun)
+        self._window_overruns += overrun
+
+        if overrun:
+            self._on_time = 0
+            if self._window_overruns >= self.RAISE_AFTER and self.scale < self.max_scale:
+                self.scale = min(self.scale * 2, self.max_scale)
+                self.n_scale_changes += 1
+                self._window.clear()
+                self._window_overruns = 0
+        else:
+            self._on_time += 1
+            if self._on_time >= self.LOWER_AFTER and self.scale > 1.0:
+                self.scale = max(self.scale / 2, 1.0)
+                self.n_scale_changes += 1
+                self._on_time = 0
+
+    def stats(self):
+        """
+        Timing statistics
+        :return: number of waits on time, mean and maximum drift (us), overruns per state,
+                 mean and maximum overrun (us), current beta scale and number of scale changes
+        """
+        n_overruns = sum(self.overruns.values())
+        return {"waits": self.n_waits,
+                "drift_mean_us": self.drift_total_ns / self.n_waits / 1e3 if self.n_waits else 0.0,
+                "drift_max_us": self.drift_max_ns / 1e3,
+                "overruns": dict((getattr(state, "name", state), count) for state, count in self.overruns.items()),
+                "overrun_mean_us": self.overrun_total_ns / n_overruns / 1e3 if n_overruns else 0.0,
+                "overrun_max_us": self.overrun_max_ns / 1e3,
+                "beta_scale": self.scale,
+                "beta_scale_changes": self.n_scale_changes}
 
 
 def read_phy_response(port, header):
     """
-    Check if packet with a specified type is available from PHY
-    :param port: socket port connecting MAC and PHY
+    Check if packet with a specified type is available from PHY.
+    Frames pushed on a subscribed PhyTransport are read locally, without a round trip.
+    :param port: socket port connecting MAC and PHY, or an open PhyTransport
     :param header: packet type
     :return:
     """
-    reading = _send_for_response(create_packet("TAIL", header.upper()), port)
-    return "YES" if reading["HEADER"] == "YES" else "NO", reading["DATA"]
+    header = header.upper()
+    if isinstance(port, PhyTransport) and port.subscribed and header in PHY_FRAME_TYPES:
+        frame = port.pop_frame(header)
+        return ("YES", frame) if frame is not None else ("NO", [])
+
+    return _phy_response(header, _send_for_response(create_packet("TAIL", header), port))
+
+
+async def read_phy_response_async(port, header):
+    """
+    Awaitable read_phy_response() for the asyncio engine (see mac_async). Frames pushed on a
+    subscribed transport are read locally; TAIL requests are awaited instead of blocking the event loop
+    :param port: open PhyTransport
+    :param header: packet type
+    """
+    header = header.upper()
+    if port.subscribed and header in PHY_FRAME_TYPES:
+        return read_phy_response(port, header)
+    return _phy_response(header, await port.request_async(create_packet("TAIL", header)))
+
+
+def _phy_response(header, reading):
+    """
+    Decode the answer of the PHY to a TAIL request
+    """
+    if reading["HEADER"] != "YES":
+        return "NO", []
+
+    if header == "NODE":
+        return "YES", plcp.decode_int(reading["DATA"])
+    if header == "SAMP_RATE":
+        return "YES", plcp.decode_float(reading["DATA"])
+    # Received frames are forwarded as raw MPDUs
+    return "YES", parse_mac(reading["DATA"])["DATA"]
+
+
+def wait_phy_frame(port, headers, timeout):
+    """
+    Wait until the PHY reports a frame of one of the given types or the timeout expires.
+    Only a subscribed PhyTransport can wake up early, otherwise this is a plain sleep.
+    :param port: socket port connecting MAC and PHY, or an open PhyTransport
+    :param headers: frame types to wait for
+    :param timeout: maximum waiting time (s)
+    :return: True if a frame is available
+    """
+    if isinstance(port, PhyTransport) and port.subscribed:
+        return port.wait_frame(headers, timeout)
+
+    time.sleep(timeout)
+    return False
 
 
 def send_wo_response(pkt, port):
     """
     Send data to socket
     :param pkt: data to be sent
-    :param port: socket port number
+    :param port: socket port number or an open PhyTransport
     :return: none
     """
+    if isinstance(port, PhyTransport):
+        port.send(pkt)
+        return
+
     s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
     s.connect((socket.gethostname(), port))
     _send_to_port(pkt, s)
     s.close()
 
 
+class PhyTransport:
+    """
+    MAC <-> PHY control channel.
+    Every request of the MAC goes through the transport that MacWifi owns. Once
+    subscribed, the PHY pushes each received frame, and the transport keeps them
+    in local queues per frame type (see wait_frame and pop_frame), bounded and
+    age-limited like the queues of the PHY (see set_queue_limits).
+    Implementations: TcpTransport (PHY in another process) and InProcessTransport
+    (PHY in the same interpreter). Use connect_phy() to select one from the config.
+    """
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._closed = False
+        self.set_queue_limits(64)
+        self._listeners = []
+        self._router = None  # function taking (frame type, frame) that replaces the local queues, see set_router
+        self.subscribed = False
+        self.cca = None  # CCA state of the PHY (uwicore_mpif.CcaState) if it can be read locally, see sense_channel
+
+    def send(self, pkt):
+        """
+        Send a message that expects no answer
+        :param pkt: cross-layer packet (see create_packet)
+        :return: none
+        """
+        raise NotImplementedError
+
+    def request(self, pkt):
+        """
+        Send a message and wait for its answer
+        :param pkt: cross-layer packet (see create_packet)
+        :return: response from PHY, with the DATA field as payload bytes
+        """
+        raise NotImplementedError
+
+    async def request_async(self, pkt):
+        """
+        Awaitable request(), for the asyncio engine (see mac_async).
+        By default request() runs in the executor of the event loop, so the loop goes on
+        while the answer is on its way (one executor thread per request in flight)
+        :param pkt: cross-layer packet (see create_packet)
+        :return: response from PHY, with the DATA field as payload bytes
+        """
+        return await asyncio.get_running_loop().run_in_executor(None, self.request, pkt)
+
+    def subscribe(self):
+        """
+        Ask the PHY to push received frames instead of waiting for TAIL requests
+        :return: True if the PHY accepted the subscription
+        """
+        if not self.subscribed:
+            self.subscribed = self.request(create_packet("SUBSCRIBE", ""))["HEADER"] == "YES"
+        return self.subscribed
+
+    def register_address(self, mac_addr):
+        """
+        Ask the PHY to also accept the DATA and ACK frames addressed to another MAC address
+        (logical stations sharing the PHY, see mac_host)
+        :param mac_addr: MAC address (6 bytes)
+        :return: True if the PHY accepted the address
+        """
+        return self.request(create_packet("ADDR", mac_addr))["HEADER"] == "YES"
+
+    def set_router(self, router):
+        """
+        Hand every pushed frame to a router instead of the local queues, e.g. to demultiplex
+        the frames of several logical stations (see mac_host)
+        :param router: function taking the frame type and the frame (see parse_mac), None to restore the queues
+        :return: none
+        """
+        self._router = router
+
+    def set_queue_limits(self, capacity, max_age=None):
+        """
+        Bound the queues of the pushed frames (see RxQueues). Call it before subscribe()
+        :param capacity: frames kept per type, the oldest is dropped when a new one arrives
+        :param max_age: age limits {type: s}, older frames are dropped instead of being read
+        :return: none
+        """
+        self.queue_limits = (capacity, max_age)
+        self._frames = RxQueues(capacity, max_age, PHY_FRAME_TYPES)
+
+    def queue_stats(self):
+        """
+        :return: counters of the pushed frame queues, see RxQueues.stats
+        """
+        return self._frames.stats()
+
+    def wait_frame(self, headers, timeout):
+        """
+        Block until a pushed frame of one of the given types is available
+        :param headers: frame types ("DATA", "ACK", "RTS", "CTS", "BEACON")
+        :param timeout: maximum waiting time (s)
+        :return: True if a frame is available, False if the timeout expired
+        """
+        return self._frames.wait(headers, timeout)
+
+    def pop_frame(self, header):
+        """
+        Take the oldest pushed frame of the given type
+        :return: frame information (see parse_mac), None if there is none
+        """
+        return self._frames.get(header)
+
+    def add_listener(self, callback):
+        """
+        Get notified of every pushed frame, e.g. to wake up an event loop (see mac_async)
+        :param callback: function taking the frame type, called from the thread that receives the frame
+        :return: none
+        """
+        self._listeners.append(callback)
+
+    def remove_listener(self, callback):
+        self._listeners.remove(callback)
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        self._frames.close()
+
+    def _push_frame(self, packet):
+        """
+        Store a frame pushed by the PHY
+        :param packet: raw MPDU
+        :return: none
+        """
+        frame = parse_mac(packet)
+        header = "DATA" if frame["HEADER"] == "DATA_FRAG" else frame["HEADER"]
+        if header in PHY_FRAME_TYPES:
+            if self._router is not None:
+                self._router(header, frame["DATA"])
+            else:
+                self._queue_frame(header, frame["DATA"])
+
+    def _queue_frame(self, header, frame):
+        """
+        Queue a received frame and wake up whoever waits for it
+        :param header: frame type
+        :param frame: frame information (see parse_mac)
+        :return: none
+        """
+        self._frames.put(header, frame)
+        for callback in self._listeners:
+            callback(header)
+
+
+class StreamTransport(PhyTransport):
+    """
+    Persistent MAC <-> PHY session over a stream socket.
+    The socket to proc_mac_request is opened once and reused for every request.
+    Each message carries a request ID ("ID") that the PHY echoes in its answer,
+    so several threads can share the session and still get their own response
+    back. Pushed frames use request ID 0 and are received by a reader thread.
+    :param sock: socket connected to the PHY
+    :param name: name of the session (for the reader thread)
+    """
+
+    def __init__(self, sock, name):
+        PhyTransport.__init__(self)
+        self.sock = sock
+        self.name = name
+        self._reader = plcp.MessageReader(self.sock)
+
+        self._send_lock = threading.Lock()
+        self._next_id = 0
+        self._replies = {}  # responses read on behalf of other requests, by request ID
+        self._waiters = {}  # futures of the awaited requests (see request_async), by request ID
+
+    def send(self, pkt):
+        with self._send_lock:
+            self._next_id = self._next_id % 0xffffffff + 1  # ID 0 is reserved for pushed frames
+            req_id = self._next_id
+            self.sock.sendall(plcp.encode_message(pkt, req_id))
+        return req_id
+
+    def request(self, pkt):
+        req_id = self.send(pkt)
+        with self._cond:
+            while req_id not in self._replies:
+                if self._closed:
+                    raise ConnectionError("PHY closed the MAC session")
+                if self.subscribed:  # the reader thread receives the answer
+                    self._cond.wait()
+                else:
+                    self._dispatch(self._reader.read())
+            return self._replies.pop(req_id)
+
+    async def request_async(self, pkt):
+        """
+        Once subscribed, the reader thread resolves a future of the event loop with the answer,
+        no executor thread is involved
+        """
+        if not self.subscribed:
+            return await PhyTransport.request_async(self, pkt)
+        future = asyncio.get_running_loop().create_future()
+        with self._cond:  # The reader thread can't see the answer before the future is registered
+            if self._closed:
+                raise ConnectionError("PHY closed the MAC session")
+            self._waiters[self.send(pkt)] = future
+        return await future
+
+    def subscribe(self):
+        if self.subscribed:
+            return True
+        if not PhyTransport.subscribe(self):
+            return False
+
+        reader = threading.Thread(target=self._read_loop, name="phy-session-%s" % self.name)
+        reader.daemon = True
+        reader.start()
+        return True
+
+    def close(self):
+        PhyTransport.close(self)
+        self.sock.close()
+        with self._cond:
+            self._fail_waiters()
+
+    def _read_loop(self):
+        try:
+            while True:
+                msg = self._reader.read()
+                with self._cond:
+                    self._dispatch(msg)
+        except (ConnectionError, OSError):
+            with self._cond:
+                self._fail_waiters()
+
+    def _fail_waiters(self):
+        """
+        The session is gone: raise ConnectionError in every awaited request. Must be called with self._cond held
+        """
+        for future in self._waiters.values():
+            future.get_loop().call_soon_threadsafe(_resolve_future, future, None)
+        self._waiters.clear()
+
+    def _dispatch(self, msg):
+        """
+        Store a message received from the PHY. Must be called with self._cond held
+        """
+        if msg is None:  # PHY closed the session
+            self._closed = True
+            self._cond.notify_all()
+            raise ConnectionError("PHY closed the MAC session")
+
+        if msg["HEADER"] == "FRAME":
+            self._push_frame(msg["DATA"])
+        elif msg["ID"] in self._waiters:  # Awaited by an event loop
+            future = self._waiters.pop(msg["ID"])
+            future.get_loop().call_soon_threadsafe(_resolve_future, future, msg)
+        else:
+            self._replies[msg["ID"]] = msg
+            self._cond.notify_all()
+
+
+def _resolve_future(future, msg):
+    """
+    Hand the answer of the PHY to an awaited request, in the thread of its event loop
+    :param msg: answer, None if the session was closed
+    """
+    if future.done():  # Cancelled
+        return
+    if msg is None:
+        future.set_exception(ConnectionError("PHY closed the MAC session"))
+    else:
+        future.set_result(msg)
+
+
+class TcpTransport(StreamTransport):
+    """
+    MAC <-> PHY session over TCP
+    :param port: socket port of the PHY (PHYport)
+    :param host: PHY host name (default: local host name)
+    """
+
+    def __init__(self, port, host=None):
+        sock = socket.create_connection((host or socket.gethostname(), port))
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        StreamTransport.__init__(self, sock, str(port))
+        self.port = port
+
+
+class UnixTransport(StreamTransport):
+    """
+    MAC <-> PHY session over a Unix domain socket, for MAC and PHY in separate processes of one host.
+    MPDUs of at least shm_threshold bytes are copied to a shared-memory ring and
+    only their descriptor is sent on the socket (PKT_SHM message).
+    :param path: Unix socket path of the PHY (unix_path)
+    :param shm_path: file backing the shared-memory ring
+    :param shm_size: ring capacity in bytes (0: send every MPDU on the socket)
+    :param shm_threshold: minimum MPDU length sent through the ring
+    """
+
+    def __init__(self, path, shm_path=None, shm_size=0, shm_threshold=256):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.connect(path)
+        StreamTransport.__init__(self, sock, path)
+        self.path = path
+        self.shm_threshold = shm_threshold
+
+        self.ring = None
+        if shm_size > 0:
+            self.ring = plcp.ShmRing(shm_path, shm_size)
+            if self.request(create_packet("SHM", shm_path))["HEADER"] != "YES":  # PHY can't map the ring
+                self.ring.close()
+                self.ring = None
+
+    def send(self, pkt):
+        if self.ring is not None and pkt["HEADER"] == "PKT":
+            info = pkt["DATA"]["INFO"]
+            packet = plcp.to_bytes(info["packet"])
+            descriptor = self.ring.put(packet) if len(packet) >= self.shm_threshold else None
+            if descriptor is not None:
+                pkt = create_packet("PKT_SHM", {"HEADER": pkt["DATA"]["HEADER"], "INFO": {
+                    "shm": descriptor, "encoding": info["encoding"], "timestamp": info["timestamp"]}})
+        return StreamTransport.send(self, pkt)
+
+    def close(self):
+        StreamTransport.close(self)
+        if self.ring is not None:
+            self.ring.close()
+
+
+# proc_mac_request.handle and CCA state of the PHYs running in this interpreter, by PHYport
+_inproc_phys = {}
+_inproc_cca = {}
+
+
+def register_inproc_phy(port, handler, cca=None):
+    """
+    Make a PHY reachable through InProcessTransport
+    :param port: PHYport of the PHY
+    :param handler: function (request, push) -> response (see phy_wifi.proc_mac_request.handle)
+    :param cca: CCA state of the PHY (uwicore_mpif.CcaState), read by the MAC instead of CCA requests
+    :return: none
+    """
+    _inproc_phys[port] = handler
+    if cca is not None:
+        _inproc_cca[port] = cca
+
+
+def unregister_inproc_phy(port):
+    _inproc_phys.pop(port, None)
+    _inproc_cca.pop(port, None)
+
+
+class InProcessTransport(PhyTransport):
+    """
+    MAC <-> PHY channel for a PHY running in the same interpreter.
+    Requests are plain calls of the PHY request handler, and pushed frames are
+    appended to the local queues by the rx_client thread of the PHY.
+    :param port: PHYport the PHY was registered with (see register_inproc_phy)
+    """
+
+    def __init__(self, port):
+        PhyTransport.__init__(self)
+        self.port = port
+        if port not in _inproc_phys:
+            raise ConnectionError("No PHY registered in this process on port %d" % port)
+        self._handler = _inproc_phys[port]
+        self.cca = _inproc_cca.get(port)
+
+    def send(self, pkt):
+        self._handler(pkt, self._push_frame)
+
+    def request(self, pkt):
+        reply = self._handler(pkt, self._push_frame)
+        return {"HEADER": reply["HEADER"], "DATA": plcp.to_bytes(reply["DATA"])}
+
+    async def request_async(self, pkt):
+        return self.request(pkt)  # A plain call, nothing to wait for
+
+
+def connect_phy(options):
+    """
+    Open the MAC <-> PHY channel selected in the MAC configuration
+    :param options: MAC options ('transport': "tcp" (default), "unix" or "inproc", 'PHYport',
+                    'unix_path', 'shm_path', 'shm_size', 'cca_path', 'rx_queue_len', 'rx_max_age')
+    :return: PhyTransport
+    """
+    transport = options.get('transport', "tcp").lower()
+    if transport == "tcp":
+        phy = TcpTransport(options['PHYport'])
+    elif transport == "unix":
+        phy = UnixTransport(options['unix_path'], options.get('shm_path'), int(options.get('shm_size', 0)))
+    elif transport == "inproc":
+        phy = InProcessTransport(options['PHYport'])
+    else:
+        raise ValueError("Invalid MAC <-> PHY transport %s" % transport)
+    phy.set_queue_limits(options.get('rx_queue_len', 64), options.get('rx_max_age'))
+
+    cca_path = options.get('cca_path')
+    if transport != "inproc" and cca_path and os.path.exists(cca_path):  # PHY on this host: CCA state in shared memory
+        phy.cca = plcp.CcaState(cca_path)
+    return phy
+
+
 """ MAC <-> Upper layer (Buffer) interactions """
 
 
@@ -313,15 +1581,27 @@ def send_ul_buff_packet(port, packet):
 def read_ul_buffer(port):
     """
     Check the upper layer buffer for packets to send
+    :return: status ("YES", "BEACON", "NO"), payload, and destination MAC address of the payload
+             (None if the buffer leaves it to the MAC)
+    """
+    return ul_buffer_status(_send_for_response(create_packet("no_packet", ""), port))
+
+
+def ul_buffer_status(reading):
+    """
+    Decode the answer of the upper layer buffer to a "no_packet" request (see read_ul_buffer)
     """
-    reading = _send_for_response(create_packet("no_packet", ""), port)
+    if reading["HEADER"] == "PAYLOAD_TO":  # is a Data Packet for a given peer?
+        data = reading["DATA"]
+        return "YES", data[plcp.PEER_ADDR_LEN:], bytes(data[:plcp.PEER_ADDR_LEN])
+
     if reading["HEADER"] == "YES":  # is a Data Packet?
-        return "YES", reading["DATA"]
+        return "YES", reading["DATA"], None
 
     if reading["HEADER"] == "BEACON":  # is a BEACON Packet?
-        return "BEACON", []
+        return "BEACON", [], None
 
-    return "NO", reading["DATA"]
+    return "NO", reading["DATA"], None
 
 
 def _make_beacon(payload, encoding, t_sym):
@@ -331,27 +1611,18 @@ def _make_beacon(payload, encoding, t_sym):
     void frame body, i.e., SSID is not included
     https://mrncciew.com/2014/10/08/802-11-mgmt-beacon-frame/
     """
-    mac_frame_ctrl = chr(0b10000000) + chr(0x00)
-    mac_duration = chr(0x00) * 2
-    mac_da = chr(0xff) * 6
-    mac_sa = payload["address2"]
-    mac_bssid = chr(0xff) * 6
-    ts_str, ts_long = _cal_timestamp()
-    bi = _cal_beacon_interval(payload["BI"])
-    capability_info = chr(0x00) * 2
-    mac_seqctrl = _cal_seq_control(payload["N_SEQ"], payload["N_FRAG"])
-
-    # pre-assemble the MPDU (duration is filled with dummy and CRC32 is missing at this point)
-    packet = mac_frame_ctrl + mac_duration + mac_da + mac_sa + mac_bssid + mac_seqctrl + ts_str + bi + capability_info
-
-    tx_time, mac_duration = _cal_tx_time(len(packet), encoding, t_sym)
+    ts_long = _cal_timestamp()
+    tx_time = airtime(t_sym).tx_time(_BEACON.size, encoding)
 
-    # assemble the MPDU (now duration is correct)
-    packet = mac_frame_ctrl + mac_duration + mac_da + mac_sa + mac_bssid + mac_seqctrl + ts_str + bi + capability_info
+    # assemble the MPDU (CRC32 is missing at this point)
+    packet = bytearray(_BEACON.size)
+    _BEACON.pack_into(packet, 0, 0x80, 0x00, tx_time & 0xffff, BROADCAST_MAC, payload["address2"], BROADCAST_MAC,
+                      _cal_seq_control(payload["N_SEQ"], payload["N_FRAG"]), ts_long,
+                      _cal_beacon_interval(payload["BI"]), 0x0000)
 
-    dic = {"packet": packet, "tx_time": tx_time, "mac_duration": mac_duration,
-           "mac_add1": mac_da, "mac_add2": mac_sa, "N_SEQ": payload["N_SEQ"], "N_FRAG": payload["N_FRAG"],
-           "MF": 0, "timestamp": ts_long, "BI": payload["BI"]}
+    dic = {"packet": bytes(packet), "tx_time": tx_time, "mac_duration": tx_time & 0xffff,
+           "mac_add1": BROADCAST_MAC, "mac_add2": payload["address2"], "N_SEQ": payload["N_SEQ"],
+           "N_FRAG": payload["N_FRAG"], "MF": 0, "timestamp": ts_long, "BI": payload["BI"]}
 
     return dic
 
@@ -360,27 +1631,13 @@ def _make_cts(payload, encoding, t_sym):
     """
     Generate an 802.11 compliant CTS frame
     """
-    mac_frame_ctrl = chr(0xc4) + chr(0x00)
-    mac_duration = chr(0x00) * 2
-    mac_ra = payload["mac_ra"]
-
-    # pre-assemble the MPDU (duration is filled with dummy and CRC32 is missing at this point)
-    packet = mac_frame_ctrl + mac_duration + mac_ra
-
-    tx_time, _ = _cal_tx_time(len(packet), encoding, t_sym)
-
-    # airtime of frame in microseconds
-    # the additional 2 at the end of this formula is not in the 
-    # standard encoding rules but in the annex G reference frame it is there!
-    tx_time = tx_time + payload["duration"]
+    # airtime of frame in microseconds, plus the medium reservation of the RTS
+    tx_time = airtime(t_sym).tx_time(CTS_LEN, encoding) + payload["duration"]
     tx_time = int(tx_time) + 1
-    mac_duration = chr((tx_time >> 8) & 0xff) + chr(tx_time & 0xff)
+    mac_duration = tx_time & 0xffff
 
-    # assemble the MPDU (now duration is correct)
-    packet = mac_frame_ctrl + mac_duration + mac_ra
-
-    dic = {"packet": packet, "tx_time": tx_time, "mac_duration": mac_duration,
-           "RX_add": mac_ra, "timestamp": payload["timestamp"]}
+    dic = {"packet": _cts_frame(payload["mac_ra"], mac_duration), "tx_time": tx_time, "mac_duration": mac_duration,
+           "RX_add": payload["mac_ra"], "timestamp": payload["timestamp"]}
 
     return dic
 
@@ -389,28 +1646,14 @@ def _make_rts(payload, encoding, t_sym):
     """
     Generate an 802.11 compliant RTS frame
     """
-    mac_frame_ctrl = chr(0xb4) + chr(0x00)
-    mac_duration = chr(0x00) * 2
-    mac_ra = payload["mac_ra"]
-    mac_ta = payload["mac_ta"]
-
-    # pre-assemble the MPDU (duration is filled with dummy and CRC32 is missing at this point)
-    packet = mac_frame_ctrl + mac_duration + mac_ra + mac_ta
-
-    tx_time, _ = _cal_tx_time(len(packet), encoding, t_sym)
-
-    # airtime of frame in microseconds
-    # the additional 2 at the end of this formula is not in the
-    # standard encoding rules but in the annex G reference frame it is there!
-    tx_time = tx_time + payload["duration"]
+    # airtime of frame in microseconds, plus the medium reservation
+    tx_time = airtime(t_sym).tx_time(RTS_LEN, encoding) + payload["duration"]
     tx_time = int(tx_time) + 1
-    mac_duration = chr((tx_time >> 8) & 0xff) + chr(tx_time & 0xff)
-
-    # assemble the MPDU (now duration is correct)
-    packet = mac_frame_ctrl + mac_duration + mac_ra + mac_ta
+    mac_duration = tx_time & 0xffff
 
-    dic = {"packet": packet, "tx_time": tx_time, "mac_duration": mac_duration,
-           "RX_add": mac_ra, "TX_add": mac_ta, "timestamp": payload["timestamp"]}
+    dic = {"packet": _rts_frame(payload["mac_ra"], payload["mac_ta"], mac_duration), "tx_time": tx_time,
+           "mac_duration": mac_duration, "RX_add": payload["mac_ra"], "TX_add": payload["mac_ta"],
+           "timestamp": payload["timestamp"]}
 
     return dic
 
@@ -419,21 +1662,10 @@ def _make_ack(payload, encoding, t_sym):
     """
     Generate an 802.11 compliant ACK frame
     """
-    mac_frame_ctrl = chr(0xd4) + chr(0x00)
-    mac_duration = chr(0x00) * 2
-    mac_ra = payload["mac_ra"]
-    mac_seqctrl = chr(0x00) * 2
-
-    # pre-assemble the MPDU (duration is filled with dummy and CRC32 is missing at this point)
-    packet = mac_frame_ctrl + mac_duration + mac_ra
+    tx_time = airtime(t_sym).tx_time(ACK_LEN, encoding)
 
-    tx_time, _ = _cal_tx_time(len(packet), encoding, t_sym)
-
-    # assemble the MPDU
-    packet = mac_frame_ctrl + mac_duration + mac_ra
-
-    dic = {"packet": packet, "tx_time": tx_time, "mac_duration": mac_duration,
-           "RX_add": mac_ra, "timestamp": time.time()}
+    dic = {"packet": _ack_frame(payload["mac_ra"]), "tx_time": tx_time, "mac_duration": 0,
+           "RX_add": payload["mac_ra"], "timestamp": time.time()}
 
     return dic
 
@@ -441,33 +1673,67 @@ def _make_ack(payload, encoding, t_sym):
 def _make_data(payload, encoding, t_sym, re_tx=False, frag=False):
     """
     Generate an 802.11 compliant DATA frame
-    :param payload:
-    :param encoding:
-    :param t_sym:
+    :param payload: frame body (bytes), addresses, sequence and fragment numbers
+    :param encoding: data rate (int [0, 8))
+    :param t_sym: symbol duration in seconds
     :param re_tx: retransmission flag
     :param frag: fragmentation flag
-    :return:
+    :return: frame information
+    """
+    body = payload["payload"]
+    if isinstance(body, str):
+        raise TypeError("DATA frame body must be bytes, not str")
+    packet_len = DATA_HEADER_LEN + len(body)  # CRC32 is missing at this point
+    tx_time = airtime(t_sym).tx_time(packet_len, encoding)
+
+    # assemble the MPDU: cached header of the peer, with the duration and the sequence control filled in
+    frame_control, addresses = _data_header((0x08 if re_tx else 0x00) | (0x04 if frag else 0x00),
+                                            payload["address1"], payload["address2"])
+    packet = _DATA_TEMPLATE.pack(frame_control, tx_time & 0xffff, addresses,
+                                 _cal_seq_control(payload["N_SEQ"], payload["N_FRAG"])) + body
+
+    dic = {"packet": packet, "tx_time": tx_time, "mac_duration": tx_time & 0xffff,
+           "mac_add1": payload["address1"], "mac_add2": payload["address2"], "N_SEQ": payload["N_SEQ"],
+           "N_FRAG": payload["N_FRAG"], "MF": 1 if frag else 0, "PAYLOAD": body, "timestamp": payload["timestamp"]}
+
+    return dic
+
+
+# Control frames only depend on the peer and the duration, so they are built once
+# and served from small LRU caches. So is the DATA header of a peer, without its
+# duration and sequence control (see _make_data)
+@functools.lru_cache(maxsize=64)
+def _data_header(flags, mac_add1, mac_add2):
+    """
+    Fixed fields of a DATA header (see _DATA_TEMPLATE)
+    :return: frame control, addresses
     """
-    mac_frame_ctrl = chr(0x08) + chr((0x08 if re_tx else 0x00) | 0x04 if frag else 0x00)
+    header = _DATA_HEADER.pack(0x08, flags, 0, mac_add1, mac_add2, BROADCAST_MAC, 0)
+    return header[:2], header[4:DATA_HEADER_LEN - 2]
 
-    mac_da = payload["address1"]
-    mac_sa = payload["address2"]
-    mac_bssid = chr(0xff) * 6  # some BSSID mac-address
-    mac_seqctrl = _cal_seq_control(payload["N_SEQ"], payload["N_FRAG"])
 
-    packet_len = 24 + len(payload["payload"])  # CRC32 is missing at this point
+@functools.lru_cache(maxsize=64)
+def _ack_frame(mac_ra):
+    """
+    Ready-made ACK frame
+    """
+    return _CTRL_HEADER.pack(0xd4, 0x00, 0, mac_ra)
 
-    tx_time, mac_duration = _cal_tx_time(packet_len, encoding, t_sym)
 
-    # assemble the MPDU (now duration is correct)
-    packet = mac_frame_ctrl + mac_duration + mac_da + mac_sa + mac_bssid + mac_seqctrl + payload[
-        "payload"]
+@functools.lru_cache(maxsize=64)
+def _cts_frame(mac_ra, duration):
+    """
+    Ready-made CTS frame
+    """
+    return _CTRL_HEADER.pack(0xc4, 0x00, duration, mac_ra)
 
-    dic = {"packet": packet, "tx_time": tx_time, "mac_duration": mac_duration,
-           "mac_add1": mac_da, "mac_add2": mac_sa, "N_SEQ": payload["N_SEQ"], "N_FRAG": payload["N_FRAG"],
-           "MF": 1 if frag else 0, "PAYLOAD": payload["payload"], "timestamp": payload["timestamp"]}
 
-    return dic
+@functools.lru_cache(maxsize=64)
+def _rts_frame(mac_ra, mac_ta, duration):
+    """
+    Ready-made RTS frame
+    """
+    return _RTS_HEADER.pack(0xb4, 0x00, duration, mac_ra, mac_ta)
 
 
 def _send_to_port(data, s):
@@ -477,29 +1743,28 @@ def _send_to_port(data, s):
     :param s: socket object
     :return: none
     """
-    pkt = pickle.dumps(data, 1)
-    s.send(pkt)
+    s.sendall(plcp.encode_message(data))
 
 
-def _recv_from_port(s, bufsize=1024):  # TODO: consider to increase the time if the packet is large
+def _recv_from_port(s):
     """
     Receive data from socket
     :param s: socket object
-    :param bufsize: the maximum amount of data to be received at once
-    :return: data received
+    :return: data received (None if the peer closed the connection)
     """
-    pkt = s.recv(bufsize)
-    info = pickle.loads(pkt)
-    return info
+    return plcp.receive_from_mac(s)
 
 
 def _send_for_response(pkt, port):
     """
     Send request to the socket and expect an answer from it
     :param pkt: data to sent
-    :param port: socket port number
+    :param port: socket port number or an open PhyTransport
     :return: response from socket
     """
+    if isinstance(port, PhyTransport):
+        return port.request(pkt)
+
     s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
     s.connect((socket.gethostname(), port))
     _send_to_port(pkt, s)
@@ -517,54 +1782,24 @@ def next_seq_num(num):
 
 def _cal_seq_control(seq, frag):
     """
-    Calculates the Sequence Number value in packed binary string format
+    Calculates the Sequence Control field (16-bit, little endian)
     """
-    return chr(((seq & 0xf) << 4) + (frag & 0xf)) + chr(seq >> 4 & 0xff)
+    return ((seq & 0xfff) << 4) | (frag & 0xf)
 
 
 def _cal_beacon_interval(time_tick):
     """
-    Calculates the Beacon Interval value in packed binary string format
+    Calculates the Beacon Interval field in time units of 1024 us
     """
     if time_tick > 67108:
         print("ERROR, Beacon interval > BI MAX (67108)")
-        BI = chr(0xff) + chr(0xff)
-    else:
-        time_tick = int(time_tick / 1024e-6) + 1
-        BI = chr(time_tick & 0xff) + chr((time_tick >> 8) & 0xff)
-    return BI
+        return 0xffff
+    return (int(time_tick / 1024e-6) + 1) & 0xffff
 
 
 def _cal_timestamp():
     """
-    Calculates the timestamp value in packed binary string format
-    :return: timestamp as string of length 6
+    Calculates the value of the Timestamp field
+    :return: timestamp (64-bit)
     """
-    x = int(time.time()) + 1
-    ts = chr(x & 0xff) + chr((x >> 8) & 0xff) + chr((x >> 16) & 0xff) + chr((x >> 24) & 0xff) + \
-         chr((x >> 32) & 0xff) + chr((x >> 40) & 0xff) + chr((x >> 48) & 0xff) + chr((x >> 56) & 0xff)
-    return ts, x
-
-
-def _cal_tx_time(payload_len, encoding, t_sym):
-    """
-    Calculate the duration to transmit a frame
-    :param payload_len: payload length in bytes
-    :param encoding: data rate (int [0, 8))
-    :param t_sym: symbol duration in seconds
-    :return: frame transmission time
-    """
-    assert encoding in range(0, 8)
-
-    N_dbps = [24.0, 36.0, 48.0, 72.0, 96.0, 144.0, 192.0, 216.0]
-
-    # 54 bits (16-bit for SERVICE, 32-bit for CRC and 6-bit for TAIL) need to be included
-    N_sym = int(math.ceil((54 + 8 * payload_len) / N_dbps[encoding]))
-
-    # airtime of frame in microseconds
-    # the additional 2 at the end of this formula is not in the
-    # standard encoding rules but in the annex G reference frame it is there!
-    tx_time = int((5 + N_sym) * t_sym * 1e6) + 2
-    mac_duration = chr((tx_time >> 8) & 0xff) + chr(tx_time & 0xff)
-
-    return tx_time, mac_duration
+    return (int(time.time()) + 1) & 0xffffffffffffffff
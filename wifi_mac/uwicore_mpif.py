@@ -45,7 +45,37 @@
 #	Dr. Javier Gozalvez (j.gozalvez@umh.es)
 
 
-import pickle
+import asyncio
+import mmap
+import os
+import struct
+
+# Wire format of the crosslayer messages: a fixed header followed by the raw payload bytes
+#   type (uint8) | request ID (uint32) | payload length (uint32) | payload
+MSG_HEADER = struct.Struct("!BII")
+MSG_MAX_LEN = 1 << 20  # Larger lengths can only come from a corrupted stream
+
+# Message types (the "HEADER" field of a crosslayer packet) and their code on the wire
+MSG_TYPES = ("CCA", "TAIL", "PKT", "YES", "NO", "BEACON", "no_packet", "remove", "copy", "PAYLOAD",
+             "SUBSCRIBE", "FRAME", "SHM", "PKT_SHM", "ADDR",
+             "PAYLOAD_TO")
+MSG_CODES = dict((name, code) for code, name in enumerate(MSG_TYPES))
+
+# Payload prefix of a "PKT" message: frame type | data rate | MAC timestamp, followed by the MPDU
+FRAME_TYPES = ("DATA", "DATA_FRAG", "DATA_RETX", "RTS", "CTS", "ACK", "BEACON")
+PKT_INFO = struct.Struct("!BBd")
+N_ENCODINGS = 8  # Data rates of the OFDM PHY, 6 to 54 Mbps
+
+# Payload of a "PKT_SHM" message after PKT_INFO: position and length of the MPDU in the shared-memory ring
+SHM_DESCRIPTOR = struct.Struct("!QI")
+
+# Payload of a "PAYLOAD_TO" message (upper layer packet for a given peer): destination MAC address, followed by
+# the packet
+PEER_ADDR_LEN = 6
+
+# Scalar payloads (node ID, sample rate, sensed power)
+INT_VALUE = struct.Struct("!q")
+FLOAT_VALUE = struct.Struct("!d")
 
 
 # Defines the packet format used for crosslayer communication
@@ -53,18 +83,441 @@ def create_packet(header, data):
     return {"HEADER": header, "DATA": data}
 
 
-# Method to send a packet through a socket
-def send_to_mac(sd, pkt):
-    packet = pickle.dumps(pkt, 1)
-    sd.send(packet)
+# Method to convert the DATA field of a crosslayer packet to payload bytes
+def to_bytes(data):
+    if data is None or isinstance(data, (list, tuple)) and len(data) == 0:
+        return b""
+    if isinstance(data, (bytes, bytearray, memoryview)):
+        return bytes(data)
+    if isinstance(data, str):
+        return data.encode("latin-1")
+    if isinstance(data, bool):
+        raise TypeError("Unsupported crosslayer payload %r" % data)
+    if isinstance(data, int):
+        return INT_VALUE.pack(data)
+    if isinstance(data, float):
+        return FLOAT_VALUE.pack(data)
+    raise TypeError("Unsupported crosslayer payload %r" % type(data))
+
+
+# Method to serialize a crosslayer packet into a framed message
+def encode_message(pkt, req_id=0):
+    header = pkt["HEADER"]
+    if header == "PKT":  # MPDU to transmit, as returned by generate_pkt()
+        info = pkt["DATA"]["INFO"]
+        payload = PKT_INFO.pack(FRAME_TYPES.index(pkt["DATA"]["HEADER"]), info["encoding"],
+                                info["timestamp"]) + to_bytes(info["packet"])
+    elif header == "PKT_SHM":  # MPDU already copied to the shared-memory ring, INFO["shm"] locates it
+        info = pkt["DATA"]["INFO"]
+        payload = PKT_INFO.pack(FRAME_TYPES.index(pkt["DATA"]["HEADER"]), info["encoding"],
+                                info["timestamp"]) + SHM_DESCRIPTOR.pack(*info["shm"])
+    else:
+        payload = to_bytes(pkt["DATA"])
+    return MSG_HEADER.pack(MSG_CODES[header], req_id, len(payload)) + payload
+
+
+# Method to rebuild a crosslayer packet from the fields of a framed message
+def decode_message(code, req_id, payload):
+    if code >= len(MSG_TYPES):
+        raise ValueError("Unknown crosslayer message type %d" % code)
+    header = MSG_TYPES[code]
+    if header == "PKT":
+        frame_type, encoding, timestamp = _unpack_pkt_info(payload)
+        info = {"packet": payload[PKT_INFO.size:], "encoding": encoding, "timestamp": timestamp}
+        data = {"HEADER": FRAME_TYPES[frame_type], "INFO": info}
+    elif header == "PKT_SHM":
+        frame_type, encoding, timestamp = _unpack_pkt_info(payload)
+        info = {"shm": SHM_DESCRIPTOR.unpack_from(payload, PKT_INFO.size), "encoding": encoding,
+                "timestamp": timestamp}
+        data = {"HEADER": FRAME_TYPES[frame_type], "INFO": info}
+    else:
+        data = payload
+    return {"HEADER": header, "DATA": data, "ID": req_id}
+
+
+# Method to read the PKT_INFO prefix of a "PKT" or "PKT_SHM" message
+def _unpack_pkt_info(payload):
+    frame_type, encoding, timestamp = PKT_INFO.unpack_from(payload)
+    if encoding >= N_ENCODINGS:
+        raise ValueError("Unknown encoding %d" % encoding)
+    return frame_type, encoding, timestamp
+
+
+# Methods to read the scalar payload of a message
+def decode_int(payload):
+    return INT_VALUE.unpack(payload)[0]
+
+
+def decode_float(payload):
+    return FLOAT_VALUE.unpack(payload)[0]
+
+
+# Method to decode a received message, raising MessageError if it is malformed
+def _decode_received(code, req_id, payload):
+    try:
+        return decode_message(code, req_id, payload)
+    except (ValueError, struct.error, IndexError) as error:
+        raise MessageError(MSG_TYPES[code] if code < len(MSG_TYPES) else None, req_id, str(error))
+
+
+class MessageError(ValueError):
+    """
+    A framed message that can't be decoded (unknown type, truncated PKT prefix, unknown encoding).
+    The framing itself is intact, so the reader can go on with the next message.
+    :param header: message type, None if unknown
+    :param req_id: request ID of the message, to answer it
+    """
+
+    def __init__(self, header, req_id, msg):
+        ValueError.__init__(self, msg)
+        self.header = header
+        self.req_id = req_id
+
+
+class MessageReader:
+    """
+    Streaming reader of framed crosslayer messages.
+    Bytes are received into a reusable buffer and kept until a whole message has
+    arrived, so messages split over several reads (or several messages merged in
+    one read) are reassembled correctly.
+    """
+
+    def __init__(self, sd, bufsize=65536):
+        self.sd = sd
+        self._buf = bytearray(bufsize)
+        self._start = 0  # first byte not consumed yet
+        self._end = 0  # end of the received bytes
+
+    def read(self):
+        """
+        Return the next message, or None if the peer closed the connection
+        """
+        while True:
+            msg = self.next_message()
+            if msg is not None:
+                return msg
+            if not self.fill():
+                return None
+
+    def next_message(self):
+        """
+        Return the next complete message already received, None if there is none
+        """
+        if self._end - self._start < MSG_HEADER.size:
+            return None
+        code, req_id, length = MSG_HEADER.unpack_from(self._buf, self._start)
+        if length > MSG_MAX_LEN:
+            raise ValueError("Crosslayer message too long (%d bytes)" % length)
+        end = self._start + MSG_HEADER.size + length
+        if end > self._end:
+            return None
+        payload = bytes(self._buf[self._start + MSG_HEADER.size:end])
+        self._start = end
+        return _decode_received(code, req_id, payload)
+
+    def fill(self):
+        """
+        Receive more bytes from the socket. Return False if the peer closed the connection
+        """
+        pending = self._end - self._start
+        if self._start > 0:  # move the partial message to the front of the buffer
+            self._buf[:pending] = self._buf[self._start:self._end]
+            self._start, self._end = 0, pending
+        if pending >= MSG_HEADER.size:  # make room for the whole message
+            _, _, length = MSG_HEADER.unpack_from(self._buf)
+            if MSG_HEADER.size + length > len(self._buf):
+                self._buf.extend(bytearray(MSG_HEADER.size + length - len(self._buf)))
+        n = self.sd.recv_into(memoryview(self._buf)[self._end:])
+        self._end += n
+        return n > 0
 
 
-# Method to receive a packet through a socket
+class ShmRing:
+    """
+    Shared-memory ring buffer (mmap) for bulk payloads between the MAC and PHY processes.
+    The writer copies a payload into the ring and only sends its descriptor
+    (position, length) over the socket. The reader copies the payload out and
+    releases its space. Positions are byte counters that only grow, and a payload
+    never wraps around the end of the ring. There is one writer and one reader.
+    :param path: file backing the ring (e.g. under /dev/shm)
+    :param size: capacity in bytes to create the ring (writer), 0 to open an existing one (reader)
+    """
+
+    POSITIONS = struct.Struct("=QQ")  # write position | read position
+    DATA_OFFSET = 64
+
+    def __init__(self, path, size=0):
+        self.path = path
+        self.owner = size > 0
+        flags = os.O_RDWR | (os.O_CREAT | os.O_TRUNC if self.owner else 0)
+        fd = os.open(path, flags, 0o600)
+        try:
+            if self.owner:
+                os.ftruncate(fd, self.DATA_OFFSET + size)
+            self.map = mmap.mmap(fd, 0)
+        finally:
+            os.close(fd)
+        self.capacity = len(self.map) - self.DATA_OFFSET
+
+    def put(self, data):
+        """
+        Copy a payload into the ring (writer side)
+        :return: descriptor (position, length), None if the ring has no room for it
+        """
+        length = len(data)
+        head, tail = self.POSITIONS.unpack_from(self.map)
+        offset = head % self.capacity
+        if offset + length > self.capacity:  # skip the end of the ring
+            head += self.capacity - offset
+            offset = 0
+        if head + length - tail > self.capacity:
+            return None
+        start = self.DATA_OFFSET + offset
+        self.map[start:start + length] = data
+        struct.pack_into("=Q", self.map, 0, head + length)
+        return head, length
+
+    def get(self, position, length):
+        """
+        Copy a payload out of the ring and release its space (reader side)
+        :return: payload bytes
+        """
+        head, tail = self.POSITIONS.unpack_from(self.map)
+        if position < tail or position + length > head or position % self.capacity + length > self.capacity:
+            raise ValueError("Invalid ring descriptor (%d, %d)" % (position, length))
+        start = self.DATA_OFFSET + position % self.capacity
+        data = self.map[start:start + length]
+        struct.pack_into("=Q", self.map, 8, position + length)
+        return data
+
+    def close(self):
+        self.map.close()
+        if self.owner:
+            os.unlink(self.path)
+
+
+class CcaState:
+    """
+    State of the energy detector of the PHY (carrier sensing), written by the PHY and read by the
+    MAC without any request, in the same process or through a shared-memory file.
+    Besides the latest state, a ring keeps the history of the power samples in bins of bin_time:
+    maximum power of the bin, and running totals of the power, of the samples and of the busy
+    samples. sense_window() then summarizes any interval of the history in constant time, except
+    for the maximum which scans the bins of the interval.
+    The record is a seqlock: the writer makes the sequence number odd while it updates it, and a
+    reader retries until it reads the same even number before and after. Neither side takes a lock.
+    Times are time.monotonic_ns() values, a clock shared by the processes of a host.
+    :param path: file backing the record (e.g. under /dev/shm), None for a record of this process only
+    :param create: create the record (writer), otherwise open an existing one (reader)
+    :param history: duration of the history (s, writer only), 0 for no history
+    :param bin_time: duration of a bin of the history (s, writer only)
+    """
+
+    SEQ = struct.Struct("=Q")
+    # time of the last sample | power level | busy flag | start of the current busy period |
+    # start of the current idle period (0: none yet)
+    FIELDS = struct.Struct("=qdQqq")
+    # bin duration (ns) | number of bins | first and last bin written (bin = time // bin duration)
+    RING = struct.Struct("=qqqq")
+    # Columns of the ring (one item per bin): bin, maximum power, running totals of power, samples, busy samples
+    COLUMNS = ("q", "d", "d", "q", "q")
+
+    def __init__(self, path=None, create=False, history=0, bin_time=1e-4):
+        self.path = path
+        self.owner = create and path is not None
+        capacity = int(round(history / bin_time)) if create else 0
+        size = self.SEQ.size + self.FIELDS.size + self.RING.size + 8 * len(self.COLUMNS) * capacity
+        if path is None:
+            self.buf = bytearray(size)
+        else:
+            fd = os.open(path, os.O_RDWR | (os.O_CREAT | os.O_TRUNC if create else 0), 0o600)
+            try:
+                if create:
+                    os.ftruncate(fd, size)
+                self.buf = mmap.mmap(fd, 0)
+            finally:
+                os.close(fd)
+        self._ring_offset = self.SEQ.size + self.FIELDS.size
+        if create:
+            self.RING.pack_into(self.buf, self._ring_offset, int(bin_time * 1e9), capacity, -1, -1)
+        self.bin_ns, self.capacity = self.RING.unpack_from(self.buf, self._ring_offset)[:2]
+        offset = self._ring_offset + self.RING.size
+        self._columns = []
+        with memoryview(self.buf) as view:
+            for code in self.COLUMNS:
+                self._columns.append(view[offset:offset + 8 * self.capacity].cast(code))
+                offset += 8 * self.capacity
+        self._bins, self._max, self._sum, self._count, self._busy = self._columns
+        self._seq = 0
+        self._totals = [0.0, 0, 0]  # running totals of the writer: power, samples, busy samples
+
+    def publish(self, t, level, busy, busy_since, idle_since, bins=()):
+        """
+        Update the record (writer side)
+        :param t: time of the last power sample (ns)
+        :param level: last power level
+        :param busy: True if the power is above the CCA threshold
+        :param busy_since: time the channel turned busy (ns)
+        :param idle_since: time the channel turned idle (ns)
+        :param bins: power samples since the last update, in time order, summarized per bin of the history:
+                     (bin, maximum power, sum of the power, samples, busy samples)
+        :return: none
+        """
+        self.SEQ.pack_into(self.buf, 0, self._seq + 1)  # odd: update in progress
+        self.FIELDS.pack_into(self.buf, self.SEQ.size, t, level, busy, busy_since, idle_since)
+        if self.capacity and bins:
+            self._add_bins(bins)
+        self._seq += 2
+        self.SEQ.pack_into(self.buf, 0, self._seq)
+
+    def _add_bins(self, bins):
+        capacity = self.capacity
+        _, _, first, last = self.RING.unpack_from(self.buf, self._ring_offset)
+        totals = self._totals
+        for bin_id, bin_max, bin_sum, bin_count, bin_busy in bins:
+            if first < 0:
+                first = last = bin_id
+                self._bins[bin_id % capacity] = bin_id
+                self._max[bin_id % capacity] = 0.0
+            elif bin_id > last:  # new bin, the bins without samples in between are empty
+                for empty in range(max(last + 1, bin_id - capacity + 1), bin_id + 1):
+                    i = empty % capacity
+                    self._bins[i] = empty
+                    self._max[i] = 0.0
+                    self._sum[i], self._count[i], self._busy[i] = totals
+                last = bin_id
+            # samples of an older bin (timing jitter of the flowgraph) are added to the last one
+            i = last % capacity
+            totals[0] += bin_sum
+            totals[1] += bin_count
+            totals[2] += bin_busy
+            self._max[i] = max(self._max[i], bin_max)
+            self._sum[i], self._count[i], self._busy[i] = totals
+        self.RING.pack_into(self.buf, self._ring_offset, self.bin_ns, capacity, first, last)
+
+    def read(self):
+        """
+        Consistent copy of the latest state (reader side)
+        :return: time of the last sample (ns), power level, busy flag, busy since (ns), idle since (ns)
+        """
+        while True:
+            seq = self.SEQ.unpack_from(self.buf)[0]
+            if seq & 1:  # the writer is updating the record
+                continue
+            t, level, busy, busy_since, idle_since = self.FIELDS.unpack_from(self.buf, self.SEQ.size)
+            if self.SEQ.unpack_from(self.buf)[0] == seq:
+                return t, level, bool(busy), busy_since, idle_since
+
+    @property
+    def level(self):
+        return self.read()[1]
+
+    @property
+    def busy(self):
+        return self.read()[2]
+
+    def busy_after(self, t):
+        """
+        :param t: time (ns)
+        :return: True if the channel has been busy at some point since t
+        """
+        _, _, busy, _, idle_since = self.read()
+        return busy or idle_since > t
+
+    def sense_window(self, t0, t1):
+        """
+        Summary of the power samples of an interval, from the history (reader side).
+        The interval is rounded to whole bins and clipped to the history available.
+        :param t0: start of the interval (ns)
+        :param t1: end of the interval (ns)
+        :return: maximum power, mean power, fraction of busy samples. None if there is no sample
+        """
+        if not self.capacity:
+            return None
+        while True:
+            seq = self.SEQ.unpack_from(self.buf)[0]
+            if seq & 1:
+                continue
+            result = self._window(t0, t1)
+            if self.SEQ.unpack_from(self.buf)[0] == seq:
+                return result
+
+    def _window(self, t0, t1):
+        capacity = self.capacity
+        _, _, first, last = self.RING.unpack_from(self.buf, self._ring_offset)
+        b0 = max(t0 // self.bin_ns, first, last - capacity + 2)
+        b1 = min(t1 // self.bin_ns, last)
+        if first < 0 or b1 < b0:
+            return None
+        i0, i1 = b0 % capacity, b1 % capacity
+        if b0 > first:  # running totals before the interval
+            before = (b0 - 1) % capacity
+            totals = self._sum[before], self._count[before], self._busy[before]
+        else:
+            totals = 0.0, 0, 0
+        count = self._count[i1] - totals[1]
+        if count <= 0:
+            return None
+        if i0 <= i1:
+            power_max = max(self._max[i0:i1 + 1])
+        else:  # the interval wraps around the end of the ring
+            power_max = max(max(self._max[i0:]), max(self._max[:i1 + 1]))
+        return power_max, (self._sum[i1] - totals[0]) / count, (self._busy[i1] - totals[2]) / count
+
+    def close(self):
+        for column in self._columns:
+            column.release()
+        if self.path is not None:
+            self.buf.close()
+        if self.owner:
+            os.unlink(self.path)
+
+
+# Method to send a packet through a socket. The request ID of a persistent MAC session is echoed back
+def send_to_mac(sd, pkt, req_id=0):
+    sd.sendall(encode_message(pkt, req_id))
+
+
+# Method to receive one packet through a socket (None if the peer closed the connection). Exactly one message
+# is read, the bytes of the following ones stay in the socket; a session with many messages keeps a MessageReader
 def receive_from_mac(sd):
-    pkt = sd.recv(10000)
-    return pickle.loads(pkt)
+    header = _recv_exactly(sd, MSG_HEADER.size)
+    if header is None:
+        return None
+    code, req_id, length = MSG_HEADER.unpack(header)
+    if length > MSG_MAX_LEN:
+        raise ValueError("Crosslayer message too long (%d bytes)" % length)
+    payload = _recv_exactly(sd, length)
+    if payload is None:
+        return None
+    return _decode_received(code, req_id, payload)
+
+
+# Method to receive exactly n bytes through a socket (None if the peer closed the connection first)
+def _recv_exactly(sd, n):
+    buf = bytearray(n)
+    view = memoryview(buf)
+    while view:
+        received = sd.recv_into(view)
+        if received == 0:
+            return None
+        view = view[received:]
+    return bytes(buf)
+
+
+# Method to receive the next message from an asyncio StreamReader (None if the peer closed the connection)
+async def read_message(stream):
+    try:
+        code, req_id, length = MSG_HEADER.unpack(await stream.readexactly(MSG_HEADER.size))
+        if length > MSG_MAX_LEN:
+            raise ValueError("Crosslayer message too long (%d bytes)" % length)
+        payload = await stream.readexactly(length)
+    except asyncio.IncompleteReadError:
+        return None
+    return _decode_received(code, req_id, payload)
 
 
-# Method to create a beacon dictionary with the values that will be used on the Neighbor Beaconing process
+# Method to create a beacon dictionary with the values that will be used on the Neighbor Beaconing process.
+# RSSI and last_seen are the power level and the time of the last beacon received from the neighbour
 def new_beacon():
-    return {"MAC": "", "timestamp": 0, "BI": 0, "OFFSET": 0, "SSID": ""}
+    return {"MAC": "", "timestamp": 0, "BI": 0, "OFFSET": 0, "SSID": "", "RSSI": 0.0, "last_seen": 0}